@@ -1,6 +1,12 @@
 import streamlit as st
 import pandas as pd
 
+from ctar.ingestion import load_uploads, parse_file, upsert_dataset
+from ctar.library import catalog_entries, entry_label, load_entry
+from ctar.perf import perf_panel
+from ctar.schema import memory_report
+from ctar.store import hold_datasets
+
 st.set_page_config(
     page_title="CTAR Analysis",
     page_icon="🌐"
@@ -42,30 +48,132 @@ st.markdown("<br>", unsafe_allow_html=True)
 st.markdown("###### Une application d'analyse des indicateurs de performance des CTAR de Madagascar, à l'initiative de l'Institut Pasteur de Madagascar.")
 
 
-def main():
-    st.markdown("<h3 style='text-align: left; margin-top: 20px;'>1. Téléchargez vos fichiers :</h3>", unsafe_allow_html=True)
+def unique_name(name, taken):
+    # Deux BDD de même nom (versions d'une même entrée, fichier téléchargé homonyme) restent distinctes
+    candidate, number = name, 2
+    while candidate in taken:
+        candidate = f"{name} ({number})"
+        number += 1
+    return candidate
 
-    uploaded_files = st.file_uploader("Sélectionnez les fichiers CSV", type=["csv"], accept_multiple_files=True)
 
-    if uploaded_files:
+def main():
+    st.markdown("<h3 style='text-align: left; margin-top: 20px;'>1. Choisissez ou téléchargez vos fichiers :</h3>", unsafe_allow_html=True)
+
+    # BDD déjà ingérées hors ligne (python -m ctar.library ingest ...) : aucun téléchargement
+    entries = {entry['id']: entry for entry in catalog_entries()}
+    selected_entries = []
+    if entries:
+        selected_entries = st.multiselect("Sélectionnez des BDD de la bibliothèque", options=list(entries),
+                                          format_func=lambda entry_id: entry_label(entries[entry_id]))
+
+    # CSV compressés (gzip, zip) décompressés pendant la lecture ; classeurs Excel lus en flux
+    uploaded_files = st.file_uploader("Sélectionnez les fichiers CSV (ou .csv.gz, .zip, .xlsx)",
+                                      type=["csv", "gz", "zip", "xlsx"], accept_multiple_files=True)
+    append = st.toggle("Mode ajout : fusionner chaque fichier dans la BDD du même type déjà choisie",
+                       help="Extraction mensuelle ajoutée à l'historique sans le retélécharger : un patient (ref_mordu) "
+                            "ou un enregistrement (record_id) déjà présent est remplacé.")
+
+    if uploaded_files or selected_entries:
         dataframes = {}
-
-        for uploaded_file in uploaded_files:
-            try:
-                df = pd.read_csv(uploaded_file, encoding='ISO-8859-1', sep=',')
-                dataframes[uploaded_file.name] = df
-            except UnicodeDecodeError as e:
-                st.error(f"Erreur de décodage pour le fichier {uploaded_file.name}: {e}")
+        datasets = {}
+
+        # BDD de la bibliothèque nommées par leur libellé et leur version (nom de fichier commun aux versions)
+        for entry_id in selected_entries:
+            name = unique_name(entry_label(entries[entry_id]), datasets)
+            datasets[name] = load_entry(entries[entry_id])
+            dataframes[name] = datasets[name].frame
+
+        # Parsing en parallèle, mis en cache selon l'empreinte du contenu de chaque fichier
+        uploaded_files = uploaded_files or []
+        loaded = []
+        uploaded_names = {}
+        if uploaded_files:
+            status = st.status(f"Lecture des fichiers : 0/{len(uploaded_files)}")
+            read = []
+
+            def on_done(uploaded_file, result):
+                read.append(uploaded_file.name)
+                status.update(label=f"Lecture des fichiers : {len(read)}/{len(uploaded_files)}")
+                if isinstance(result, Exception):
+                    status.write(f"{uploaded_file.name} : erreur")
+                else:
+                    # Encodage et séparateur détectés sur le début du fichier (CSV seulement)
+                    dialect = f" ({result.dialect})" if result.dialect else ""
+                    status.write(f"{uploaded_file.name} : {len(result.frame)} lignes{dialect}")
+
+            loaded = load_uploads(uploaded_files, on_done)
+            failed = any(isinstance(result, Exception) for _, result in loaded)
+            status.update(label=f"{len(uploaded_files)} fichier(s) lu(s)", state='error' if failed else 'complete')
+
+        # Résultats dans l'ordre des fichiers téléchargés, quel que soit l'ordre de fin de lecture
+        for uploaded_file, dataset in loaded:
+            if isinstance(dataset, UnicodeDecodeError):
+                st.error(f"Erreur de décodage pour le fichier {uploaded_file.name}: {dataset}")
                 continue
-
-        st.session_state['dataframes'] = dataframes
-
-        st.header(f"Contenu du fichier: {list(dataframes.keys())[0]}")
-        st.dataframe(df.head())
+            if isinstance(dataset, Exception):
+                st.error(f"Erreur de lecture pour le fichier {uploaded_file.name}: {dataset}")
+                continue
+            name = unique_name(uploaded_file.name, datasets)
+            uploaded_names[name] = uploaded_file
+            datasets[name] = dataset
+            dataframes[name] = dataset.frame
+            # Mode ajout : upsert dans la première BDD du même type, structures dérivées mises à jour
+            base_name = next((other for other, base in datasets.items() if other != name
+                              and base.schema_name and base.schema_name == dataset.schema_name), None)
+            if append and base_name:
+                try:
+                    merged = upsert_dataset(datasets[base_name], dataset)
+                except (ValueError, TypeError) as e:  # BDD incompatibles ou colonnes non fusionnables
+                    st.error(str(e))
+                    continue
+                del datasets[name], dataframes[name]
+                st.caption(f"{name} fusionné dans {base_name} : {len(dataset.frame)} lignes, "
+                           f"{len(merged.frame)} lignes au total.")
+                datasets[base_name] = merged
+                dataframes[base_name] = merged.frame
+                continue
+            # Type de BDD reconnu à l'en-tête, quel que soit le nom du fichier
+            if dataset.schema_name is None:
+                st.warning(f"{name} : colonnes non reconnues (ni BDD IPM ni BDD périphérique), "
+                           "le fichier ne sera pas analysé par les pages.")
+
+        # La session ne garde que des poignées : un même fichier est partagé par toutes les sessions
+        hold_datasets(datasets)
+
+        # Aperçu du premier fichier lu (aucun si tous les fichiers sont en erreur)
+        if dataframes:
+            preview_name = next(iter(dataframes))
+            st.header(f"Contenu du fichier: {preview_name}")
+            st.dataframe(dataframes[preview_name].head())
+
+        # Empreinte mémoire avant/après typage des colonnes (relit le fichier sans schéma)
+        with st.expander("Rapport mémoire par colonne"):
+            report_file = st.selectbox("Fichier", options=[name for name in uploaded_names
+                                                           if name in datasets and datasets[name].schema_name])
+            if report_file and st.button("Calculer le rapport mémoire"):
+                uploaded_file = uploaded_names[report_file]
+                # Dialecte détecté au chargement : le fichier n'est pas réexaminé
+                raw = parse_file(uploaded_file.getvalue(), dialect=datasets[report_file].dialect)
+                st.dataframe(memory_report(raw, dataframes[report_file]))
+
+        # Valeurs modifiées par les règles de ctar.corrections au chargement des fichiers
+        corrected = {name: dataset.corrections for name, dataset in datasets.items()
+                     if dataset.corrections is not None and not dataset.corrections.empty}
+        if corrected:
+            with st.expander("Corrections appliquées"):
+                for name, corrections in corrected.items():
+                    st.caption(f"{name} : {int(corrections['appliquée'].sum())} valeur(s) corrigée(s)")
+                    ignored = int((~corrections['appliquée'].astype(bool)).sum())
+                    if ignored:
+                        st.warning(f"{name} : {ignored} correction(s) ignorée(s), valeur actuelle différente de "
+                                   "celle attendue par la règle (identifiant d'enregistrement à vérifier).")
+                    st.dataframe(corrections, hide_index=True)
 
 
     else:
-        st.warning("Veuillez télécharger au moins un fichier CSV.")
+        st.warning("Veuillez sélectionner une BDD de la bibliothèque ou télécharger au moins un fichier CSV."
+                   if entries else "Veuillez télécharger au moins un fichier CSV.")
 
 
 if __name__ == '__main__':
@@ -78,3 +186,5 @@ st.write("IPM © 2024")
 
 with st.sidebar.container():
     st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
+
+perf_panel('Accueil')
@@ -0,0 +1,150 @@
+"""Générateur de BDD CTAR synthétiques (IPM et périphériques) pour les benchmarks.
+
+    python -m bench.generate --scale 10 --output /tmp/ctar-bench
+
+Les colonnes et les valeurs reprennent celles des exports nettoyés réels ;
+l'échelle 1 correspond à la taille actuelle de la BDD nationale.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from ctar.ingestion import CSV_ENCODING
+
+# Nombre de lignes à l'échelle 1
+BASE_ROWS = {'ipm': 20000, 'peripheral': 30000}
+
+FILE_NAMES = {
+    'ipm': 'CTAR_ipmdata20022024_cleaned.csv',
+    'peripheral': 'CTAR_peripheriquedata20022024_cleaned.csv',
+}
+
+CTARS = [
+    'Antsohihy', 'Morondava', 'Vangaindrano', 'Fianarantsoa', 'Toamasina', 'Mahajanga', 'Antsiranana',
+    'Toliara', 'Ambositra', 'Moramanga', 'Manakara', 'Farafangana', 'Maintirano', 'Sambava',
+    'Ambatondrazaka', 'Fort-Dauphin', 'Miarinarivo', 'Antsirabe',
+]
+
+IPM_BODY_COLUMNS = ['tet_cont', 'm_sup_cont', 'ext_s_cont', 'm_inf_cont', 'ext_i_cont', 'abdo_cont', 'dos_cont', 'geni_cont']
+IPM_LESION_COLUMNS = ['nbtet', 'nb_sup', 'nb_extr_s', 'nb_inf', 'nb_extr_i', 'nb_abdo', 'nb_dos', 'nb_genit']
+# Probabilité qu'une partie du corps soit touchée (mains et jambes le plus souvent)
+BODY_PART_RATES = [0.06, 0.12, 0.25, 0.35, 0.2, 0.03, 0.04, 0.01]
+PERIPHERAL_BODY_FLAGS = [1, 2, 3, 4, 5, 6, 7, 9]
+
+
+def _choice(rng, values, weights, n):
+    weights = np.asarray(weights, dtype=float)
+    return rng.choice(np.array(values, dtype=object), size=n, p=weights / weights.sum())
+
+
+def _ages(rng, n):
+    # Beaucoup d'enfants mordus : distribution exponentielle tronquée
+    return np.minimum(rng.exponential(18, n), 95).astype(int)
+
+
+def _dates(rng, n, start, end):
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    return start + pd.to_timedelta(rng.integers(0, (end - start).days, n), unit='D')
+
+
+def _hours(rng, n):
+    # Morsures surtout l'après-midi ; '00:00' = heure inconnue dans les exports
+    hours = np.clip(rng.normal(14, 4, n), 0, 23).astype(int)
+    minutes = rng.integers(0, 60, n)
+    text = np.char.add(np.char.add(np.char.zfill(hours.astype(str), 2), ':'), np.char.zfill(minutes.astype(str), 2))
+    text = text.astype(object)
+    text[rng.random(n) < 0.08] = '00:00'
+    text[rng.random(n) < 0.03] = np.nan
+    return text
+
+
+def generate_peripheral(n, rng):
+    dates = _dates(rng, n, '2017-01-01', '2025-03-01')
+    ctar_weights = rng.dirichlet(np.full(len(CTARS), 2.0))
+    id_ctar = _choice(rng, CTARS, ctar_weights, n)
+    id_ctar[rng.random(n) < 0.02] = np.nan
+
+    df = pd.DataFrame({
+        'record_id': np.arange(1, n + 1),
+        'id_ctar': id_ctar,
+        'ctar': id_ctar.copy(),
+        'date_de_consultation': dates.strftime('%Y-%m-%d'),
+        'age': _ages(rng, n),
+        'sexe': _choice(rng, ['M', 'F', np.nan], [0.52, 0.47, 0.01], n),
+        'espece': _choice(rng, ['Chien', 'Chat', 'Autre', np.nan], [0.8, 0.12, 0.06, 0.02], n),
+        'dev_carac': _choice(
+            rng,
+            ['Domestique-Vivant', 'Errant-Vivant', 'Errant-Disparu', 'Domestique-Disparu', 'Domestique-Mort', 'Sauvage-nan', 'nan-nan'],
+            [0.45, 0.2, 0.15, 0.08, 0.04, 0.03, 0.05], n),
+        'lavage_savon': _choice(rng, ['OUI', 'NON', '0', 'Non rempli'], [0.55, 0.25, 0.1, 0.1], n),
+        'heure_du_contact_cleaned': _hours(rng, n),
+        'nb_lesion': _choice(rng, ['1', '2', '3', '4', '5', '01', '02', '052', np.nan], [40, 25, 12, 6, 3, 2, 1, 0.1, 10], n),
+    })
+    # Un identifiant CTAR manquant est parfois renseigné dans 'ctar' seulement
+    df.loc[df['id_ctar'].isna(), 'ctar'] = np.nan
+
+    for flag, rate in zip(PERIPHERAL_BODY_FLAGS, BODY_PART_RATES):
+        df[f'singes_des_legions___{flag}'] = (rng.random(n) < rate).astype('int8')
+    for contact, rate in zip(range(1, 6), [0.15, 0.1, 0.1, 0.05, 0.6]):
+        df[f'type_contact___{contact}'] = (rng.random(n) < rate).astype('int8')
+    return df
+
+
+def generate_ipm(n, rng):
+    # Plusieurs visites par patient (protocole de vaccination J0, J3, J7)
+    patients = max(n // 3, 1)
+    ref = rng.integers(0, patients, n)
+    first_visit = _dates(rng, patients, '2019-01-01', '2024-12-31')
+    dates = first_visit[ref] + pd.to_timedelta(rng.choice([0, 3, 7, 28], n), unit='D')
+
+    df = pd.DataFrame({
+        'ref_mordu': np.char.add('M', np.char.zfill(ref.astype(str), 7)),
+        'dat_consu': dates.strftime('%d/%m/%Y'),
+        'mois': dates.month,
+        'Annee': dates.year,
+        'age': _ages(rng, patients)[ref],
+        'sexe': _choice(rng, ['M', 'F', np.nan], [0.52, 0.47, 0.01], patients)[ref],
+        'animal': _choice(rng, ['Chien', 'Chat', 'Singe', 'Rat', 'Autre'], [0.8, 0.12, 0.02, 0.04, 0.02], patients)[ref],
+        'typanim': _choice(rng, list('ABCDEFG'), [0.02, 0.15, 0.2, 0.45, 0.08, 0.05, 0.05], patients)[ref],
+        'savon': _choice(rng, ['OUI', 'NON', np.nan], [0.6, 0.3, 0.1], patients)[ref],
+    })
+    for body, lesions, rate in zip(IPM_BODY_COLUMNS, IPM_LESION_COLUMNS, BODY_PART_RATES):
+        touched = rng.random(patients) < rate
+        contact = _choice(rng, ['MT', 'LPS', 'GRIF', 'LPL'], [0.6, 0.15, 0.15, 0.1], patients)
+        contact[~touched] = np.nan
+        count = np.where(touched, rng.integers(1, 4, patients), np.nan)
+        df[body] = contact[ref]
+        df[lesions] = count[ref]
+    return df.sort_values('dat_consu', kind='stable', key=lambda s: pd.to_datetime(s, format='%d/%m/%Y')).reset_index(drop=True)
+
+
+def generate(kind, scale=1, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = int(BASE_ROWS[kind] * scale)
+    return generate_ipm(rows, rng) if kind == 'ipm' else generate_peripheral(rows, rng)
+
+
+def write_datasets(directory, scale=1, seed=0):
+    # Écrit les deux BDD sous leurs noms d'export réels ; renvoie {type: chemin}
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for kind, file_name in FILE_NAMES.items():
+        paths[kind] = os.path.join(directory, file_name)
+        generate(kind, scale, seed).to_csv(paths[kind], index=False, encoding=CSV_ENCODING)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Génère des BDD CTAR synthétiques.')
+    parser.add_argument('--scale', type=float, default=1, help='multiple de la taille de la BDD nationale (1, 10, 100, ...)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='.', help='dossier de sortie')
+    args = parser.parse_args()
+    for kind, path in write_datasets(args.output, args.scale, args.seed).items():
+        print(f'{kind}: {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Benchmark headless de l'ingestion et des fonctions de calcul des pages.
+
+    python -m bench.run --scale 1 10 100 --repeat 3
+
+Pour chaque échelle, les BDD synthétiques sont générées, lues, puis chaque
+fonction de page est chronométrée sur la sélection la plus large (tous les
+CTARs, toutes les années) :
+  - 'cold' : fichier fraîchement chargé, structures dérivées (cubes, vues) à construire
+  - 'warm' : structures dérivées déjà en cache
+Les résultats sont écrits en JSON pour suivre les régressions dans le temps.
+"""
+import argparse
+import ast
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import plotly
+from streamlit import config
+from streamlit.logger import set_log_level
+
+from bench.generate import FILE_NAMES, write_datasets
+from ctar.contacts import contact_counts, ipm_contact_cube, peripheral_contact_cube
+from ctar.cube import cube_array, cube_slice, ipm_cube, peripheral_cube
+from ctar.ingestion import Dataset, content_hash, parse_csv, read_header
+from ctar.prepare import ipm_patients, patient_view, prepared_peripheral
+from ctar.schema import detect_schema
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES_DIR = os.path.join(ROOT, 'pages')
+
+
+def _hourly_counts(dataset):
+    cube = peripheral_cube(dataset, ['heure_inconnue', 'heure', 'jour', 'sexe', 'espece'])
+    return cube_slice(cube, ['heure', 'jour', 'sexe', 'espece'], heure_inconnue=[False])
+
+
+def _animals(counts, level):
+    # Animaux du plus fréquent au moins fréquent, comme les choix proposés par la page
+    return counts.groupby(level=level, observed=True).sum().sort_values(ascending=False).index.tolist()
+
+
+def _animal_counts(ds, kind):
+    if kind == 'ipm':
+        counts = ipm_cube(ds, ['animal', 'typanim'])
+        return counts, _animals(counts, 'animal')
+    counts = cube_slice(peripheral_cube(ds, ['espece', 'dev_carac']), ['espece', 'dev_carac'])
+    return counts, _animals(counts, 'espece')
+
+
+def _lifestyle_args(ds, kind):
+    # Animal sélectionné par défaut : le plus fréquent
+    counts, animals = _animal_counts(ds, kind)
+    return counts, animals[0]
+
+
+def _species_args(ds, kind):
+    # Animaux sélectionnés par défaut : les quatre plus fréquents
+    counts, animals = _animal_counts(ds, kind)
+    return counts, animals[:4]
+
+
+# (page, BDD, fonction, arguments construits comme dans le code principal de la page)
+CASES = [
+    ('Age et Sexe', 'ipm', 'age_sexe', lambda ds: (ipm_cube(ds, ['age', 'sexe']),)),
+    ('Age et Sexe', 'peripheral', 'age_sexe',
+     lambda ds: (cube_slice(peripheral_cube(ds, ['age', 'sexe']), ['age', 'sexe']),)),
+    ('Animal mordant et mode de vie', 'ipm', 'anim_mord', lambda ds: _lifestyle_args(ds, 'ipm')),
+    ('Animal mordant et mode de vie', 'ipm', 'anim_mord_species', lambda ds: _species_args(ds, 'ipm')),
+    ('Animal mordant et mode de vie', 'peripheral', 'anim_mord_perif', lambda ds: _lifestyle_args(ds, 'peripheral')),
+    ('Animal mordant et mode de vie', 'peripheral', 'anim_mord_perif_species', lambda ds: _species_args(ds, 'peripheral')),
+    ('Exposition catégorie1', 'ipm', 'plot_cat1_ipm',
+     lambda ds: (contact_counts(ipm_contact_cube(ds, ['Body Part', 'Age Group']), 'LPS', ['Body Part', 'Age Group']),)),
+    ('Exposition catégorie1', 'peripheral', 'plot_cat1_peripheral',
+     lambda ds: (contact_counts(peripheral_contact_cube(ds, ['Body Part', 'Age Group']), 'LPS', ['Body Part', 'Age Group']),)),
+    ('Heure de morsure', 'peripheral', 'plot_hourly_sex_counts', lambda ds: (_hourly_counts(ds),)),
+    ('Heure de morsure', 'peripheral', 'plot_hourly_species_counts', lambda ds: (_hourly_counts(ds),)),
+    ('Heure de morsure', 'peripheral', 'plot_hourly_weekday_heatmap', lambda ds: (_hourly_counts(ds),)),
+    ('Lésion', 'ipm', 'plot_cat1_ipm', lambda ds: (ipm_patients(ds),)),
+    ('Lésion', 'peripheral', 'plot_cat1_peripheral',
+     lambda ds: (cube_slice(peripheral_cube(ds, ['nb_lesion']), ['nb_lesion']),)),
+    ('Morsure Transdermique', 'ipm', 'plot_MT_ipm',
+     lambda ds: (ipm_contact_cube(ds, ['Body Part', 'sexe', 'typanim', 'Age Group']),)),
+    ('Morsure Transdermique', 'ipm', 'plot_MT_ipm_animal',
+     lambda ds: (ipm_contact_cube(ds, ['Body Part', 'sexe', 'typanim', 'Age Group']),)),
+    ('Morsure Transdermique', 'peripheral', 'plot_MT_peripheral',
+     lambda ds: (peripheral_contact_cube(ds, ['Body Part', 'sexe', 'dev_carac', 'Age Group']),)),
+    ('Morsure Transdermique', 'peripheral', 'plot_MT_peripheral_animal',
+     lambda ds: (peripheral_contact_cube(ds, ['Body Part', 'sexe', 'dev_carac', 'Age Group']),)),
+    ('Saison de morsure', 'ipm', 'plot_saison_morsure_ipm',
+     lambda ds: (cube_array(ipm_cube(ds, ['Annee', 'sexe', 'mois']), ['Annee', 'sexe', 'mois']),)),
+    ('Saison de morsure', 'peripheral', 'plot_saison_peripheral',
+     lambda ds: (cube_array(peripheral_cube(ds, ['mois', 'sexe']), ['id_ctar', 'Annee', 'sexe', 'mois']),)),
+    ('Utilisation savon sur plaie', 'ipm', 'plot_age_sex_savon_distribution',
+     lambda ds: (ipm_cube(ds, ['age', 'sexe', 'savon']),)),
+    ('Utilisation savon sur plaie', 'peripheral', 'plot_peripheral_data',
+     lambda ds: (cube_slice(peripheral_cube(ds, ['age', 'sexe', 'lavage_savon']), ['age', 'sexe', 'lavage_savon']),)),
+]
+
+# Structures dérivées construites par les pages, chronométrées à part
+PREPARE = {
+    'ipm': ('patient_view', patient_view),
+    'peripheral': ('prepare_peripheral', prepared_peripheral),
+}
+
+
+def page_functions(page):
+    # Imports, constantes et fonctions de la page seulement : le code principal (widgets) n'est pas exécuté
+    path = os.path.join(PAGES_DIR, f'PATIENT-{page}.py')
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    tree.body = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom, ast.Assign, ast.FunctionDef))]
+    namespace = {'__name__': 'bench_page'}
+    exec(compile(tree, path, 'exec'), namespace)
+    return namespace
+
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _median_times(func, repeat):
+    return statistics.median(_timed(func) for _ in range(repeat))
+
+
+def bench_scale(scale, repeat, seed, directory):
+    paths = write_datasets(directory, scale, seed)
+    results = []
+
+    def record(kind, stage, name, rows, cold, warm=None, page=None):
+        results.append({
+            'scale': scale, 'dataset': kind, 'rows': rows, 'stage': stage, 'page': page,
+            'function': name, 'cold_s': round(cold, 6), 'warm_s': None if warm is None else round(warm, 6),
+        })
+
+    datasets = {}
+    for kind, path in paths.items():
+        with open(path, 'rb') as f:
+            data = f.read()
+        schema = detect_schema(read_header(data))
+        frame = parse_csv(data, schema)
+        rows = len(frame)
+        record(kind, 'ingestion', 'parse_csv', rows, _median_times(lambda: parse_csv(data, schema), repeat))
+        key = content_hash(data)
+        datasets[kind] = (key, frame, rows)
+
+        name, prepare = PREPARE[kind]
+        fresh = lambda: prepare(Dataset(key, FILE_NAMES[kind], frame))
+        record(kind, 'prepare', name, rows, _median_times(fresh, repeat))
+
+    functions = {}
+    for page, kind, name, arguments in CASES:
+        if page not in functions:
+            functions[page] = page_functions(page)
+        func = functions[page][name]
+        key, frame, rows = datasets[kind]
+
+        def cold():
+            func(*arguments(Dataset(key, FILE_NAMES[kind], frame)))
+
+        warm_dataset = Dataset(key, FILE_NAMES[kind], frame)
+        func(*arguments(warm_dataset))
+        record(kind, 'page', name, rows, _median_times(cold, repeat),
+               _median_times(lambda: func(*arguments(warm_dataset)), repeat), page=page)
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de l'ingestion et des pages CTAR.")
+    parser.add_argument('--scale', type=float, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=3, help='mesures par fonction (médiane)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='fichier JSON (par défaut bench/results/<date>.json)')
+    args = parser.parse_args()
+
+    # Les fonctions des pages appellent st.* hors d'une session Streamlit : la configuration
+    # est lue avant de baisser le niveau de log, sinon elle le rétablit au premier appel
+    config.get_config_options()
+    set_log_level('error')
+
+    started = datetime.now(timezone.utc)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scale:
+            for result in bench_scale(scale, args.repeat, args.seed, directory):
+                results.append(result)
+                page = f"{result['page']} / " if result['page'] else ''
+                print(f"x{scale:g} {result['dataset']:<10} {page + result['function']:<64} "
+                      f"cold {result['cold_s']:.3f}s" + (f" warm {result['warm_s']:.3f}s" if result['warm_s'] is not None else ''))
+
+    report = {
+        'started': started.isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'plotly': plotly.__version__,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'results': results,
+    }
+    output = args.output or os.path.join(ROOT, 'bench', 'results', started.strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f'Résultats : {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Cache LRU borné par une taille totale en octets (partagé entre sessions)."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            # L'entrée devient la plus récemment utilisée
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self._total -= self._sizes.pop(key)
+                del self._entries[key]
+            # Une entrée plus grande que le budget n'est jamais conservée
+            if nbytes > self.max_bytes:
+                return value
+            self._entries[key] = value
+            self._sizes[key] = nbytes
+            self._total += nbytes
+            # Évincer les entrées les moins récemment utilisées
+            while self._total > self.max_bytes:
+                old_key, _ = self._entries.popitem(last=False)
+                self._total -= self._sizes.pop(old_key)
+            return value
+
+    def pop(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._total -= self._sizes.pop(key)
+            return self._entries.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total
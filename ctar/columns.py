@@ -0,0 +1,39 @@
+import ast
+import glob
+import os
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pages')
+
+_needed = {}
+
+
+def _declared(path):
+    # Constante COLUMNS de la page ({schéma: [colonnes]}), évaluée avec les seuls imports de la page :
+    # le code des widgets n'est pas exécuté. None si la page ne déclare rien.
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    body = [node for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom))
+            or (isinstance(node, ast.Assign) and any(getattr(t, 'id', None) == 'COLUMNS' for t in node.targets))]
+    if not any(isinstance(node, ast.Assign) for node in body):
+        return None
+    namespace = {}
+    exec(compile(ast.Module(body=body, type_ignores=[]), path, 'exec'), namespace)
+    return namespace['COLUMNS']
+
+
+def needed_columns(schema):
+    """Colonnes à lire pour une BDD : colonnes obligatoires, clé d'upsert et union des déclarations des pages.
+
+    None (toutes les colonnes) si une page installée ne déclare pas ses colonnes.
+    """
+    name = schema['name']
+    if name not in _needed:
+        declared = [_declared(path) for path in sorted(glob.glob(os.path.join(PAGES_DIR, '*.py')))]
+        if not declared or any(columns is None for columns in declared):
+            _needed[name] = None
+        else:
+            columns = set(schema['required']) | {schema['record_key']}
+            for page_columns in declared:
+                columns.update(page_columns.get(name, ()))
+            _needed[name] = frozenset(columns)
+    return _needed[name]
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+
+from ctar.cube import FILTER_DIMS, build_cube, cube_slice, update_cube
+from ctar.prepare import patient_changes, patient_view, peripheral_frame, prepare_peripheral
+
+# Parties du corps (libellé de la légende -> colonne)
+# IPM : la colonne contient le type de contact ('MT', 'LPS', ...)
+IPM_BODY_PARTS = {
+    'Tête': 'tet_cont',
+    'Bras et avant-bras': 'm_sup_cont',
+    'Main': 'ext_s_cont',
+    'Cuisse et Jambe': 'm_inf_cont',
+    'Pied': 'ext_i_cont',
+    'Abdomen': 'abdo_cont',
+    'Dos': 'dos_cont',
+    'Parties génitales': 'geni_cont',
+}
+
+# Périphériques : une case à cocher par partie du corps et par type de contact
+PERIPHERAL_BODY_PARTS = {
+    'Tête et Cou': 'singes_des_legions___1',
+    'Bras et Avant-bras': 'singes_des_legions___2',
+    'Main': 'singes_des_legions___3',
+    'Cuisse et Jambe': 'singes_des_legions___4',
+    'Pied': 'singes_des_legions___5',
+    'Autres': 'singes_des_legions___9',
+    'Dos et Torse': 'singes_des_legions___6',
+    'Parties génitales': 'singes_des_legions___7',
+}
+PERIPHERAL_CONTACT_TYPES = {
+    'LPS': 'type_contact___1',
+    'MT': 'type_contact___5',
+}
+
+# Dimensions conservées pour chaque contact
+IPM_CONTACT_KEYS = ('sexe', 'Age Group', 'typanim')
+PERIPHERAL_CONTACT_KEYS = FILTER_DIMS + ('sexe', 'Age Group', 'dev_carac')
+
+# Colonnes lues par les cubes de contacts, à déclarer par les pages qui les utilisent
+CONTACT_COLUMNS = {
+    'ipm': list(IPM_BODY_PARTS.values()) + list(IPM_CONTACT_KEYS),
+    'peripheral': list(PERIPHERAL_BODY_PARTS.values()) + list(PERIPHERAL_CONTACT_TYPES.values())
+    + list(PERIPHERAL_CONTACT_KEYS),
+}
+
+
+def _is_checked(series):
+    # Case cochée : 1 (export brut REDCap) ou 'OUI' (export avec libellés)
+    return series.astype(str).isin(['1', '1.0', 'OUI']).to_numpy()
+
+
+def melt_contacts(frame, body_parts, contact_types=None, keys=()):
+    # Une ligne par (consultation, partie du corps, type de contact), en un seul passage
+    pieces = []
+    checked = {contact: _is_checked(frame[column]) for contact, column in (contact_types or {}).items()}
+    for code, column in enumerate(body_parts.values()):
+        if contact_types is None:
+            values = frame[column].astype(object).to_numpy()
+            hit = pd.notna(values)
+            pieces.append((np.flatnonzero(hit), code, values[hit]))
+        else:
+            touched = _is_checked(frame[column])
+            for contact, yes in checked.items():
+                hit = np.flatnonzero(touched & yes)
+                pieces.append((hit, code, np.full(len(hit), contact, dtype=object)))
+
+    rows = np.concatenate([hit for hit, _, _ in pieces])
+    parts = np.concatenate([np.full(len(hit), code, dtype='int8') for hit, code, _ in pieces])
+    long = frame[list(keys)].iloc[rows].reset_index(drop=True)
+    long['Body Part'] = pd.Categorical.from_codes(parts, categories=list(body_parts))
+    long['Contact'] = pd.Categorical(np.concatenate([contacts for _, _, contacts in pieces]))
+    return long
+
+
+def _peripheral_contacts(frame):
+    return melt_contacts(frame, PERIPHERAL_BODY_PARTS, PERIPHERAL_CONTACT_TYPES, keys=PERIPHERAL_CONTACT_KEYS)
+
+
+def _ipm_contacts(patients):
+    return melt_contacts(patients, IPM_BODY_PARTS, keys=IPM_CONTACT_KEYS)
+
+
+def peripheral_contact_cube(dataset, dims):
+    dims = tuple(dims)
+
+    def build(_):
+        long = dataset.derived(('contacts', 'peripheral'), lambda _: _peripheral_contacts(peripheral_frame(dataset)))
+        return build_cube(long, FILTER_DIMS + ('Contact',) + dims)
+
+    def update(cube, change):
+        removed, added = change.derived('peripheral', prepare_peripheral)
+        return update_cube(cube, _peripheral_contacts(removed), _peripheral_contacts(added))
+
+    return dataset.derived(('contact_cube', 'peripheral') + dims, build, update)
+
+
+def ipm_contact_cube(dataset, dims):
+    dims = tuple(dims)
+
+    def build(_):
+        long = dataset.derived(('contacts', 'ipm'), lambda _: _ipm_contacts(patient_view(dataset).patients))
+        return build_cube(long, ('Contact',) + dims)
+
+    def update(cube, change):
+        removed, added = patient_changes(change)
+        return update_cube(cube, _ipm_contacts(removed), _ipm_contacts(added))
+
+    return dataset.derived(('contact_cube', 'ipm') + dims, build, update)
+
+
+def contact_counts(cube, contact, by, **filters):
+    # Nombre de contacts d'une catégorie ('MT', 'LPS', ...) par clés `by`, sans ligne vide
+    counts = cube_slice(cube, by, Contact=[contact], **filters).reset_index(name='count')
+    counts = counts.dropna(subset=list(by))
+    return counts[counts['count'] > 0].reset_index(drop=True)
@@ -0,0 +1,156 @@
+import numpy as np
+import pandas as pd
+
+from ctar.schema import apply_schema, column_kinds
+
+# Corrections de saisie, appliquées une fois au chargement d'une BDD (et non à chaque affichage).
+# Chaque règle vise une colonne d'un schéma et sélectionne les valeurs à corriger :
+#   'records' : {identifiant de l'enregistrement (clé 'record_key' du schéma): (valeur attendue, valeur corrigée)} ;
+#               la valeur attendue est celle de la colonne 'check' (par défaut la colonne corrigée).
+#               Un enregistrement qui ne l'a pas est laissé tel quel et signalé dans le journal.
+#   'pattern' / 'replace' : expression régulière appliquée aux valeurs texte
+#   'integer' : valeurs qui ne sont toujours pas des entiers remplacées par une valeur manquante
+# La colonne corrigée est ensuite retypée selon le schéma (ex. 'nb_lesion' en entier).
+RULES = [
+    {
+        'schema': 'peripheral',
+        'column': 'nb_lesion',
+        # Lue en entier, la colonne est déjà nettoyée ('052' -> 52) ; la règle sert quand une
+        # valeur non numérique la garde en catégorie
+        'pattern': r'^0+(?=\d)',
+        'replace': '',
+        'reason': "Zéros en tête du nombre de lésions ('052' -> '52')",
+    },
+    {
+        'schema': 'peripheral',
+        'column': 'nb_lesion',
+        # Après les règles précédentes : une valeur comme 'plusieurs' ne doit pas laisser la
+        # colonne en catégorie, les pages attendent un entier
+        'integer': True,
+        'reason': 'Nombre de lésions non numérique remplacé par une valeur manquante',
+    },
+    {
+        'schema': 'peripheral',
+        'column': 'ctar',
+        # Lignes 26659, 36582, 38479, 42574 et 42575 de l'export du 20/02/2024 (record_id supposé = ligne + 1) :
+        # le nom n'est corrigé que si l'identifiant 'id_ctar' de l'enregistrement est bien ce CTAR
+        'check': 'id_ctar',
+        'records': {
+            26660: ('Antsohihy', 'Antsohihy'),
+            36583: ('Morondava', 'Morondava'),
+            38480: ('Vangaindrano', 'Vangaindrano'),
+            42575: ('Fianarantsoa', 'Fianarantsoa'),
+            42576: ('Fianarantsoa', 'Fianarantsoa'),
+        },
+        'reason': 'Nom du CTAR corrigé',
+    },
+]
+
+AUDIT_COLUMNS = ['règle', 'colonne', 'enregistrement', 'avant', 'après', 'appliquée']
+
+
+def _is_text(series):
+    return isinstance(series.dtype, pd.CategoricalDtype) or not pd.api.types.is_numeric_dtype(series.dtype)
+
+
+def _corrected(series, keys, rule):
+    # Valeurs corrigées (index des lignes concernées) pour une règle
+    if 'records' in rule:
+        records = pd.Series({key: corrected for key, (_, corrected) in rule['records'].items()})
+        selected = keys.isin(records.index)
+        return keys[selected].map(records)
+    if rule.get('integer'):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Catégories converties une fois, reportées sur les lignes par leur code
+            numbers = pd.to_numeric(pd.Series(series.cat.categories.astype(str)), errors='coerce')
+            invalid = np.flatnonzero((numbers.isna() | (numbers != numbers.round())).to_numpy())
+            selected = np.isin(series.cat.codes.to_numpy(), invalid)
+        else:
+            numbers = pd.to_numeric(series, errors='coerce')
+            selected = (series.notna() & (numbers.isna() | (numbers != numbers.round()))).to_numpy()
+        return pd.Series(np.nan, index=series.index[selected], dtype=object)
+    if not _is_text(series):
+        return series.iloc[:0]
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Expression appliquée aux seules catégories, puis reportée sur les lignes par leur code
+        categories = series.cat.categories.astype(str)
+        replaced = categories.str.replace(rule['pattern'], rule['replace'], regex=True)
+        changed = np.flatnonzero(replaced != categories)
+        selected = np.isin(series.cat.codes.to_numpy(), changed)
+        codes = series.cat.codes.to_numpy()[selected]
+        return pd.Series(replaced[codes], index=series.index[selected])
+    text = series.dropna().astype(str)
+    replaced = text.str.replace(rule['pattern'], rule['replace'], regex=True)
+    return replaced[replaced != text]
+
+
+def _expected_records(frame, columns, keys, values, rule, audits):
+    # Corrections par enregistrement gardées seulement si la valeur actuelle est celle attendue :
+    # un identifiant erroné ne modifie pas un autre patient, il est signalé dans le journal
+    check = rule.get('check', rule['column'])
+    expected = keys.loc[values.index].map(pd.Series({key: value for key, (value, _) in rule['records'].items()}))
+    if check in frame.columns:
+        current = columns.get(check, frame[check]).loc[values.index]
+        unexpected = current.astype(object).to_numpy() != expected.astype(object).to_numpy()
+    else:
+        unexpected = np.ones(len(values), dtype=bool)
+    if unexpected.any():
+        before = columns.get(rule['column'], frame[rule['column']]).loc[values.index[unexpected]].astype(object)
+        audits.append(pd.DataFrame({
+            'règle': f"{rule['reason']} : ignorée, {check} différent de la valeur attendue",
+            'colonne': rule['column'],
+            'enregistrement': keys.loc[before.index].to_numpy(),
+            'avant': before.to_numpy(),
+            'après': before.to_numpy(),
+            'appliquée': False,
+        }, index=before.index))
+    return values[~unexpected]
+
+
+def apply_corrections(frame, schema, rules=RULES):
+    """Applique les règles du schéma ; renvoie (BDD corrigée, journal des valeurs modifiées)."""
+    if schema is None:
+        return frame, pd.DataFrame(columns=AUDIT_COLUMNS)
+    record_key = schema['record_key']
+    keys = frame[record_key] if record_key in frame.columns else pd.Series(np.nan, index=frame.index)
+    audits, columns = [], {}
+    for rule in rules:
+        column = rule['column']
+        if rule['schema'] != schema['name'] or column not in frame.columns:
+            continue
+        series = columns.get(column, frame[column])
+        values = _corrected(series, keys, rule)
+        if 'records' in rule:
+            values = _expected_records(frame, columns, keys, values, rule, audits)
+        before = series.loc[values.index]
+        changed = values.astype(object).to_numpy() != before.astype(object).to_numpy()
+        values = values[changed]
+        if values.empty:
+            continue
+        audits.append(pd.DataFrame({
+            'règle': rule['reason'],
+            'colonne': column,
+            'enregistrement': keys.loc[values.index].to_numpy(),
+            'avant': before[changed].astype(object).to_numpy(),
+            'après': values.astype(object).to_numpy(),
+            'appliquée': True,
+        }, index=values.index))
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.cat.add_categories(pd.Index(values.dropna().unique()).difference(series.cat.categories))
+        else:
+            series = series.astype(object)
+        columns[column] = series.mask(series.index.isin(values.index), values)
+
+    if not columns:
+        return frame, pd.concat(audits) if audits else pd.DataFrame(columns=AUDIT_COLUMNS)
+    # Colonnes corrigées retypées comme à la lecture (texte nettoyé -> entier, catégories inutiles retirées)
+    kinds = column_kinds(schema, columns)
+    for column, series in columns.items():
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Catégories triées comme à la lecture
+            series = series.cat.remove_unused_categories()
+            series = series.cat.reorder_categories(series.cat.categories.sort_values())
+            if kinds.get(column) in ('flag', 'smallint'):
+                series = series.astype(object)
+        columns[column] = series
+    return frame.assign(**apply_schema(pd.DataFrame(columns, index=frame.index), schema)), pd.concat(audits)
@@ -0,0 +1,69 @@
+import numpy as np
+
+from ctar.perf import stage
+from ctar.prepare import patient_changes, patient_view, peripheral_frame, prepare_peripheral
+from ctar.schema import concat_typed
+
+# Dimensions de filtrage des pages (sélection des CTARs et des années)
+FILTER_DIMS = ('id_ctar', 'Annee')
+
+
+def build_cube(frame, dims):
+    # Nombre de lignes pour chaque combinaison observée des dimensions (NaN compris) :
+    # la taille du cube dépend du nombre de combinaisons, pas du nombre de lignes
+    return frame.groupby(list(dims), observed=True, dropna=False).size()
+
+
+def update_cube(cube, removed, added):
+    # Cube d'une BDD modifiée : comptes des lignes retirées soustraits, ceux des lignes ajoutées additionnés
+    dims = list(cube.index.names)
+    counts = concat_typed([
+        cube.reset_index(name='n'),
+        build_cube(removed, dims).mul(-1).reset_index(name='n'),
+        build_cube(added, dims).reset_index(name='n'),
+    ])
+    counts = counts.groupby(dims, observed=True, dropna=False)['n'].sum().rename(None)
+    return counts[counts != 0]
+
+
+def peripheral_cube(dataset, dims):
+    dims = tuple(dims)
+    return dataset.derived(
+        ('cube', 'peripheral') + dims,
+        lambda _: build_cube(peripheral_frame(dataset), FILTER_DIMS + dims),
+        lambda cube, change: update_cube(cube, *change.derived('peripheral', prepare_peripheral)),
+    )
+
+
+def ipm_cube(dataset, dims):
+    dims = tuple(dims)
+    return dataset.derived(('cube', 'ipm') + dims, lambda _: build_cube(patient_view(dataset).patients, dims),
+                           lambda cube, change: update_cube(cube, *patient_changes(change)))
+
+
+def cube_slice(cube, by, **filters):
+    # Filtre les dimensions (None = toutes les valeurs) puis somme sur les dimensions `by`
+    with stage('filtrage', rows_in=cube, detail=', '.join(map(str, by))) as measure:
+        mask = np.ones(len(cube), dtype=bool)
+        for dim, values in filters.items():
+            if values is not None:
+                mask &= cube.index.get_level_values(dim).isin(values)
+        return measure.output(cube[mask].groupby(level=list(by), observed=True, dropna=False).sum())
+
+
+def cube_array(cube, dims):
+    """Cube dense : tableau numpy des comptes sur les dimensions `dims`.
+
+    Renvoie (values, axes) : `axes` associe à chaque dimension ses valeurs
+    observées (triées, NaN exclues) et `values[i, j, ...]` est le compte de
+    (axes[dims[0]][i], axes[dims[1]][j], ...), 0 pour une combinaison absente.
+    Une sélection se lit alors comme une tranche ou une somme du tableau.
+    """
+    dims = list(dims)
+    with stage('agrégation', rows_in=cube, detail='tableau ' + ', '.join(map(str, dims))) as measure:
+        counts = cube.groupby(level=dims, observed=True).sum()
+        axes = {dim: counts.index.get_level_values(dim).unique().sort_values() for dim in dims}
+        values = np.zeros([len(axes[dim]) for dim in dims], dtype='int64')
+        positions = tuple(axes[dim].get_indexer(counts.index.get_level_values(dim)) for dim in dims)
+        values[positions] = counts.to_numpy()
+        return measure.output(values), axes
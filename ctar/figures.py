@@ -0,0 +1,53 @@
+import os
+
+import plotly.io as pio
+import streamlit as st
+
+from ctar.cache import LRUCache
+from ctar.perf import stage
+
+# Budget mémoire du cache des figures sérialisées (en Mo)
+FIGURE_CACHE_MB = int(os.environ.get('CTAR_FIGURE_CACHE_MB', 128))
+
+_figures = LRUCache(FIGURE_CACHE_MB * 1024 * 1024)
+
+
+def _selection_value(value):
+    # L'ordre des CTARs / années sélectionnés ne change pas la figure
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(value, key=str))
+    return value
+
+
+def figure_key(dataset, page, **selection):
+    # Une figure = un fichier (empreinte du contenu), une page et les valeurs des widgets
+    return (dataset.key, page) + tuple(sorted((name, _selection_value(value)) for name, value in selection.items()))
+
+
+def cached_figures(key, build):
+    # `build` renvoie une figure, une liste de figures ou None (rien à afficher) ;
+    # le JSON est conservé pour qu'une sélection déjà vue ne refasse aucun calcul pandas
+    specs = _figures.get(key)
+    if specs is None:
+        selection = ', '.join(f'{name}={value}' for name, value in key[2:])
+        with stage('figure', detail=f'{key[1]} {selection}'.strip()) as measure:
+            figures = build()
+            if figures is None:
+                figures = []
+            elif not isinstance(figures, (list, tuple)):
+                figures = [figures]
+            measure.output(figures)
+        with stage('sérialisation', rows_in=figures) as measure:
+            specs = measure.output(tuple(fig.to_json() for fig in figures))
+        _figures.put(key, specs, sum(len(spec) for spec in specs))
+    with stage('désérialisation', rows_in=specs) as measure:
+        return measure.output([pio.from_json(spec) for spec in specs])
+
+
+def plotly_charts(key, build, **kwargs):
+    # Affiche les figures en cache (ou les construit) ; renvoie la liste des figures affichées (vide si aucune)
+    figures = cached_figures(key, build)
+    with stage('rendu', rows_in=figures):
+        for fig in figures:
+            st.plotly_chart(fig, **kwargs)
+    return figures
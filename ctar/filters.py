@@ -0,0 +1,45 @@
+import streamlit as st
+
+# Sélection validée, conservée d'une page à l'autre (l'état d'un widget est propre à sa page)
+FILTERS_KEY = 'ctar_filters'
+_FORM_KEY = '_ctar_filters_form'
+
+
+def filter_form(ctars, years=None):
+    """Filtre CTARs / années des pages périphériques, dans un formulaire de la sidebar.
+
+    Les choix ne relancent la page qu'au clic sur « Appliquer » ; la sélection
+    validée est gardée en session et reprise par les autres pages (les figures
+    déjà calculées pour cette sélection sont alors relues du cache). Renvoie
+    (tous les CTARs, CTARs choisis, années choisies), limités aux valeurs du
+    fichier ; années à None si la page ne filtre pas par année.
+    """
+    ctars = list(ctars)
+    year_options = None if years is None else sorted(int(year) for year in years)
+    saved = st.session_state.get(FILTERS_KEY, {'all_ctars': False, 'ctars': [], 'years': []})
+
+    with st.sidebar.form(_FORM_KEY):
+        st.subheader('Filtres')
+        all_ctars = st.checkbox("Sélectionnez tous les CTARs", value=saved['all_ctars'])
+        selected_ctars = st.multiselect(
+            "Sélectionnez un ou plusieurs CTARs", options=ctars,
+            default=[ctar for ctar in saved['ctars'] if ctar in ctars],
+            help="Ignoré quand tous les CTARs sont sélectionnés.")
+        if year_options is not None:
+            selected_year = st.multiselect(
+                "Sélectionnez une ou plusieurs année(s)", options=year_options,
+                default=[year for year in saved['years'] if year in year_options])
+        if st.form_submit_button('Appliquer'):
+            # Années d'une page sans filtre d'année : celles déjà validées sont gardées
+            saved = {
+                'all_ctars': all_ctars,
+                'ctars': selected_ctars,
+                'years': saved['years'] if year_options is None else selected_year,
+            }
+            st.session_state[FILTERS_KEY] = saved
+
+    return (
+        saved['all_ctars'],
+        [ctar for ctar in saved['ctars'] if ctar in ctars],
+        None if year_options is None else [year for year in saved['years'] if year in year_options],
+    )
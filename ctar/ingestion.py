@@ -0,0 +1,330 @@
+import codecs
+import csv
+import datetime
+import gzip
+import hashlib
+import io
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+
+import openpyxl
+import pandas as pd
+
+from ctar.columns import needed_columns
+from ctar.corrections import apply_corrections
+from ctar.perf import add_stages, stage, worker_session, worker_stages
+from ctar.schema import SCHEMAS, apply_schema, concat_typed, detect_schema, read_dtypes
+from ctar.snapshot import read_snapshot, write_snapshot
+from ctar.store import store
+
+# Les DataFrames mis en cache sont partagés entre les reruns : avec le
+# copy-on-write (toujours actif à partir de pandas 3), une page qui modifie
+# une colonne travaille sur sa propre copie et ne corrompt pas le cache.
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
+
+# Dialecte des anciens exports, retenu quand l'échantillon ne permet pas de trancher
+CSV_ENCODING = 'ISO-8859-1'
+CSV_SEP = ','
+# Début du fichier examiné pour détecter l'encodage et le séparateur (en octets)
+SNIFF_BYTES = 64 * 1024
+_SEPARATORS = (',', ';', '\t', '|')
+
+# Lignes lues à la fois : chaque bloc est typé avant la lecture du suivant
+CSV_CHUNK_ROWS = int(os.environ.get('CTAR_CSV_CHUNK_ROWS', 50000))
+# Fichiers lus en parallèle (le tokenizer CSV de pandas libère le GIL)
+INGEST_WORKERS = int(os.environ.get('CTAR_INGEST_WORKERS', min(4, os.cpu_count() or 1)))
+
+
+class Dialect:
+    """Encodage et séparateur d'un CSV, détectés sur le début du fichier."""
+
+    def __init__(self, encoding=CSV_ENCODING, sep=CSV_SEP):
+        self.encoding = encoding
+        self.sep = sep
+
+    def __repr__(self):
+        return f"{self.encoding}, séparateur {'tabulation' if self.sep == chr(9) else repr(self.sep)}"
+
+
+class Dataset:
+    """Fichier téléchargé et parsé, identifié par l'empreinte de son contenu."""
+
+    def __init__(self, key, name, frame, schema_name=None, dialect=None, corrections=None):
+        self.key = key
+        self.name = name
+        self.frame = frame
+        # Dialecte détecté avant la lecture (None pour un classeur Excel) : jamais redétecté
+        self.dialect = dialect
+        # Journal des corrections de saisie appliquées au chargement (ctar.corrections)
+        self.corrections = corrections
+        # Type de BDD ('ipm', 'peripheral') reconnu à l'en-tête, None si inconnu
+        self.schema_name = schema_name
+        # Poignée dans le store partagé : même contenu, même schéma
+        self.handle = (key, schema_name)
+        self.nbytes = int(frame.memory_usage(deep=True).sum())
+        self._derived = {}
+        self._updates = {}
+
+    def derived(self, name, build, update=None):
+        # Structures dérivées (BDD préparée, vues, agrégats) calculées une fois par fichier ;
+        # `update(ancienne valeur, Change)` les met à jour après un upsert, sinon elles sont reconstruites
+        if name not in self._derived:
+            with stage('agrégation', rows_in=self.frame, detail=_label(name)) as measure:
+                self._derived[name] = measure.output(build(self.frame))
+            if update is not None:
+                self._updates[name] = update
+        return self._derived[name]
+
+    def upserted(self, key, delta, record_key):
+        # Nouvelle BDD : lignes de `delta` ajoutées, celles de même clé remplacées ; les
+        # structures dérivées déjà calculées sont mises à jour sur les seules lignes modifiées
+        replaced = self.frame[record_key].isin(delta[record_key]).to_numpy()
+        # Les lignes ajoutées prennent de nouveaux numéros : l'index des lignes gardées ne change pas
+        start = int(self.frame.index.max()) + 1 if len(self.frame) else 0
+        delta = delta.set_axis(pd.RangeIndex(start, start + len(delta)))
+        change = Change(self.frame[replaced], delta)
+
+        dataset = Dataset(key, self.name, concat_typed([self.frame[~replaced], delta]), self.schema_name, self.dialect)
+        for name, update in self._updates.items():
+            with stage('mise à jour', rows_in=delta, detail=_label(name)) as measure:
+                dataset._derived[name] = measure.output(update(self._derived[name], change))
+            dataset._updates[name] = update
+        return dataset
+
+
+class Change:
+    """Lignes brutes retirées et ajoutées par un upsert (index de l'ancienne / de la nouvelle BDD)."""
+
+    def __init__(self, removed, added):
+        self.removed = removed
+        self.added = added
+        self._derived = {}
+
+    def derived(self, name, build):
+        # (build(retirées), build(ajoutées)), calculé une fois pour toutes les structures à mettre à jour
+        if name not in self._derived:
+            self._derived[name] = (build(self.removed), build(self.added))
+        return self._derived[name]
+
+
+def _label(name):
+    return ' / '.join(map(str, name)) if isinstance(name, tuple) else name
+
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_format(data):
+    # Format reconnu au contenu : 'gzip', 'zip' (archive d'un CSV), 'xlsx' ou 'csv'
+    if data[:2] == b'\x1f\x8b':
+        return 'gzip'
+    if data[:4] == b'PK\x03\x04':
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            return 'xlsx' if 'xl/workbook.xml' in archive.namelist() else 'zip'
+    return 'csv'
+
+
+def _csv_stream(data):
+    # Texte CSV décompressé à la volée pendant la lecture, sans copie décompressée complète en mémoire
+    kind = file_format(data)
+    if kind == 'gzip':
+        return gzip.GzipFile(fileobj=io.BytesIO(data))
+    if kind == 'zip':
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        members = [m for m in archive.namelist() if m.lower().endswith('.csv') and not m.startswith('__MACOSX/')]
+        if len(members) != 1:
+            raise ValueError(f"L'archive doit contenir un seul fichier CSV ({len(members)} trouvé(s))")
+        return archive.open(members[0])
+    return io.BytesIO(data)
+
+
+def sniff_dialect(data):
+    # Encodage (BOM, sinon UTF-8 si l'échantillon est valide, sinon Latin-1) et séparateur
+    # (celui qui découpe l'en-tête en plus de colonnes) ; None pour un classeur Excel
+    if file_format(data) == 'xlsx':
+        return None
+    with _csv_stream(data) as stream:
+        sample = stream.read(SNIFF_BYTES)
+    if sample.startswith(codecs.BOM_UTF8):
+        encoding = 'utf-8-sig'
+    elif sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = 'utf-16'
+    else:
+        try:
+            # Décodage incrémental : un caractère coupé en fin d'échantillon n'est pas une erreur
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            encoding = CSV_ENCODING
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample)
+    header = text.lstrip('\ufeff').splitlines()[0] if text.strip() else ''
+    sep = max(_SEPARATORS, key=lambda sep: (len(next(csv.reader([header], delimiter=sep), [])), sep == CSV_SEP))
+    return Dialect(encoding, sep)
+
+
+def read_header(data, dialect=None):
+    # Noms des colonnes, lus sur la seule première ligne du fichier (ou du classeur)
+    if file_format(data) == 'xlsx':
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+        try:
+            header = next(workbook.worksheets[0].iter_rows(max_row=1, values_only=True), ())
+        finally:
+            workbook.close()
+        return pd.Index(['' if name is None else str(name) for name in header])
+    dialect = dialect or sniff_dialect(data)
+    with _csv_stream(data) as stream:
+        # Lecture décodée : une ligne UTF-16 compte deux octets par caractère
+        line = io.TextIOWrapper(stream, encoding=dialect.encoding, errors='replace', newline='').readline()
+    return pd.read_csv(io.StringIO(line), sep=dialect.sep, nrows=0).columns
+
+
+def parse_csv(data, schema=None, project=True, dialect=None):
+    dialect = dialect or sniff_dialect(data)
+    try:
+        return _read_csv(data, schema, project, dialect)
+    except UnicodeDecodeError:
+        if dialect.encoding != 'utf-8':
+            raise
+        # Octet non UTF-8 après l'échantillon (début du fichier en ASCII) : ancien export Latin-1
+        dialect.encoding = CSV_ENCODING
+        return _read_csv(data, schema, project, dialect)
+
+
+def _read_csv(data, schema, project, dialect):
+    if schema is None:
+        with _csv_stream(data) as stream:
+            return pd.read_csv(stream, encoding=dialect.encoding, sep=dialect.sep)
+    # Seules les colonnes utilisées par les pages sont lues (toutes si `project` est faux)
+    columns = needed_columns(schema) if project else None
+    # Lecture par blocs typés à mesure (catégories à la lecture, puis entiers et dates) :
+    # le pic mémoire reste proche de la taille compacte finale, pas de celle du texte brut
+    options = dict(encoding=dialect.encoding, sep=dialect.sep, dtype=read_dtypes(schema['columns']),
+                   usecols=None if columns is None else columns.__contains__)
+    with _csv_stream(data) as stream, pd.read_csv(stream, chunksize=CSV_CHUNK_ROWS, **options) as reader:
+        chunks = [apply_schema(chunk, schema) for chunk in reader]
+    if not chunks:
+        with _csv_stream(data) as stream:
+            chunks = [apply_schema(pd.read_csv(stream, nrows=0, **options), schema)]
+    return chunks[0] if len(chunks) == 1 else concat_typed(chunks)
+
+
+def _cell(value):
+    # Heure saisie dans Excel : même texte 'HH:MM' que dans l'export CSV
+    return value.strftime('%H:%M') if isinstance(value, datetime.time) else value
+
+
+def parse_excel(data, schema=None, project=True):
+    # Première feuille lue ligne à ligne (openpyxl en lecture seule), typée par blocs comme un CSV
+    columns = needed_columns(schema) if schema is not None and project else None
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = ['' if name is None else str(name) for name in next(rows, ())]
+        keep = [i for i, name in enumerate(header) if columns is None or name in columns]
+        names = [header[i] for i in keep]
+        chunks, start = [], 0
+        while True:
+            raw = list(islice(rows, CSV_CHUNK_ROWS))
+            # Lignes entièrement vides (cellules seulement mises en forme) ignorées
+            block = [[_cell(row[i]) if i < len(row) else None for i in keep]
+                     for row in raw if any(value is not None for value in row)]
+            if block or not chunks:
+                chunk = pd.DataFrame(block, columns=names, index=pd.RangeIndex(start, start + len(block)))
+                chunk = chunk.infer_objects()
+                chunks.append(apply_schema(chunk, schema) if schema is not None else chunk)
+                start += len(block)
+            if len(raw) < CSV_CHUNK_ROWS:
+                break
+    finally:
+        workbook.close()
+    return chunks[0] if len(chunks) == 1 else concat_typed(chunks)
+
+
+def parse_file(data, schema=None, project=True, dialect=None):
+    # CSV (éventuellement gzip ou zip) ou classeur Excel
+    if file_format(data) == 'xlsx':
+        return parse_excel(data, schema, project)
+    return parse_csv(data, schema, project, dialect)
+
+
+def load_bytes(name, data):
+    # Même contenu = même DataFrame : pas de nouveau parsing à chaque rerun
+    key = content_hash(data)
+    # Fichier déjà chargé : ni détection du dialecte, ni lecture de l'en-tête
+    for schema_name in (*SCHEMAS, None):
+        dataset = store.get((key, schema_name))
+        if dataset is not None:
+            return dataset
+
+    dialect = sniff_dialect(data)
+    schema = detect_schema(read_header(data, dialect))
+    schema_name = schema['name'] if schema else None
+    # Instantané Arrow écrit par un autre processus serveur : pas de nouveau parsing
+    with stage('instantané', detail=name) as measure:
+        frame = measure.output(read_snapshot(key, schema))
+    if frame is None:
+        with stage('parsing', detail=name) as measure:
+            frame = measure.output(parse_file(data, schema, dialect=dialect))
+        write_snapshot(key, schema, frame)
+    # L'instantané garde la BDD lue : une règle modifiée s'applique sans nouvelle lecture
+    with stage('corrections', rows_in=frame, detail=name) as measure:
+        frame, corrections = apply_corrections(frame, schema)
+        measure.output(corrections)
+    return store.add((key, schema_name), Dataset(key, name, frame, schema_name, dialect, corrections))
+
+
+def upsert_dataset(base, delta):
+    # `delta` (nouvelles consultations) fusionné dans `base` : un enregistrement déjà présent
+    # (même 'ref_mordu' pour l'IPM, même 'record_id' pour les périphériques) est remplacé
+    if base.schema_name is None or delta.schema_name != base.schema_name:
+        raise ValueError(f'{delta.name} : BDD de type différent de {base.name}, fusion impossible')
+    record_key = SCHEMAS[base.schema_name]['record_key']
+    for dataset in (base, delta):
+        if record_key not in dataset.frame.columns:
+            raise ValueError(f'{dataset.name} : colonne {record_key} absente, fusion impossible')
+    key = content_hash(f'{base.key}+{delta.key}'.encode())
+    dataset = store.get((key, base.schema_name))
+    if dataset is None:
+        dataset = base.upserted(key, delta.frame, record_key)
+        # Journal : corrections des enregistrements gardés, puis celles du fichier ajouté
+        if base.corrections is not None and delta.corrections is not None:
+            kept = base.corrections[~base.corrections['enregistrement'].isin(delta.frame[record_key])]
+            dataset.corrections = pd.concat([kept, delta.corrections], ignore_index=True)
+        dataset = store.add((key, base.schema_name), dataset)
+    return dataset
+
+
+def _load_measured(name, data, session):
+    # Dans un thread de travail : (Dataset ou exception, étapes mesurées pour la session)
+    with worker_stages(session) as records:
+        try:
+            result = load_bytes(name, data)
+        except (ValueError, TypeError, OSError, EOFError, zipfile.BadZipFile) as e:  # décodage, CSV, typage, gzip tronqué, zip ou classeur invalide
+            result = e
+    return result, records
+
+
+def load_uploads(uploaded_files, on_done=None):
+    """Charge plusieurs fichiers en parallèle ; renvoie [(fichier, Dataset ou exception)] dans l'ordre des fichiers.
+
+    Une erreur de lecture n'interrompt pas les autres fichiers. `on_done(fichier, résultat)`
+    est appelé dans le thread appelant à mesure que les fichiers sont lus.
+    """
+    results = {}
+    with stage('ingestion', rows_in=len(uploaded_files), detail=f'{INGEST_WORKERS} threads') as measure:
+        session = worker_session()
+        with ThreadPoolExecutor(max_workers=max(1, INGEST_WORKERS)) as pool:
+            futures = {pool.submit(_load_measured, f.name, f.getvalue(), session): i for i, f in enumerate(uploaded_files)}
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i], records = future.result()
+                # Parsing, instantané et corrections du fichier : sous-étapes de l'ingestion
+                add_stages(records)
+                if on_done is not None:
+                    on_done(uploaded_files[i], results[i])
+        measure.output(len(results))
+    return [(uploaded_file, results[i]) for i, uploaded_file in enumerate(uploaded_files)]
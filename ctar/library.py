@@ -0,0 +1,233 @@
+"""Bibliothèque locale et versionnée des BDD CTAR déjà ingérées.
+
+    python -m ctar.library ingest CTAR_peripheriquedata20022024_cleaned.csv.gz [--label ...]
+    python -m ctar.library append peripheral-v1 CTAR_peripheriquedata20032024_cleaned.csv [--label ...]
+    python -m ctar.library list
+
+L'ingestion valide le CSV nettoyé (éventuellement compressé en gzip ou zip,
+ou un classeur Excel), le convertit en Parquet compressé (zstd) et
+l'enregistre dans le catalogue ; Home.py propose ensuite ces BDD sans
+téléchargement. L'ajout fusionne une extraction partielle dans une version
+existante (upsert sur 'ref_mordu' / 'record_id') et crée la version suivante.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from ctar.columns import needed_columns
+from ctar.corrections import apply_corrections
+from ctar.ingestion import Dataset, content_hash, parse_file, read_header, sniff_dialect, upsert_dataset
+from ctar.perf import stage
+from ctar.schema import SCHEMAS, detect_schema, validate
+from ctar.snapshot import read_snapshot, write_snapshot
+from ctar.store import store
+
+LIBRARY_DIR = os.environ.get(
+    'CTAR_LIBRARY_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'library'))
+CATALOG_FILE = 'catalog.json'
+
+# Date d'export dans le nom des fichiers (ex. CTAR_ipmdata20022024_cleaned.csv : 20/02/2024)
+_EXPORT_DATE = re.compile(r'(\d{2})(\d{2})(\d{4})')
+
+
+class IngestError(Exception):
+    pass
+
+
+def catalog_entries():
+    # Entrées du catalogue, de la plus récente à la plus ancienne
+    path = os.path.join(LIBRARY_DIR, CATALOG_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)['datasets']
+    return sorted(entries, key=lambda entry: entry['ingested_at'], reverse=True)
+
+
+def _write_catalog(entries):
+    os.makedirs(LIBRARY_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=LIBRARY_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({'datasets': entries}, f, indent=2, ensure_ascii=False)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, os.path.join(LIBRARY_DIR, CATALOG_FILE))
+
+
+def entry_label(entry):
+    return f"{entry['label']} (v{entry['version']})"
+
+
+def _default_label(schema, file_name):
+    match = _EXPORT_DATE.search(file_name)
+    if match:
+        day, month, year = match.groups()
+        try:
+            return f"{schema['name']} {datetime(int(year), int(month), int(day)):%Y-%m-%d}"
+        except ValueError:
+            pass
+    return f"{schema['name']} {datetime.now():%Y-%m-%d}"
+
+
+def ingest(path, label=None):
+    """Valide un CSV nettoyé et l'ajoute à la bibliothèque ; renvoie (entrée, avertissements).
+
+    Un contenu déjà présent dans la bibliothèque n'est pas ajouté une seconde fois.
+    """
+    file_name = os.path.basename(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Dialecte détecté une seule fois, pour l'en-tête puis pour la lecture
+    dialect = sniff_dialect(data)
+    schema = detect_schema(read_header(data, dialect))
+    if schema is None:
+        raise IngestError(f'{file_name} : colonnes non reconnues (BDD IPM ou périphérique attendue)')
+    key = content_hash(data)
+
+    entries = catalog_entries()
+    existing = next((e for e in entries if e['content_hash'] == key and e['schema'] == schema['name']), None)
+    if existing is not None:
+        return existing, [f'Contenu déjà ingéré : {entry_label(existing)}']
+
+    # La bibliothèque garde toutes les colonnes : une page ajoutée plus tard peut en déclarer de nouvelles
+    frame = parse_file(data, schema, project=False, dialect=dialect)
+    return _add_version(entries, schema, frame, key, file_name, label or _default_label(schema, file_name))
+
+
+def append(entry_id, path, label=None):
+    """Fusionne un CSV partiel dans la version `entry_id` ; renvoie (nouvelle entrée, avertissements).
+
+    Seul le fichier partiel est lu et parsé, l'historique vient de la bibliothèque.
+    """
+    entries = catalog_entries()
+    base_entry = next((e for e in entries if e['id'] == entry_id), None)
+    if base_entry is None:
+        raise IngestError(f'{entry_id} : version absente de la bibliothèque')
+    file_name = os.path.basename(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    dialect = sniff_dialect(data)
+    schema = detect_schema(read_header(data, dialect))
+    if schema is None or schema['name'] != base_entry['schema']:
+        raise IngestError(f"{file_name} : colonnes non reconnues (BDD {base_entry['schema']} attendue)")
+
+    base = load_entry(base_entry, project=False)
+    delta = Dataset(content_hash(data), file_name, parse_file(data, schema, project=False, dialect=dialect),
+                    schema['name'], dialect)
+    try:
+        merged = upsert_dataset(base, delta)
+    except ValueError as e:
+        raise IngestError(str(e)) from e
+    existing = next((e for e in entries if e['content_hash'] == merged.key and e['schema'] == schema['name']), None)
+    if existing is not None:
+        return existing, [f'Contenu déjà ingéré : {entry_label(existing)}']
+    return _add_version(entries, schema, merged.frame, merged.key, base_entry['file_name'],
+                        label or _default_label(schema, file_name), parent=base_entry['id'])
+
+
+def _add_version(entries, schema, frame, key, file_name, label, parent=None):
+    errors, warnings = validate(frame, schema)
+    if errors:
+        raise IngestError(f"{file_name} : {' ; '.join(errors)}")
+
+    version = 1 + max((e['version'] for e in entries if e['schema'] == schema['name']), default=0)
+    entry = {
+        'id': f"{schema['name']}-v{version}",
+        'schema': schema['name'],
+        'version': version,
+        'label': label,
+        'file_name': file_name,
+        'content_hash': key,
+        'rows': len(frame),
+        'columns': len(frame.columns),
+        'ingested_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'path': f"{schema['name']}-v{version}.parquet",
+    }
+    if parent is not None:
+        entry['parent'] = parent
+    os.makedirs(LIBRARY_DIR, exist_ok=True)
+    frame.to_parquet(os.path.join(LIBRARY_DIR, entry['path']), compression='zstd')
+    _write_catalog(entries + [entry])
+    return entry, warnings
+
+
+def load_entry(entry, project=True):
+    # BDD de la bibliothèque, partagée avec les téléchargements du même contenu ; seules
+    # les colonnes déclarées par les pages sont lues (toutes si `project` est faux)
+    schema = SCHEMAS[entry['schema']]
+    path = os.path.join(LIBRARY_DIR, entry['path'])
+    if not project:
+        return Dataset(entry['content_hash'], entry['file_name'], pd.read_parquet(path), entry['schema'])
+
+    handle = (entry['content_hash'], entry['schema'])
+    dataset = store.get(handle)
+    if dataset is None:
+        frame = read_snapshot(entry['content_hash'], schema)
+        if frame is None:
+            columns = needed_columns(schema)
+            with stage('bibliothèque', detail=entry_label(entry)) as measure:
+                frame = measure.output(pd.read_parquet(
+                    path, columns=None if columns is None else [c for c in pq.read_schema(path).names if c in columns]))
+            write_snapshot(entry['content_hash'], schema, frame)
+        # La bibliothèque garde les données telles que saisies : corrections appliquées au chargement
+        with stage('corrections', rows_in=frame, detail=entry_label(entry)) as measure:
+            frame, corrections = apply_corrections(frame, schema)
+            measure.output(corrections)
+        dataset = store.add(handle, Dataset(entry['content_hash'], entry['file_name'], frame, entry['schema'],
+                                            corrections=corrections))
+    return dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bibliothèque des BDD CTAR ingérées.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help='valider et ajouter des CSV nettoyés')
+    ingest_parser.add_argument('files', nargs='+')
+    ingest_parser.add_argument('--label', help='libellé affiché dans Home (par défaut : type et date d\'export)')
+    append_parser = commands.add_parser('append', help='fusionner des CSV partiels dans une version existante')
+    append_parser.add_argument('entry', help='version de départ (ex. peripheral-v1)')
+    append_parser.add_argument('files', nargs='+')
+    append_parser.add_argument('--label', help='libellé de la nouvelle version')
+    commands.add_parser('list', help='lister les BDD de la bibliothèque')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for entry in catalog_entries():
+            print(f"{entry['id']:<16} {entry_label(entry):<32} {entry['rows']:>9} lignes  "
+                  f"{entry['file_name']}  ({entry['ingested_at']})")
+        return 0
+
+    status = 0
+    entry_id = getattr(args, 'entry', None)
+    for path in args.files:
+        try:
+            if args.command == 'append':
+                # Chaque fichier partiel part de la version créée par le précédent
+                entry, warnings = append(entry_id, path, args.label)
+                entry_id = entry['id']
+            else:
+                entry, warnings = ingest(path, args.label)
+        except (OSError, IngestError) as e:
+            print(f'ERREUR {e}', file=sys.stderr)
+            status = 1
+            continue
+        except (ValueError, TypeError, EOFError, zipfile.BadZipFile) as e:  # décodage, CSV, typage, gzip tronqué, zip ou classeur invalide
+            # Fichier illisible : signalé, les fichiers suivants sont quand même traités
+            print(f'ERREUR {os.path.basename(path)} : {e}', file=sys.stderr)
+            status = 1
+            continue
+        print(f"{entry['id']} : {entry_label(entry)}, {entry['rows']} lignes")
+        for warning in warnings:
+            print(f'  avertissement : {warning}')
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,243 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import pandas as pd
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# Mesures activées par défaut (sinon via l'interrupteur de la sidebar)
+PERF_DEFAULT = os.environ.get('CTAR_PERF', '') not in ('', '0')
+# Journal JSON (une ligne par étape mesurée)
+PERF_LOG = os.environ.get('CTAR_PERF_LOG', 'ctar_perf.log')
+# Une session sans rerun depuis ce délai ne garde plus tracemalloc actif (onglet fermé, en minutes)
+PERF_SESSION_TTL_MIN = int(os.environ.get('CTAR_PERF_SESSION_TTL_MIN', 10))
+
+_STATE_KEY = '_ctar_perf'
+# Choix conservé d'une page à l'autre (l'état d'un widget est propre à sa page)
+_ENABLED_KEY = 'ctar_perf_enabled'
+_TOGGLE_KEY = '_ctar_perf_toggle'
+_log_lock = threading.Lock()
+
+# tracemalloc est commun au processus : sessions dont les mesures sont activées ({session: dernier
+# passage}) et étapes en cours, toutes sessions confondues. Il n'est arrêté que quand plus aucune
+# session ne mesure, ou que les dernières sont inactives depuis PERF_SESSION_TTL_MIN.
+_tracing_lock = threading.Lock()
+_tracing_sessions = {}
+_open_stages = 0
+# Étapes d'un thread de travail (lecture parallèle des fichiers), sans contexte de script Streamlit
+_worker = threading.local()
+
+
+class Stage:
+    """Étape mesurée : durée, lignes en entrée / en sortie, pic mémoire du processus pendant l'étape."""
+
+    def __init__(self, name, depth, rows_in=None, detail=None):
+        self.name = name
+        self.depth = depth
+        self.rows_in = _rows(rows_in)
+        self.rows_out = None
+        self.detail = detail
+        self.seconds = None
+        self.peak_bytes = None
+        self._max_traced = 0
+
+    def output(self, result):
+        # Lignes produites par l'étape (DataFrame, Series, liste ou nombre)
+        self.rows_out = _rows(result)
+        return result
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'depth': self.depth,
+            'detail': self.detail,
+            'wall_ms': round(self.seconds * 1000, 3),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'process_peak_mb': round(self.peak_bytes / 1024 ** 2, 3),
+        }
+
+
+class _Disabled:
+    # Étape sans mesure : l'instrumentation ne coûte qu'un test quand elle est désactivée
+    def output(self, result):
+        return result
+
+
+def _rows(value):
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def _enabled():
+    return st.session_state.get(_TOGGLE_KEY, st.session_state.get(_ENABLED_KEY, PERF_DEFAULT))
+
+
+def _session_id():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+def _expire_tracing():
+    # Sous _tracing_lock : sessions inactives oubliées, tracemalloc arrêté si plus aucune ne mesure
+    deadline = time.monotonic() - PERF_SESSION_TTL_MIN * 60
+    for session, seen in list(_tracing_sessions.items()):
+        if seen < deadline:
+            del _tracing_sessions[session]
+    if not _tracing_sessions and not _open_stages and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def _track_tracing(session, enabled):
+    # À chaque rerun : la session renouvelle sa place (mesures activées) ou la libère
+    with _tracing_lock:
+        if enabled:
+            _tracing_sessions[session] = time.monotonic()
+        else:
+            _tracing_sessions.pop(session, None)
+        _expire_tracing()
+
+
+def _state():
+    # Mesures propres à la session (une session = un thread de script Streamlit),
+    # ou au thread de travail qui mesure pour elle
+    worker = getattr(_worker, 'state', None)
+    if worker is not None:
+        return worker
+    if get_script_run_ctx(suppress_warning=True) is None or not _enabled():
+        return None
+    if _STATE_KEY not in st.session_state:
+        st.session_state[_STATE_KEY] = {'records': [], 'stack': []}
+    return st.session_state[_STATE_KEY]
+
+
+@contextmanager
+def stage(name, rows_in=None, detail=None):
+    """Mesure une étape (parsing, filtrage, agrégation, figure, sérialisation).
+
+    Les étapes peuvent s'imbriquer : la durée et le pic mémoire d'une étape
+    incluent ceux des étapes qu'elle contient. Le pic est celui du processus
+    (allocations des autres sessions comprises), pas celui de la seule étape.
+    """
+    global _open_stages
+    state = _state()
+    if state is None:
+        yield _Disabled()
+        return
+
+    stack = state['stack']
+    current = Stage(name, len(stack), rows_in, detail)
+    with _tracing_lock:
+        _tracing_sessions[state.get('session') or _session_id()] = time.monotonic()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # Le pic n'est remis à zéro que si aucune étape d'une autre session n'est en cours
+        # (sinon leur pic serait effacé) ; celui de l'étape parente est conservé avant
+        if _open_stages == len(stack):
+            if stack:
+                stack[-1]._max_traced = max(stack[-1]._max_traced, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        _open_stages += 1
+        start_traced = tracemalloc.get_traced_memory()[0]
+    state['records'].append(current)
+    stack.append(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - start
+        with _tracing_lock:
+            _open_stages -= 1
+            peak = max(current._max_traced, tracemalloc.get_traced_memory()[1])
+        current.peak_bytes = max(peak - start_traced, 0)
+        stack.pop()
+        if stack:
+            stack[-1]._max_traced = max(stack[-1]._max_traced, peak)
+
+
+def worker_session():
+    # Dans le thread du script : session à transmettre aux threads de travail, None sans mesures
+    return _session_id() if _state() is not None else None
+
+
+@contextmanager
+def worker_stages(session):
+    """Mesure les étapes d'un thread de travail pour la session `session`.
+
+    Le thread n'a pas de contexte Streamlit : ses étapes sont gardées dans une
+    pile propre au thread et renvoyées (liste de Stage) pour être rattachées
+    à la session par `add_stages`, dans le thread du script.
+    """
+    if session is None:
+        yield []
+        return
+    _worker.state = {'records': [], 'stack': [], 'session': session}
+    try:
+        yield _worker.state['records']
+    finally:
+        del _worker.state
+
+
+def add_stages(records):
+    # Étapes mesurées par un thread de travail, rattachées comme sous-étapes de l'étape en cours
+    state = _state()
+    if state is None:
+        return
+    depth = len(state['stack'])
+    for record in records:
+        record.depth += depth
+        state['records'].append(record)
+
+
+def _append_log(page, records):
+    now = datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+    session = _session_id()
+    lines = [json.dumps({'time': now, 'session': session, 'page': page, **record.as_dict()}, ensure_ascii=False)
+             for record in records]
+    with _log_lock:
+        with open(PERF_LOG, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def perf_panel(page):
+    # Interrupteur et tableau des mesures du rerun, à appeler en fin de page
+    with st.sidebar.expander('Mesures de performance'):
+        enabled = st.toggle('Activer les mesures', value=_enabled(), key=_TOGGLE_KEY)
+        st.session_state[_ENABLED_KEY] = enabled
+        state = st.session_state.get(_STATE_KEY)
+        records = [record for record in state['records'] if record.seconds is not None] if state else []
+        if not enabled:
+            st.caption("Mesures désactivées : durée, lignes et pic mémoire du processus pendant chaque étape "
+                       "(parsing, filtrage, agrégation, figure, sérialisation).")
+        elif not records:
+            st.caption('Aucune étape mesurée pendant ce rerun.')
+        else:
+            st.dataframe(pd.DataFrame([
+                {
+                    'Étape': '· ' * record.depth + record.name,
+                    'Détail': record.detail,
+                    'Durée (ms)': round(record.seconds * 1000, 1),
+                    'Lignes entrée': record.rows_in,
+                    'Lignes sortie': record.rows_out,
+                    'Pic mémoire processus (Mo)': round(record.peak_bytes / 1024 ** 2, 2),
+                }
+                for record in records
+            ]), hide_index=True)
+            st.caption('Pic mémoire de tout le processus pendant l\'étape : il comprend les allocations '
+                       'des autres sessions.')
+            _append_log(page, records)
+
+    # Mesures remises à zéro pour le prochain rerun
+    if state:
+        state['records'] = []
+        state['stack'] = []
+    _track_tracing(_session_id(), enabled)
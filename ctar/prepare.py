@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+from ctar.schema import concat_typed
+from ctar.seasons import assign_season
+
+# Les consultations datées après cette année sont des erreurs de saisie
+ANNEE_MAX = 2024
+
+# Tranches d'âge de 5 en 5 ans
+AGE_BINS = list(range(0, 105, 5)) + [float('inf')]
+AGE_LABELS = [f'{i}-{i+4}' for i in AGE_BINS[:-2]] + ['100+']
+
+
+def age_groups(age):
+    return pd.cut(pd.to_numeric(age, errors='coerce'), bins=AGE_BINS, labels=AGE_LABELS, right=False)
+
+
+# Heure de morsure 'HH:MM' ; '00:00' est saisi quand l'heure est inconnue
+HEURE_INCONNUE = '00:00'
+
+
+def bite_hours(heures):
+    # Heure entière (int8, -1 si inconnue) et indicateur d'heure inconnue (vide, illisible ou '00:00') ;
+    # chaque valeur distincte n'est analysée qu'une fois (au plus 1440 heures 'HH:MM')
+    codes, uniques = pd.factorize(heures)
+    text = pd.Series(uniques, dtype=object).astype(str)
+    hours = pd.to_numeric(text.str.extract(r'^\s*(\d{1,2}):', expand=False), errors='coerce')
+    unknown = hours.isna() | (hours > 23) | text.str.contains(HEURE_INCONNUE, regex=False)
+    # Code -1 (valeur manquante) : dernier élément, heure inconnue
+    hours = np.append(hours.where(~unknown, -1).to_numpy(dtype='int8'), np.int8(-1))
+    unknown = np.append(unknown.to_numpy(dtype=bool), True)
+    return hours[codes], unknown[codes]
+
+
+def prepare_peripheral(df):
+    #  Ne pas comptabiliser les lignes sans ID 'id_ctar' = CTAR périphériques inconnues
+    df = df.dropna(subset=['id_ctar', 'date_de_consultation'])
+
+    dates = pd.to_datetime(df['date_de_consultation'])
+    hours = {}
+    if 'heure_du_contact_cleaned' in df.columns:
+        hours['heure'], hours['heure_inconnue'] = bite_hours(df['heure_du_contact_cleaned'])
+    df = df.assign(
+        date_de_consultation=dates,
+        Annee=dates.dt.year.astype('int16'),
+        mois=dates.dt.month.astype('int8'),
+        # Jour de la semaine (0 = lundi)
+        jour=dates.dt.dayofweek.astype('int8'),
+        season=assign_season(dates, df['id_ctar']),
+        **hours,
+        **{'Age Group': age_groups(df['age'])},
+    )
+    return df[df['Annee'] <= ANNEE_MAX]
+
+
+def prepare_ipm(df):
+    # Date de consultation et saison malgache associée, calculées une fois par fichier
+    dates = pd.to_datetime(df['dat_consu'], format='%d/%m/%Y', errors='coerce')
+    return df.assign(dat_consu=dates, season=assign_season(dates), **{'Age Group': age_groups(df['age'])})
+
+
+def update_peripheral(prepared, change):
+    # Préparation des seules lignes ajoutées ; l'index des lignes gardées est celui de la BDD brute
+    kept = prepared[~prepared.index.isin(change.removed.index)]
+    return concat_typed([kept, change.derived('peripheral', prepare_peripheral)[1]])
+
+
+def peripheral_frame(dataset):
+    # BDD préparée partagée par les cubes et les contacts, calculée une seule fois par fichier
+    return dataset.derived('peripheral', prepare_peripheral, update_peripheral)
+
+
+def prepared_peripheral(dataset):
+    # Vue sur la BDD préparée : les colonnes ajoutées par une page restent locales à la page
+    return peripheral_frame(dataset).copy(deep=False)
+
+
+def first_visits(visits):
+    return visits[~visits.duplicated(subset=['ref_mordu'])]
+
+
+class PatientView:
+    """BDD IPM à raison d'une ligne par patient ('ref_mordu', première visite).
+
+    `codes` associe chaque visite à la position de son patient dans `patients`,
+    ce qui permet de revenir aux visites sans dupliquer la table.
+    """
+
+    def __init__(self, visits):
+        self.codes, _ = pd.factorize(visits['ref_mordu'], use_na_sentinel=False)
+        self.patients = first_visits(visits)
+        self._visits = visits
+
+    def updated(self, change):
+        # Un upsert remplace toutes les visites des patients concernés : seules les visites ajoutées sont préparées
+        kept = self._visits[~self._visits.index.isin(change.removed.index)]
+        return PatientView(concat_typed([kept, change.derived('ipm', prepare_ipm)[1]]))
+
+    def visits_of(self, patients):
+        # Visites (toutes consultations) d'un sous-ensemble de patients
+        positions = self.patients.index.get_indexer(patients.index)
+        return self._visits.iloc[np.flatnonzero(np.isin(self.codes, positions))]
+
+
+def patient_view(dataset):
+    return dataset.derived('patients', lambda frame: PatientView(prepare_ipm(frame)), PatientView.updated)
+
+
+def patient_changes(change):
+    # Patients (première visite) retirés et ajoutés par un upsert : toutes les visites
+    # d'un patient remplacé sont retirées, sa première visite l'est donc aussi
+    removed, added = change.derived('ipm', prepare_ipm)
+    return first_visits(removed), first_visits(added)
+
+
+def ipm_patients(dataset):
+    # 1 patient = 1 ID ref_mordu, calculé une seule fois par fichier
+    return patient_view(dataset).patients.copy(deep=False)
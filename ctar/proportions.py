@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+# Quantile de la loi normale pour un intervalle de confiance à 95 %
+Z_95 = 1.959964
+
+
+def wilson_interval(count, total, z=Z_95):
+    # Intervalle de Wilson (en %) d'une proportion count / total ; NaN si total = 0
+    count = np.asarray(count, dtype='float64')
+    total = np.asarray(total, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = count / total
+        denominator = 1 + z ** 2 / total
+        center = (p + z ** 2 / (2 * total)) / denominator
+        half = z * np.sqrt(p * (1 - p) / total + z ** 2 / (4 * total ** 2)) / denominator
+    return 100 * (center - half), 100 * (center + half)
+
+
+def stratified_proportions(counts, by, within, z=Z_95):
+    """Effectifs, pourcentages et intervalles de confiance par strate.
+
+    `counts` est un comptage indexé par dimensions (cube ou tranche de cube),
+    ou un DataFrame des dimensions avec une colonne 'count'. Il est sommé sur
+    les dimensions `by`, puis chaque effectif est rapporté au total de sa
+    strate `within` (sous-ensemble de `by`). Renvoie un DataFrame : dimensions
+    `by`, 'count', 'total', 'percentage', 'ci_low', 'ci_high' (de 0 à 100).
+    """
+    by, within = list(by), list(within)
+    if isinstance(counts, pd.DataFrame):
+        table = counts.groupby(by, observed=True)['count'].sum().reset_index()
+    else:
+        table = counts.groupby(level=by, observed=True).sum().rename('count').reset_index()
+    # Total de la strate de chaque ligne, en un seul groupby / transform
+    if within:
+        table['total'] = table.groupby(within, observed=True)['count'].transform('sum')
+    else:
+        table['total'] = table['count'].sum()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        table['percentage'] = np.where(table['total'] > 0, 100 * table['count'] / table['total'], 0.0)
+    table['ci_low'], table['ci_high'] = wilson_interval(table['count'], table['total'], z)
+    return table
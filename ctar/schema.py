@@ -0,0 +1,183 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Types déclarés pour les colonnes des BDD CTAR :
+#   'category' : texte répétitif (sexe, espèce, ...), converti dès la lecture
+#   'flag'     : cases à cocher REDCap 0/1
+#   'smallint' : entiers nullables (âges, nombre de lésions, mois, année)
+#   'date'     : dates de consultation, éventuellement avec un format
+# 'required' : colonnes sans lesquelles les pages ne peuvent rien afficher ;
+#              elles servent aussi d'empreinte pour reconnaître la BDD à son en-tête
+# 'record_key' : identifiant d'un enregistrement, clé des mises à jour incrémentales (upsert)
+IPM_SCHEMA = {
+    'name': 'ipm',
+    'columns': {
+        'sexe': 'category',
+        'animal': 'category',
+        'typanim': 'category',
+        'savon': 'category',
+        'tet_cont': 'category',
+        'm_sup_cont': 'category',
+        'ext_s_cont': 'category',
+        'm_inf_cont': 'category',
+        'ext_i_cont': 'category',
+        'abdo_cont': 'category',
+        'dos_cont': 'category',
+        'geni_cont': 'category',
+        'age': 'smallint',
+        'mois': 'smallint',
+        'Annee': 'smallint',
+        'nbtet': 'smallint',
+        'nb_sup': 'smallint',
+        'nb_extr_s': 'smallint',
+        'nb_inf': 'smallint',
+        'nb_extr_i': 'smallint',
+        'nb_abdo': 'smallint',
+        'nb_dos': 'smallint',
+        'nb_genit': 'smallint',
+        'dat_consu': ('date', '%d/%m/%Y'),
+    },
+    'prefixes': {},
+    'required': ['ref_mordu', 'dat_consu', 'age', 'sexe'],
+    'record_key': 'ref_mordu',
+}
+
+PERIPHERAL_SCHEMA = {
+    'name': 'peripheral',
+    'columns': {
+        'id_ctar': 'category',
+        'ctar': 'category',
+        'sexe': 'category',
+        'espece': 'category',
+        'dev_carac': 'category',
+        'lavage_savon': 'category',
+        'age': 'smallint',
+        'nb_lesion': 'smallint',
+        'date_de_consultation': ('date', None),
+    },
+    'prefixes': {
+        'singes_des_legions___': 'flag',
+        'type_contact___': 'flag',
+    },
+    'required': ['id_ctar', 'date_de_consultation', 'age', 'sexe'],
+    'record_key': 'record_id',
+}
+
+SCHEMAS = {schema['name']: schema for schema in (IPM_SCHEMA, PERIPHERAL_SCHEMA)}
+
+
+def detect_schema(columns):
+    # Empreinte de l'en-tête, indépendante du nom du fichier (ex. extraction d'un autre mois) :
+    # le schéma dont toutes les colonnes obligatoires sont présentes, None si aucun ou plusieurs
+    columns = set(columns)
+    matches = [schema for schema in SCHEMAS.values() if columns.issuperset(schema['required'])]
+    return matches[0] if len(matches) == 1 else None
+
+
+def column_kinds(schema, columns):
+    kinds = {}
+    for col in columns:
+        kind = schema['columns'].get(col)
+        if kind is None:
+            kind = next((k for prefix, k in schema['prefixes'].items() if col.startswith(prefix)), None)
+        if kind is not None:
+            kinds[col] = kind
+    return kinds
+
+
+def read_dtypes(kinds):
+    # Les catégories sont créées par le parser, sans passer par des objets str
+    return {col: 'category' for col, kind in kinds.items() if kind == 'category'}
+
+
+def _smallest_int(values, nullable):
+    lo, hi = (values.min(), values.max()) if len(values) else (0, 0)
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            name = np.dtype(dtype).name
+            return name.capitalize() if nullable else name
+    return 'Int64' if nullable else 'int64'
+
+
+def _to_numeric(series, kind):
+    numeric = pd.to_numeric(series, errors='coerce')
+    # Une valeur non numérique (ex. 'OUI') : on garde la colonne en catégorie
+    if numeric.isna().sum() > series.isna().sum():
+        return series.astype('category')
+    values = numeric.dropna()
+    if not (values == values.round()).all():
+        return numeric.astype('float32')
+    nullable = kind == 'smallint' or numeric.isna().any()
+    return numeric.astype(_smallest_int(values, nullable))
+
+
+def apply_schema(df, schema):
+    kinds = column_kinds(schema, df.columns)
+    converted = {}
+    for col, kind in kinds.items():
+        if kind in ('flag', 'smallint'):
+            converted[col] = _to_numeric(df[col], kind)
+        elif isinstance(kind, tuple) and kind[0] == 'date':
+            converted[col] = pd.to_datetime(df[col], format=kind[1], errors='coerce')
+        elif kind == 'category' and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            converted[col] = df[col].astype('category')
+    return df.assign(**converted) if converted else df
+
+
+def concat_typed(frames):
+    # Concaténation qui garde les colonnes catégorielles : catégories réunies et triées, comme à la lecture
+    frames = list(frames)
+    for col in frames[0].columns:
+        dtypes = [frame[col].dtype for frame in frames if col in frame.columns]
+        # Colonne numérique retombée en catégorie dans un seul bloc (valeur non numérique) :
+        # le repli vaut pour tous, sinon la concaténation donnerait une colonne d'objets mêlés
+        if (len(dtypes) == len(frames) and any(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes)
+                and not all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes)):
+            frames = [frame if isinstance(frame[col].dtype, pd.CategoricalDtype)
+                      else frame.assign(**{col: frame[col].astype('str').astype('category')}) for frame in frames]
+            dtypes = [frame[col].dtype for frame in frames]
+        if (len(dtypes) == len(frames) and all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes)
+                and any(dtype != dtypes[0] for dtype in dtypes[1:])):
+            # Bloc où la colonne est vide : catégories vides de type object, à écarter de l'union
+            parts = [frame[col] for frame in frames if len(frame[col].cat.categories)]
+            categories = union_categoricals(parts, sort_categories=True).categories
+            frames = [frame.assign(**{col: frame[col].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames)
+
+
+def validate(df, schema):
+    # Erreurs (fichier inutilisable) et avertissements sur une BDD typée
+    errors, warnings = [], []
+    missing = [col for col in schema['required'] if col not in df.columns]
+    if missing:
+        errors.append(f"Colonnes obligatoires absentes : {', '.join(missing)}")
+    if df.empty:
+        errors.append('Aucune ligne')
+    for prefix in schema['prefixes']:
+        if not any(col.startswith(prefix) for col in df.columns):
+            warnings.append(f'Aucune colonne {prefix}*')
+    for col, kind in column_kinds(schema, df.columns).items():
+        if isinstance(kind, tuple) and kind[0] == 'date' and len(df):
+            share = df[col].isna().mean()
+            if share > 0:
+                warnings.append(f'{col} : {share:.1%} de dates manquantes ou illisibles')
+        elif kind == 'flag' and isinstance(df[col].dtype, pd.CategoricalDtype):
+            warnings.append(f'{col} : valeurs non numériques')
+    return errors, warnings
+
+
+def memory_report(before, after):
+    # Empreinte mémoire par colonne avant/après application du schéma (et projection des colonnes)
+    read = before.columns.isin(after.columns)
+    report = pd.DataFrame({
+        'dtype avant': before.dtypes.astype(str),
+        'dtype après': after.dtypes.reindex(before.columns).astype(str).where(read, 'non lue'),
+        'octets avant': before.memory_usage(deep=True, index=False),
+        'octets après': after.memory_usage(deep=True, index=False).reindex(before.columns).fillna(0).astype('int64'),
+    })
+    report['gain'] = (report['octets avant'] / report['octets après']).round(1).where(read)
+    report.loc['TOTAL'] = ['', '', report['octets avant'].sum(), report['octets après'].sum(),
+                           round(report['octets avant'].sum() / report['octets après'].sum(), 1)]
+    return report
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+# Saisons malgaches, dans l'ordre de l'année
+SEASONS = ['Fahavratra (pluie)', 'Fararano (automne)', 'Ritinina (hiver)', 'Lohataona (été)']
+
+# Date de début (mois, jour) de chaque saison, par région
+DEFAULT_REGION = 'Madagascar'
+SEASON_CALENDARS = {
+    DEFAULT_REGION: {
+        'Fararano (automne)': (3, 15),
+        'Ritinina (hiver)': (6, 15),
+        'Lohataona (été)': (9, 15),
+        'Fahavratra (pluie)': (12, 15),
+    },
+}
+
+# Région des CTARs dont le calendrier diffère du calendrier national (id_ctar -> région)
+CTAR_REGIONS = {}
+
+
+def _season_codes(months, days, calendar):
+    starts = sorted((month * 100 + day, SEASONS.index(name)) for name, (month, day) in calendar.items())
+    bounds = np.array([start for start, _ in starts])
+    codes = np.array([code for _, code in starts], dtype='int8')
+    # Dernière saison commencée ; avant le premier début de l'année, l'indice -1
+    # renvoie la saison commencée l'année précédente
+    return codes[np.searchsorted(bounds, months * 100 + days, side='right') - 1]
+
+
+def assign_season(dates, regions=None):
+    # Saison de chaque date (catégorielle), selon le calendrier de la région du CTAR
+    valid = dates.notna().to_numpy()
+    months = dates.dt.month.fillna(0).to_numpy(dtype='int64')
+    days = dates.dt.day.fillna(0).to_numpy(dtype='int64')
+
+    if regions is None:
+        row_regions = np.full(len(dates), DEFAULT_REGION, dtype=object)
+    else:
+        regions = regions.astype('category')
+        # Une région par catégorie puis par ligne ; le code -1 (id_ctar manquant) prend la dernière valeur
+        by_category = [CTAR_REGIONS.get(ctar) for ctar in regions.cat.categories]
+        by_category = [r if r in SEASON_CALENDARS else DEFAULT_REGION for r in by_category] + [DEFAULT_REGION]
+        row_regions = np.array(by_category, dtype=object)[regions.cat.codes.to_numpy()]
+
+    codes = np.full(len(dates), -1, dtype='int8')
+    for region, calendar in SEASON_CALENDARS.items():
+        mask = valid & (row_regions == region)
+        codes[mask] = _season_codes(months[mask], days[mask], calendar)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=SEASONS), index=dates.index)
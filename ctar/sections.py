@@ -0,0 +1,18 @@
+import streamlit as st
+
+
+def lazy_section(label, render, key, expanded=False):
+    """Section repliable dont le contenu n'est calculé qu'une fois ouverte.
+
+    L'expander et son contenu forment un fragment Streamlit : ouvrir ou fermer
+    la section, ou changer un de ses widgets, ne réexécute que la section et
+    non toute la page. `render()` affiche le contenu dans l'expander.
+    """
+    def section():
+        expander = st.expander(label, expanded=expanded, key=key, on_change='rerun')
+        # Section fermée : ni agrégation ni figure
+        if expander.open:
+            with expander:
+                render()
+
+    st.fragment(section, key=f'{key}_section')()
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import tempfile
+
+try:
+    import pyarrow as pa
+except ImportError:  # pyarrow absent : pas d'instantanés, chaque processus relit le CSV
+    pa = None
+
+from ctar.columns import needed_columns
+
+# Dossier local partagé par les processus serveur ('' pour désactiver les instantanés)
+SNAPSHOT_DIR = os.environ.get('CTAR_SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'ctar-snapshots'))
+# Taille maximale du dossier ; les instantanés les plus anciens sont supprimés au-delà (en Mo)
+SNAPSHOT_MAX_MB = int(os.environ.get('CTAR_SNAPSHOT_MAX_MB', 4096))
+
+
+def enabled():
+    return pa is not None and bool(SNAPSHOT_DIR)
+
+
+def _private_dir(create=False):
+    # Instantanés = données patients : dossier 0700 de l'utilisateur des processus serveur, fichiers 0600.
+    # Un dossier appartenant à un autre utilisateur (ex. créé d'avance dans /tmp) n'est ni lu ni écrit.
+    if create:
+        os.makedirs(SNAPSHOT_DIR, mode=0o700, exist_ok=True)
+    try:
+        stat = os.stat(SNAPSHOT_DIR)
+    except FileNotFoundError:
+        return False
+    if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+        return False
+    if create and stat.st_mode & 0o077:
+        os.chmod(SNAPSHOT_DIR, 0o700)
+    return True
+
+
+def snapshot_path(key, schema):
+    # Le nom dépend aussi du schéma et des colonnes lues : un schéma modifié ou une page
+    # déclarant une nouvelle colonne n'utilise pas un ancien instantané
+    if schema is None:
+        return os.path.join(SNAPSHOT_DIR, f'{key}-brut.arrow')
+    columns = needed_columns(schema)
+    declaration = (schema, None if columns is None else sorted(columns))
+    tag = hashlib.blake2b(repr(declaration).encode(), digest_size=4).hexdigest()
+    return os.path.join(SNAPSHOT_DIR, f"{key}-{schema['name']}-{tag}.arrow")
+
+
+def read_snapshot(key, schema):
+    # BDD typée lue depuis son fichier Arrow IPC, ouvert en mémoire partagée (mmap) ; None si absent
+    if not enabled() or not _private_dir():
+        return None
+    path = snapshot_path(key, schema)
+    try:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    # split_blocks : les colonnes numériques sans valeur manquante restent adossées au mmap
+    return table.to_pandas(split_blocks=True)
+
+
+def write_snapshot(key, schema, frame):
+    # Écrit l'instantané une seule fois ; non compressé pour rester lisible par mmap
+    if not enabled():
+        return None
+    path = snapshot_path(key, schema)
+    if os.path.exists(path):
+        return path
+    try:
+        table = pa.Table.from_pandas(frame, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Colonne de types mélangés : le fichier sera relu depuis le CSV
+        return None
+    if not _private_dir(create=True):
+        return None
+    # Écriture dans un fichier temporaire puis renommage : un autre processus ne lit jamais un fichier partiel
+    fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        # mkstemp crée le fichier en 0600 : lisible par les processus serveur (même utilisateur) seulement
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _prune()
+    return path
+
+
+def _prune():
+    # Supprime les instantanés les moins récemment écrits au-delà de SNAPSHOT_MAX_MB
+    entries = []
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name.endswith('.arrow'):
+            stat = os.stat(os.path.join(SNAPSHOT_DIR, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= SNAPSHOT_MAX_MB * 1024 * 1024:
+            break
+        try:
+            os.unlink(os.path.join(SNAPSHOT_DIR, name))
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from ctar.cache import LRUCache
+
+# Budget des fichiers qu'aucune session n'utilise plus, gardés pour un nouveau téléchargement (en Mo)
+DATASET_CACHE_MB = int(os.environ.get('CTAR_DATASET_CACHE_MB', 512))
+# Une session inactive depuis ce délai ne retient plus ses fichiers (en minutes)
+DATASET_SESSION_TTL_MIN = int(os.environ.get('CTAR_DATASET_SESSION_TTL_MIN', 60))
+
+# Poignées des fichiers de la session : {nom du fichier: poignée}
+SESSION_KEY = 'datasets'
+
+
+class DatasetStore:
+    """Fichiers parsés partagés par toutes les sessions du processus.
+
+    Une session ne garde qu'une poignée ; le même contenu n'est chargé qu'une fois.
+    Un fichier retenu par au moins une session n'est jamais évincé. Quand plus
+    aucune session ne le retient (remplacé, ou session inactive depuis
+    `ttl` secondes), il passe dans un cache LRU borné en octets d'où il peut
+    être repris ou évincé.
+    """
+
+    def __init__(self, idle_bytes, ttl):
+        self.ttl = ttl
+        self._live = {}
+        self._holders = {}
+        self._idle = LRUCache(idle_bytes)
+        self._lock = threading.RLock()
+
+    def get(self, handle):
+        with self._lock:
+            dataset = self._live.get(handle)
+            return dataset if dataset is not None else self._idle.get(handle)
+
+    def add(self, handle, dataset):
+        with self._lock:
+            existing = self.get(handle)
+            if existing is not None:
+                return existing
+            self._idle.put(handle, dataset, dataset.nbytes)
+            return dataset
+
+    def acquire(self, handle, session, dataset=None):
+        # Retient le fichier pour la session ; `dataset` sert s'il n'est plus dans le store
+        with self._lock:
+            if handle not in self._live:
+                dataset = self._idle.pop(handle) or dataset
+                if dataset is None:
+                    return None
+                self._live[handle] = dataset
+            self._holders.setdefault(handle, {})[session] = time.monotonic()
+            return self._live[handle]
+
+    def touch(self, handle, session):
+        # Renouvelle la poignée de la session ; None si le fichier a été libéré
+        with self._lock:
+            self._expire()
+            holders = self._holders.get(handle)
+            if holders is None or session not in holders:
+                return self.acquire(handle, session)
+            holders[session] = time.monotonic()
+            return self._live[handle]
+
+    def release(self, handle, session):
+        with self._lock:
+            holders = self._holders.get(handle, {})
+            holders.pop(session, None)
+            if not holders and handle in self._live:
+                del self._holders[handle]
+                dataset = self._live.pop(handle)
+                self._idle.put(handle, dataset, dataset.nbytes)
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        for handle, holders in list(self._holders.items()):
+            for session, seen in list(holders.items()):
+                if seen < deadline:
+                    self.release(handle, session)
+
+
+store = DatasetStore(DATASET_CACHE_MB * 1024 * 1024, DATASET_SESSION_TTL_MIN * 60)
+
+
+def _session_id():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+def hold_datasets(datasets):
+    # Remplace les fichiers de la session par `datasets` ({nom: Dataset}) ; seules les poignées sont gardées
+    session = _session_id()
+    previous = st.session_state.get(SESSION_KEY, {})
+    handles = {name: dataset.handle for name, dataset in datasets.items()}
+    for dataset in datasets.values():
+        store.acquire(dataset.handle, session, dataset)
+    for handle in set(previous.values()) - set(handles.values()):
+        store.release(handle, session)
+    st.session_state[SESSION_KEY] = handles
+
+
+def session_datasets():
+    # {nom: Dataset} des fichiers de la session encore disponibles dans le store
+    session = _session_id()
+    datasets = {}
+    for name, handle in st.session_state.get(SESSION_KEY, {}).items():
+        dataset = store.touch(handle, session)
+        if dataset is not None:
+            datasets[name] = dataset
+    return datasets
@@ -2,22 +2,35 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 
+from ctar.cube import cube_slice, ipm_cube, peripheral_cube
+from ctar.figures import figure_key, plotly_charts
+from ctar.filters import filter_form
+from ctar.perf import perf_panel
+from ctar.prepare import prepared_peripheral
+from ctar.store import session_datasets
+
+# Colonnes utilisées par la page : seules les colonnes déclarées par les pages sont lues à l'ingestion
+COLUMNS = {
+    'ipm': ['age', 'sexe'],
+    'peripheral': ['age', 'sexe'],
+}
+
 # Titre page
 st.set_page_config(page_title="Ange et Sexe", page_icon="⚧️")
 st.title("Age et sexe des victimes.")
 
 
-def age_sexe(df_clean):
+def age_sexe(counts):
+    # Nombre de patients par pair (age, sexe), lu dans le cube de comptage
+    counts = counts.reset_index(name='count')
     # Colonne 'age' est de type numerique
-    df_clean['age'] = pd.to_numeric(df_clean['age'], errors='coerce')
+    counts['age'] = pd.to_numeric(counts['age'], errors='coerce')
     # L'âge des patients ne peut pas être au dessus de 120ans
-    df_clean=df_clean[df_clean['age']<=120]
-
-    # Compter les pairs (age, sexe) non nulles
-    not_null_pairs = df_clean[['age', 'sexe']].notnull().all(axis=1).sum()
+    counts = counts[(counts['age'] <= 120) & counts['sexe'].notna()]
 
-    # Grouper et compter l'occurence des pairs (age, sexe)
-    age_sex_counts = df_clean.groupby(['age', 'sexe']).size().reset_index(name='count')
+    # Grouper et compter l'occurence des pairs (age, sexe) non nulles
+    age_sex_counts = counts.groupby(['age', 'sexe'], observed=True)['count'].sum().reset_index()
+    not_null_pairs = age_sex_counts['count'].sum()
 
     # Sort by age (ensured to be numeric)
     age_sex_counts = age_sex_counts.sort_values(by='age')
@@ -57,68 +70,56 @@ def age_sexe(df_clean):
         )
     )
 
-    st.plotly_chart(fig)
+    return fig
 
 
 # Main
-if 'dataframes' in st.session_state:
-    dataframes = st.session_state['dataframes']
+# Fichiers de la session (poignées vers le store partagé entre sessions)
+datasets = session_datasets()
+if datasets:
 
-    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(dataframes.keys()))
+    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(datasets.keys()))
 
     if selected_file:
-        df = dataframes[selected_file]
+        dataset = datasets[selected_file]
 
         # BDD CTAR IPM : 
-        if selected_file == "CTAR_ipmdata20022024_cleaned.csv":
-            # 1 patient = 1 ID ref_mordu
-            df = df.drop_duplicates(subset=['ref_mordu'])
+        if dataset.schema_name == 'ipm':
+            # 1 patient = 1 ID ref_mordu (cube calculé une seule fois par fichier)
             st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-            age_sexe(df)
+            plotly_charts(figure_key(dataset, 'Age et Sexe'), lambda: age_sexe(ipm_cube(dataset, ['age', 'sexe'])))
 
         # BDD CTAR périphériques
-        elif selected_file == "CTAR_peripheriquedata20022024_cleaned.csv":
+        elif dataset.schema_name == 'peripheral':
 
-            #  Ne pas comptabiliser les lignes sans ID 'id_ctar' = CTAR périphériques inconnues 
-            df = df.dropna(subset=['id_ctar'])
-            df = df.dropna(subset=['date_de_consultation'])
+            # BDD nettoyée une seule fois par fichier : lignes sans 'id_ctar' ou sans date exclues, années <= 2024
+            df = prepared_peripheral(dataset)
 
-            # Liste des CTARs périphériques pour leur sélection
+            # Liste des CTARs périphériques et des années pour leur sélection
             unique_ctars = df['id_ctar'].unique()
+            unique_year = df['Annee'].unique()
+            cube = peripheral_cube(dataset, ['age', 'sexe'])
 
-            df['date_de_consultation']=pd.to_datetime(df['date_de_consultation'])
-
-            df['Annee'] = df['date_de_consultation'].dt.year
-            df['Annee']=df['Annee'].astype(int)
-            df=df[df['Annee']<=2024]
-            unique_year=df['Annee'].unique()
-
-            # Analyse de l'ensemble des CTAR périphériques
-            all_ctars_selected = st.checkbox("Sélectionnez tous les CTARs")
-            selected_year = st.multiselect(
-                    "Sélectionnez une ou plusieurs année(s)",
-                    options=sorted(list(unique_year)))
+            # Filtre CTARs / années de la sidebar, validé par « Appliquer » et partagé par les pages
+            all_ctars_selected, selected_ctars, selected_year = filter_form(unique_ctars, unique_year)
 
             if not all_ctars_selected:
-                selected_ctars = st.multiselect(
-                    "Sélectionnez un ou plusieurs CTARs",
-                    options=list(unique_ctars))
                 if not selected_ctars or not selected_year:
                     st.warning("Veuillez sélectionner au moins un CTAR et une année pour afficher l'analyse.")
                 else:
-                    df= df[df['id_ctar'].isin(selected_ctars)&df['Annee'].isin(selected_year)]
                     st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                    age_sexe(df)
+                    plotly_charts(figure_key(dataset, 'Age et Sexe', id_ctar=selected_ctars, Annee=selected_year),
+                                  lambda: age_sexe(cube_slice(cube, ['age', 'sexe'], id_ctar=selected_ctars, Annee=selected_year)))
             elif all_ctars_selected and selected_year:  
                 st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                df= df[df['Annee'].isin(selected_year)]
-                age_sexe(df) 
+                plotly_charts(figure_key(dataset, 'Age et Sexe', Annee=selected_year),
+                              lambda: age_sexe(cube_slice(cube, ['age', 'sexe'], Annee=selected_year)))
             elif all_ctars_selected and not selected_year:
                 st.warning("Veuillez sélectionner au moins une année pour afficher l'analyse.")
 
 
         else:
-            st.warning('Veuillez sélectionner un fichier entre "CTAR_peripheriquedata20022024_cleaned.csv" et "CTAR_ipmdata20022024_cleaned.csv".')        
+            st.warning("Colonnes du fichier non reconnues : veuillez sélectionner une BDD CTAR IPM ou périphérique.")
 
 else:
     st.error("Aucun fichier n'a été téléchargé. Veuillez retourner à la page d'accueil pour télécharger un fichier.")
@@ -127,3 +128,5 @@ else:
 # Sidebar de la page
 with st.sidebar.container():
     st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
+
+perf_panel('Age et Sexe')
@@ -2,6 +2,20 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 
+from ctar.cube import cube_slice, ipm_cube, peripheral_cube
+from ctar.figures import figure_key, plotly_charts
+from ctar.filters import filter_form
+from ctar.perf import perf_panel
+from ctar.prepare import prepared_peripheral
+from ctar.sections import lazy_section
+from ctar.store import session_datasets
+
+# Colonnes utilisées par la page : seules les colonnes déclarées par les pages sont lues à l'ingestion
+COLUMNS = {
+    'ipm': ['animal', 'typanim'],
+    'peripheral': ['espece', 'dev_carac'],
+}
+
 # Titre page
 st.set_page_config(page_title="Espèce responsable et mode de vie.", page_icon="🐕")
 st.title("Espèce responsable et leur mode de vie.")
@@ -17,8 +31,9 @@ label_mapping = {
     'G': 'Domestique mort'
 }
 
-def create_donut_chart(df, label_col, count_col, title, is_peripherique=False):
-            counts = df[label_col].value_counts().reset_index()
+def create_donut_chart(counts, label_col, count_col, title, is_peripherique=False):
+            # Effectifs indexés par modalité (modalités inconnues ou absentes ignorées)
+            counts = counts[counts.index.notna() & (counts > 0)].sort_values(ascending=False).reset_index()
             counts.columns = [label_col, count_col]
 
             fig = go.Figure(go.Pie(
@@ -42,8 +57,9 @@ def create_donut_chart(df, label_col, count_col, title, is_peripherique=False):
 
             return fig
 
-def create_pie_chart(df, label_col, count_col, title, is_peripherique=False):
-            counts = df[label_col].value_counts().reset_index()
+def create_pie_chart(counts, label_col, count_col, title, is_peripherique=False):
+            # Effectifs indexés par modalité (modalités inconnues ou absentes ignorées)
+            counts = counts[counts.index.notna() & (counts > 0)].sort_values(ascending=False).reset_index()
             counts.columns = [label_col, count_col]
 
             fig = go.Figure(go.Pie(
@@ -66,111 +82,131 @@ def create_pie_chart(df, label_col, count_col, title, is_peripherique=False):
             return fig
       
         
-def anim_mord(df):
-    
-    df_clean = df.drop_duplicates(subset=['ref_mordu'])
+def species_counts(counts, level):
+    # Effectifs par animal, du plus fréquent au moins fréquent
+    totals = counts.groupby(level=level, observed=True).sum()
+    return totals[totals > 0].sort_values(ascending=False)
 
-    # Selection box pour animal
-    selected_animal = st.selectbox("Sélectionnez un animal pour voir le type d'animal", options=df_clean['animal'].dropna().unique())
 
-    # Filter la BDD pour l'animal sélectionné
-    filtered_df = df_clean[df_clean['animal'] == selected_animal]
+def anim_mord(counts, selected_animal):
+    # Nombre de patients par (animal, typanim), lu dans le cube de comptage ; filtré pour l'animal sélectionné
+    typanim_counts = counts[counts.index.get_level_values('animal') == selected_animal].droplevel('animal')
 
     # Remplacer dans le colonne 'typanim' lettres par valuers pour la légende de la visualisation
-    filtered_df['typanim'] = filtered_df['typanim'].map(label_mapping)
+    typanim_counts.index = typanim_counts.index.map(label_mapping)
 
     # Visualisation pour le mode de vie de l'animal
-    fig_typanim = create_donut_chart(filtered_df, 'typanim', 'count', f"Répartition du mode de vie de l'animal pour : {len(filtered_df)} {selected_animal}(s) ")
-    st.plotly_chart(fig_typanim, use_container_width=True)
-
-    # Selectionnez d'autres animaux à analyser
-    additional_animals = df_clean['animal'].value_counts().index.tolist()
-    selected_additional = st.multiselect("Sélectionnez d'autres animaux à afficher", options=additional_animals, default=additional_animals[:4])
+    return create_donut_chart(typanim_counts, 'typanim', 'count', f"Répartition du mode de vie de l'animal pour : {typanim_counts.sum()} {selected_animal}(s) ")
 
+def anim_mord_species(counts, selected_additional):
     # Visualisation pour l(es) animal(aux) sélectionné(s)
-    if selected_additional:
-        filtered_additional = df_clean[df_clean['animal'].isin(selected_additional)]
-        fig_additional_animals = create_pie_chart(filtered_additional, 'animal', 'count', f"Répartition des espèces responsables (tout type de contact) ({len(filtered_additional)} animaux)")
-        st.plotly_chart(fig_additional_animals, use_container_width=True)
+    animal_counts = species_counts(counts, 'animal')
+    filtered_additional = animal_counts[animal_counts.index.isin(selected_additional)]
+    return create_pie_chart(filtered_additional, 'animal', 'count', f"Répartition des espèces responsables (tout type de contact) ({filtered_additional.sum()} animaux)")
 
-def anim_mord_perif(df):
-    df = df.dropna(subset=['espece'])
-    selected_animal = st.selectbox("Sélectionnez un animal pour voir le type d'animal", options=df['espece'].dropna().unique())
+def known_dev_carac(counts):
+    # Modes de vie renseignés seulement ('nan-nan', 'nan-...' exclus)
+    dev_carac = counts.index.get_level_values('dev_carac').astype(str)
+    return counts[~dev_carac.str.contains('nan-nan|nan-|nan-|-nan', regex=True)]
 
-    df = df[~df['dev_carac'].astype(str).str.contains('nan-nan|nan-|nan-|-nan', regex=True)]
-
-    # Selectionnez d'autres animaux à analyser
-    additional_animals = df['espece'].value_counts().index.tolist()
+def anim_mord_perif(counts, selected_animal):
+    # Nombre de patients par (espece, dev_carac), lu dans le cube de comptage
+    counts = known_dev_carac(counts)
 
     # Visualisation pour le mode de vie de l'animal
-    animal_type = df[df['espece']==selected_animal]
-    fig_typanim_ctar = create_donut_chart(animal_type, 'dev_carac', 'count', f"Répartition du mode de vie de l'animal pour : {len(df[df.espece==selected_animal])}  {selected_animal}(s) ", is_peripherique=True)
-    st.plotly_chart(fig_typanim_ctar, use_container_width=True)
+    animal_type = counts[counts.index.get_level_values('espece') == selected_animal].droplevel('espece')
+    return create_donut_chart(animal_type, 'dev_carac', 'count', f"Répartition du mode de vie de l'animal pour : {animal_type.sum()}  {selected_animal}(s) ", is_peripherique=True)
 
-    selected_additional = st.multiselect("Sélectionnez d'autres animaux à afficher", options=additional_animals, default=additional_animals[:4])
-            
+def anim_mord_perif_species(counts, selected_additional):
     # Visualisation pour l(es) animal(aux) sélectionné(s)
-    if selected_additional:
-        filtered_additional = df[df['espece'].isin(selected_additional)]
-        fig_additional_animals = create_pie_chart(filtered_additional, 'espece', 'count', f"Répartition des espèces responsables (tout type de contact) ({len(filtered_additional)} animaux/animal)", is_peripherique=True)
-        st.plotly_chart(fig_additional_animals, use_container_width=True)
-            
+    additional_counts = species_counts(known_dev_carac(counts), 'espece')
+    filtered_additional = additional_counts[additional_counts.index.isin(selected_additional)]
+    return create_pie_chart(filtered_additional, 'espece', 'count', f"Répartition des espèces responsables (tout type de contact) ({filtered_additional.sum()} animaux/animal)", is_peripherique=True)
+
+# (graphique du mode de vie, graphique des espèces, animaux proposés pour chacun) par type de BDD
+PLOTS = {
+    'ipm': (anim_mord, anim_mord_species,
+            lambda counts: species_counts(counts, 'animal').index.tolist(),
+            lambda counts: species_counts(counts, 'animal').index.tolist()),
+    'peripheral': (anim_mord_perif, anim_mord_perif_species,
+                   lambda counts: species_counts(counts, 'espece').index.tolist(),
+                   lambda counts: species_counts(known_dev_carac(counts), 'espece').index.tolist()),
+}
+
+def show_animal_sections(dataset, counts, **filters):
+    # Deux sections indépendantes : un widget de l'une ne réexécute qu'elle, et la
+    # répartition des espèces n'est calculée qu'à l'ouverture de sa section. Les widgets
+    # sont hors des fonctions de tracé : les figures sont mises en cache par sélection.
+    lifestyle, species, lifestyle_options, species_options = PLOTS[dataset.schema_name]
+
+    def render_lifestyle():
+        # Tranche du cube lue seulement quand la section est ouverte (animaux proposés, figure)
+        animal_counts = counts()
+        # Selection box pour animal
+        selected_animal = st.selectbox("Sélectionnez un animal pour voir le type d'animal",
+                                       options=lifestyle_options(animal_counts))
+        plotly_charts(figure_key(dataset, 'Animal', animal=selected_animal, **filters),
+                      lambda: lifestyle(animal_counts, selected_animal), use_container_width=True)
+
+    def render_species():
+        # Selectionnez d'autres animaux à analyser
+        animal_counts = counts()
+        additional_animals = species_options(animal_counts)
+        selected_additional = st.multiselect("Sélectionnez d'autres animaux à afficher", options=additional_animals,
+                                             default=additional_animals[:4])
+        if selected_additional:
+            plotly_charts(figure_key(dataset, 'Animal espèces', animaux=selected_additional, **filters),
+                          lambda: species(animal_counts, selected_additional), use_container_width=True)
+
+    lazy_section("Mode de vie de l'animal", render_lifestyle, key='animal_mode_de_vie', expanded=True)
+    lazy_section("Répartition des espèces responsables", render_species, key='animal_especes')
+
 
 # Main 
-if 'dataframes' in st.session_state:
-    dataframes = st.session_state['dataframes']
+# Fichiers de la session (poignées vers le store partagé entre sessions)
+datasets = session_datasets()
+if datasets:
 
-    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(dataframes.keys()))
+    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(datasets.keys()))
 
     if selected_file:
-        df = dataframes[selected_file]
+        dataset = datasets[selected_file]
 
         # BDD CTAR IPM
-        if selected_file == "CTAR_ipmdata20022024_cleaned.csv":
-            anim_mord(df)
+        if dataset.schema_name == 'ipm':
+            # 1 patient = 1 ID ref_mordu (cube calculé une seule fois par fichier)
+            show_animal_sections(dataset, lambda: ipm_cube(dataset, ['animal', 'typanim']))
 
         #  BDD CTAR Périphériques
-        elif selected_file == "CTAR_peripheriquedata20022024_cleaned.csv":
-            #  Ne pas comptabiliser les lignes sans ID 'id_ctar' = CTAR périphériques inconnues 
-            df = df.dropna(subset=['id_ctar'])
-            df = df.dropna(subset=['date_de_consultation'])
+        elif dataset.schema_name == 'peripheral':
+            # BDD nettoyée une seule fois par fichier : lignes sans 'id_ctar' ou sans date exclues, années <= 2024
+            df = prepared_peripheral(dataset)
 
-            # Liste des CTARs périphériques pour leur sélection
+            # Liste des CTARs périphériques et des années pour leur sélection
             unique_ctars = df['id_ctar'].unique()
+            unique_year = df['Annee'].unique()
+            cube = peripheral_cube(dataset, ['espece', 'dev_carac'])
 
-            df['date_de_consultation']=pd.to_datetime(df['date_de_consultation'])
-
-            df['Annee'] = df['date_de_consultation'].dt.year
-            df=df[df['Annee']<=2024]
-            df['Annee']=df['Annee'].astype(int)
-            unique_year=df['Annee'].unique()
-
-            # Analyse de l'ensemble des CTAR périphériques
-            all_ctars_selected = st.checkbox("Sélectionnez tous les CTARs")
-            selected_year = st.multiselect(
-                    "Sélectionnez une ou plusieurs année(s)",
-                    options=sorted(list(unique_year)))
+            # Filtre CTARs / années de la sidebar, validé par « Appliquer » et partagé par les pages
+            all_ctars_selected, selected_ctars, selected_year = filter_form(unique_ctars, unique_year)
 
             if not all_ctars_selected:
-                selected_ctars = st.multiselect(
-                    "Sélectionnez un ou plusieurs CTARs",
-                    options=list(unique_ctars))
                 if not selected_ctars or not selected_year:
                     st.warning("Veuillez sélectionner au moins un CTAR et une année pour afficher l'analyse.")
                 else:
-                    df= df[df['id_ctar'].isin(selected_ctars)&df['Annee'].isin(selected_year)]
                     st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                    anim_mord_perif(df)
+                    show_animal_sections(dataset, lambda: cube_slice(cube, ['espece', 'dev_carac'], id_ctar=selected_ctars, Annee=selected_year),
+                                         id_ctar=selected_ctars, Annee=selected_year)
             elif all_ctars_selected and selected_year:  
                 st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                df= df[df['Annee'].isin(selected_year)]
-                anim_mord_perif(df) 
+                show_animal_sections(dataset, lambda: cube_slice(cube, ['espece', 'dev_carac'], Annee=selected_year),
+                                     Annee=selected_year)
             elif all_ctars_selected and not selected_year:
                 st.warning("Veuillez sélectionner au moins une année pour afficher l'analyse.")
 
 
         else:
-            st.warning('Veuillez sélectionner un fichier entre "CTAR_peripheriquedata20022024_cleaned.csv" et "CTAR_ipmdata20022024_cleaned.csv".')        
+            st.warning("Colonnes du fichier non reconnues : veuillez sélectionner une BDD CTAR IPM ou périphérique.")
 
            
 
@@ -181,3 +217,4 @@ else:
 with st.sidebar.container():
     st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
 
+perf_panel('Animal mordant et mode de vie')
@@ -4,42 +4,25 @@ import plotly.graph_objects as go
 import plotly.express as px
 import plotly.colors as pc
 
+from ctar.contacts import CONTACT_COLUMNS, contact_counts, ipm_contact_cube, peripheral_contact_cube
+from ctar.figures import figure_key, plotly_charts
+from ctar.filters import filter_form
+from ctar.perf import perf_panel
+from ctar.prepare import prepared_peripheral
+from ctar.store import session_datasets
+
+# Colonnes utilisées par la page : seules les colonnes déclarées par les pages sont lues à l'ingestion
+COLUMNS = CONTACT_COLUMNS
+
 # Page titre
 st.set_page_config(page_title="LPS", page_icon="👅")
 st.title("Exposition catégorie 1 : Léchage sur Peau Saine (LPS).")
 
 
-def plot_cat1_ipm(ipm):
-    
-    # 1 patient = 1 ID ref_mordu 
-    ipm=ipm.drop_duplicates(subset=['ref_mordu'])
-    
-    # Définir les tranches d'âge (de 5 en 5)
-    bins = list(range(0, 105, 5)) + [float('inf')]
-    labels = [f'{i}-{i+4}' for i in bins[:-2]] + ['100+']
-    age_groups = pd.cut(ipm['age'], bins=bins, labels=labels, right=False)
-    ipm['Age Group'] = age_groups
-
-    # Correspondance valeurs parties du corps pour la légende
-    body_parts = {
-            'Tête': 'tet_cont',
-            'Bras et avant-bras': 'm_sup_cont',
-            'Main': 'ext_s_cont',
-            'Cuisse et Jambe': 'm_inf_cont',
-            'Pied': 'ext_i_cont',
-            'Abdomen': 'abdo_cont',
-            'Dos': 'dos_cont',
-            'Parties génitales': 'geni_cont'
-        }
-
-    # Sous tableau pour compter le nombre de catégorie LPS pour chaque partie du corps et groupe d'âge
-    lps_counts = pd.DataFrame(columns=['Age Group', 'Body Part', 'LPS Count'])
-
-    # Remplir le tableau lps_counts
-    for part, column in body_parts.items():
-            part_counts = ipm[ipm[column] == 'LPS'].groupby('Age Group').size().reset_index(name='LPS Count')
-            part_counts['Body Part'] = part
-            lps_counts = pd.concat([lps_counts, part_counts], ignore_index=True)
+def plot_cat1_ipm(lps_counts):
+
+    # Nombre de LPS par partie du corps et groupe d'âge, lu dans le cube des contacts
+    lps_counts = lps_counts.rename(columns={'count': 'LPS Count'})
 
     # Visualisation
     fig = px.bar(
@@ -55,34 +38,10 @@ def plot_cat1_ipm(ipm):
 
     st.info('Pas de visualisation disponible.')
 
-def plot_cat1_peripheral(df):
-     
-    # Définir les tranches d'âge (de 5 en 5)
-    bins = list(range(0, 105, 5)) + [float('inf')]
-    labels = [f'{i}-{i+4}' for i in bins[:-2]] + ['100+']
-    age_groups = pd.cut(df['age'], bins=bins, labels=labels, right=False)
-    df['Age Group'] = age_groups
-
-    # Correspondance valeurs parties du corps pour la légende
-    body_parts = {
-            'Tête et Cou': 'singes_des_legions___1',
-            'Bras et Avant-bras': 'singes_des_legions___2',
-            'Main': 'singes_des_legions___3',
-            'Cuisse et Jambe': 'singes_des_legions___4',
-            'Pied': 'singes_des_legions___5',
-            'Autres': 'singes_des_legions___9',
-            'Dos et Torse': 'singes_des_legions___6',
-            'Parties génitales': 'singes_des_legions___7'
-        }
-
-    # Sous tableau pour compter le nombre de catégorie LPS pour chaque partie du corps et groupe d'âge
-    lps_counts = pd.DataFrame(columns=['Age Group', 'Body Part', 'LPS Count'])
-
-    # Remplir le tableau lps_counts
-    for part, column in body_parts.items():
-            part_counts = df[(df[column] == 1)&(df.type_contact___1=='OUI')].groupby('Age Group').size().reset_index(name='LPS Count')
-            part_counts['Body Part'] = part
-            lps_counts = pd.concat([lps_counts, part_counts], ignore_index=True)
+def plot_cat1_peripheral(lps_counts):
+
+    # Nombre de LPS par partie du corps et groupe d'âge, lu dans le cube des contacts
+    lps_counts = lps_counts.rename(columns={'count': 'LPS Count'})
 
     # Visualisation
     fig = px.bar(
@@ -96,66 +55,61 @@ def plot_cat1_peripheral(df):
         )
 
     
-    return (st.plotly_chart(fig, use_container_width=True))
+    return fig
 
 
 # Main
-if 'dataframes' in st.session_state:
-    dataframes = st.session_state['dataframes']
+# Fichiers de la session (poignées vers le store partagé entre sessions)
+datasets = session_datasets()
+if datasets:
 
-    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(dataframes.keys()))
+    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(datasets.keys()))
 
     if selected_file:
-        df = dataframes[selected_file]
+        dataset = datasets[selected_file]
 
         # BDD IPM CTAR
-        if selected_file == "CTAR_ipmdata20022024_cleaned.csv":
-            plot_cat1_ipm(df)
+        if dataset.schema_name == 'ipm':
+            # 1 patient = 1 ID ref_mordu (cube calculé une seule fois par fichier)
+            cube = ipm_contact_cube(dataset, ['Body Part', 'Age Group'])
+            plot_cat1_ipm(contact_counts(cube, 'LPS', ['Body Part', 'Age Group']))
 
         #  BDD IPM périphériques
-        elif selected_file == "CTAR_peripheriquedata20022024_cleaned.csv":
-             #  Ne pas comptabiliser les lignes sans ID 'id_ctar' = CTAR périphériques inconnues 
-            df = df.dropna(subset=['id_ctar'])
-            df = df.dropna(subset=['date_de_consultation'])
+        elif dataset.schema_name == 'peripheral':
+             # BDD nettoyée une seule fois par fichier : lignes sans 'id_ctar' ou sans date exclues, années <= 2024
+            df = prepared_peripheral(dataset)
 
-            # Liste des CTARs périphériques pour leur sélection
+            # Liste des CTARs périphériques et des années pour leur sélection
             unique_ctars = df['id_ctar'].unique()
+            unique_year = df['Annee'].unique()
+            cube = peripheral_contact_cube(dataset, ['Body Part', 'Age Group'])
 
-            df['date_de_consultation']=pd.to_datetime(df['date_de_consultation'])
-
-            df['Annee'] = df['date_de_consultation'].dt.year
-            df['Annee']=df['Annee'].astype(int)
-            df=df[df['Annee']<=2024]
-            unique_year=df['Annee'].unique()
-
-            # Analyse de l'ensemble des CTAR périphériques
-            all_ctars_selected = st.checkbox("Sélectionnez tous les CTARs")
-            selected_year = st.multiselect(
-                    "Sélectionnez une ou plusieurs année(s)",
-                    options=sorted(list(unique_year)))
+            # Filtre CTARs / années de la sidebar, validé par « Appliquer » et partagé par les pages
+            all_ctars_selected, selected_ctars, selected_year = filter_form(unique_ctars, unique_year)
 
             if not all_ctars_selected:
-                selected_ctars = st.multiselect(
-                    "Sélectionnez un ou plusieurs CTARs",
-                    options=list(unique_ctars))
                 if not selected_ctars or not selected_year:
                     st.warning("Veuillez sélectionner au moins un CTAR et une année pour afficher l'analyse.")
                 else:
-                    df= df[df['id_ctar'].isin(selected_ctars)&df['Annee'].isin(selected_year)]
                     st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                    plot_cat1_peripheral(df)
+                    plotly_charts(figure_key(dataset, 'LPS', id_ctar=selected_ctars, Annee=selected_year),
+                                  lambda: plot_cat1_peripheral(contact_counts(cube, 'LPS', ['Body Part', 'Age Group'], id_ctar=selected_ctars, Annee=selected_year)),
+                                  use_container_width=True)
             elif all_ctars_selected and selected_year:  
                 st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                df= df[df['Annee'].isin(selected_year)]
-                plot_cat1_peripheral(df) 
+                plotly_charts(figure_key(dataset, 'LPS', Annee=selected_year),
+                              lambda: plot_cat1_peripheral(contact_counts(cube, 'LPS', ['Body Part', 'Age Group'], Annee=selected_year)),
+                              use_container_width=True)
             elif all_ctars_selected and not selected_year:
                 st.warning("Veuillez sélectionner au moins une année pour afficher l'analyse.")
         else:
-            st.warning('Veuillez sélectionner un fichier entre "CTAR_peripheriquedata20022024_cleaned.csv" et "CTAR_ipmdata20022024_cleaned.csv".')        
+            st.warning("Colonnes du fichier non reconnues : veuillez sélectionner une BDD CTAR IPM ou périphérique.")
   
 else:
     st.error("Aucun fichier n'a été téléchargé. Veuillez retourner à la page d'accueil pour télécharger un fichier.")
 
 # Sidebar de la page
 with st.sidebar.container():
-    st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
\ No newline at end of file
+    st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
+
+perf_panel('Exposition catégorie1')
@@ -1,34 +1,40 @@
 import streamlit as st
-import pandas as pd
 import plotly.graph_objects as go
 
+from ctar.cube import cube_slice, peripheral_cube
+from ctar.figures import figure_key, plotly_charts
+from ctar.filters import filter_form
+from ctar.perf import perf_panel
+from ctar.prepare import prepared_peripheral
+from ctar.store import session_datasets
+
+# Colonnes utilisées par la page : seules les colonnes déclarées par les pages sont lues à l'ingestion
+COLUMNS = {
+    'peripheral': ['heure_du_contact_cleaned', 'sexe', 'espece'],
+}
+
 # Titre page
 st.set_page_config(page_title="Heure de morsure", page_icon="🕒")
 st.title("Heure de morsure des patients.")
 
 
-def plot_hourly_sex_counts(df, selected_ctars): 
+# Heures et jours de la semaine en abscisse, dans l'ordre (et non dans l'ordre alphabétique)
+HEURES = list(range(24))
+JOURS = ['Lundi', 'Mardi', 'Mercredi', 'Jeudi', 'Vendredi', 'Samedi', 'Dimanche']
 
-   
-    
-    # Filter the dataframe by the selected CTARs
-    df_filtered = df[df['id_ctar'].isin(selected_ctars)]
 
-    if df_filtered.empty:
-        st.warning("Aucune donnée disponible pour les CTARs sélectionnés.")
-        return
+def hourly_counts(cube, **filters):
+    # Agrégat partagé par les figures : patients par heure, jour, sexe et espèce, heures inconnues exclues
+    return cube_slice(cube, ['heure', 'jour', 'sexe', 'espece'], heure_inconnue=[False], **filters)
+
 
-    # Drop rows where 'heure_du_contact_cleaned' contains '00:00' (midnight)
-    df_filtered = df_filtered[~df_filtered['heure_du_contact_cleaned'].astype(str).str.contains('00:00')]
-    # Extract hours and minutes for plotting
-    df_filtered[['Hour', 'Minute']] = df_filtered['heure_du_contact_cleaned'].str.split(':', expand=True)
-    
-    # Handle NaN values before conversion
-    df_filtered = df_filtered.dropna(subset=['Hour'])
-    df_filtered['Minute'] = pd.to_numeric(df_filtered['Minute'], errors='coerce').fillna(0).astype(int)
+def plot_hourly_sex_counts(counts):
 
-    # Group by time and sex to count occurrences
-    hourly_sex_counts = df_filtered.groupby(['Hour', 'sexe']).size().reset_index(name='count')
+    if counts.empty:
+        return None
+
+    # Group by hour and sex to count occurrences
+    hourly_sex_counts = counts.groupby(level=['heure', 'sexe'], observed=True).sum().reset_index(name='count')
 
     fig = go.Figure()
 
@@ -40,7 +46,7 @@ def plot_hourly_sex_counts(df, selected_ctars):
         df_sex = hourly_sex_counts[hourly_sex_counts['sexe'] == sex]
 
         fig.add_trace(go.Scatter(
-            x=df_sex['Hour'],
+            x=df_sex['heure'],
             y=df_sex['count'],
             mode='lines+markers',
             name='Homme' if sex == 'M' else 'Femme',
@@ -49,40 +55,25 @@ def plot_hourly_sex_counts(df, selected_ctars):
         ))
 
     fig.update_layout(
-        title=f'Heure de morsure par sexe pour {len(df_filtered)} patient(s) des CTARs périphériques.',
+        title=f'Heure de morsure par sexe pour {counts.sum()} patient(s) des CTARs périphériques.',
         xaxis=dict(
             title='Heures',
-            tickvals=hourly_sex_counts['Hour'].unique(), 
+            tickvals=HEURES,
             tickangle=0 
         ),
         yaxis=dict(title='Nombre de patients'),
         legend_title='Sexe'
     )
-    st.plotly_chart(fig)
-
+    return fig
 
-def plot_hourly_species_counts(df, selected_ctars):
 
-    
-    # Filter the dataframe by the selected CTARs
-    df_filtered = df[df['id_ctar'].isin(selected_ctars)]
+def plot_hourly_species_counts(counts):
 
-    # Drop rows where 'heure_du_contact_cleaned' contains '00:00' (midnight)
-    df_filtered = df_filtered[~df_filtered['heure_du_contact_cleaned'].astype(str).str.contains('00:00')]
+    if counts.empty:
+        return None
 
-    if df_filtered.empty:
-        st.warning("Aucune donnée disponible pour les CTARs sélectionnés.")
-        return
-
-    # Extract hours and minutes for plotting
-    df_filtered[['Hour', 'Minute']] = df_filtered['heure_du_contact_cleaned'].str.split(':', expand=True)
-    
-    # Handle NaN values before conversion
-    df_filtered = df_filtered.dropna(subset=['Hour'])
-    df_filtered['Minute'] = pd.to_numeric(df_filtered['Minute'], errors='coerce').fillna(0).astype(int)
-
-    # Group by time and species to count occurrences
-    hourly_species_counts = df_filtered.groupby(['Hour', 'espece']).size().reset_index(name='count')
+    # Group by hour and species to count occurrences
+    hourly_species_counts = counts.groupby(level=['heure', 'espece'], observed=True).sum().reset_index(name='count')
 
     fig = go.Figure()
 
@@ -96,7 +87,7 @@ def plot_hourly_species_counts(df, selected_ctars):
         df_species = hourly_species_counts[hourly_species_counts['espece'] == species]
 
         fig.add_trace(go.Scatter(
-            x=df_species['Hour'],
+            x=df_species['heure'],
             y=df_species['count'],
             mode='lines+markers',
             name=species,
@@ -105,77 +96,107 @@ def plot_hourly_species_counts(df, selected_ctars):
         ))
 
     fig.update_layout(
-        title=f'Heure de morsure par espèce pour {len(df_filtered)} patient(s) des CTARs périphériques.',
+        title=f'Heure de morsure par espèce pour {counts.sum()} patient(s) des CTARs périphériques.',
         xaxis=dict(
             title='Heures',
-            tickvals=sorted(hourly_species_counts['Hour'].unique()),  
+            tickvals=HEURES,
             tickangle=0  
         ),
         yaxis=dict(title="Nombre d'animaux"),
         legend_title='Espèce'
     )
 
-    st.plotly_chart(fig)
+    return fig
+
+
+def plot_hourly_weekday_heatmap(counts, species=None):
+    # Patients par heure et jour de la semaine (de consultation), pour une espèce ou toutes
+
+    if species is not None:
+        counts = counts[counts.index.get_level_values('espece') == species]
+    if counts.empty:
+        return None
+
+    # Grille 7 jours x 24 heures complète : une case sans morsure vaut 0
+    grid = (counts.groupby(level=['jour', 'heure']).sum()
+            .unstack('heure').reindex(index=range(len(JOURS)), columns=HEURES).fillna(0).astype('int64'))
+
+    fig = go.Figure(go.Heatmap(
+        z=grid.to_numpy(),
+        x=HEURES,
+        y=JOURS,
+        colorscale='Oranges',
+        colorbar=dict(title='Patients'),
+        hovertemplate='%{y} %{x} h : %{z} patient(s)<extra></extra>',
+    ))
+
+    fig.update_layout(
+        title=f"Heure de morsure par jour de consultation pour {counts.sum()} patient(s) "
+              f"({species or 'toutes espèces'}).",
+        xaxis=dict(title='Heures', tickvals=HEURES, tickangle=0),
+        yaxis=dict(title='Jour de consultation', autorange='reversed'),
+    )
+    return fig
+
+
+def show_hourly_counts(dataset, cube, species, **filters):
+    # Trois figures construites depuis un même agrégat, mises en cache par sélection
+    def build():
+        counts = hourly_counts(cube, **filters)
+        figures = [plot_hourly_sex_counts(counts), plot_hourly_species_counts(counts),
+                   plot_hourly_weekday_heatmap(counts, species)]
+        return [fig for fig in figures if fig is not None]
+
+    if not plotly_charts(figure_key(dataset, 'Heure', espece=species, **filters), build):
+        st.warning("Aucune donnée disponible pour les CTARs sélectionnés.")
 
 
 # Main 
-if 'dataframes' in st.session_state:
-    dataframes = st.session_state['dataframes']
+# Fichiers de la session (poignées vers le store partagé entre sessions)
+datasets = session_datasets()
+if datasets:
 
-    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(dataframes.keys()))
+    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(datasets.keys()))
 
     if selected_file:
-        df = dataframes[selected_file]
+        dataset = datasets[selected_file]
 
         # BDD CTAR IPM
-        if selected_file == "CTAR_ipmdata20022024_cleaned.csv":
+        if dataset.schema_name == 'ipm':
             st.warning("Donnée de l'heure de morsure non disponible pour CTAR IPM.")
 
         # BDD CTAR périphériques
-        elif selected_file == "CTAR_peripheriquedata20022024_cleaned.csv":
-            #  Ne pas comptabiliser les lignes sans ID 'id_ctar' = CTAR périphériques inconnues 
-            df = df.dropna(subset=['id_ctar'])
-            df = df.dropna(subset=['date_de_consultation'])
+        elif dataset.schema_name == 'peripheral':
+            # BDD nettoyée une seule fois par fichier : lignes sans 'id_ctar' ou sans date exclues, années <= 2024
+            df = prepared_peripheral(dataset)
 
-            # Liste des CTARs périphériques pour leur sélection
+            # Liste des CTARs périphériques et des années pour leur sélection
             unique_ctars = df['id_ctar'].unique()
+            unique_year = df['Annee'].unique()
+            # Heure entière et indicateur d'heure inconnue calculés une seule fois par fichier
+            cube = peripheral_cube(dataset, ['heure_inconnue', 'heure', 'jour', 'sexe', 'espece'])
 
-            df['date_de_consultation']=pd.to_datetime(df['date_de_consultation'])
-
-            df['Annee'] = df['date_de_consultation'].dt.year
-            df['Annee']=df['Annee'].astype(int)
-            df=df[df['Annee']<=2024]
-            unique_year=df['Annee'].unique()
-
-            # Analyse de l'ensemble des CTAR périphériques
-            all_ctars_selected = st.checkbox("Sélectionnez tous les CTARs")
-            selected_year = st.multiselect(
-                    "Sélectionnez une ou plusieurs année(s)",
-                    options=sorted(list(unique_year)))
+            # Filtre CTARs / années de la sidebar, validé par « Appliquer » et partagé par les pages
+            all_ctars_selected, selected_ctars, selected_year = filter_form(unique_ctars, unique_year)
+            # Espèce de la carte heure x jour (toutes par défaut)
+            selected_species = st.selectbox("Espèce pour la carte heure x jour",
+                                            options=['Toutes', 'Chien', 'Chat', 'Autre'])
+            species = None if selected_species == 'Toutes' else selected_species
 
             if not all_ctars_selected:
-                selected_ctars = st.multiselect(
-                    "Sélectionnez un ou plusieurs CTARs",
-                    options=list(unique_ctars))
                 if not selected_ctars or not selected_year:
                     st.warning("Veuillez sélectionner au moins un CTAR et une année pour afficher l'analyse.")
                 else:
-                    df= df[df['id_ctar'].isin(selected_ctars)&df['Annee'].isin(selected_year)]
                     st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                    plot_hourly_sex_counts(df, selected_ctars)
-
-                    plot_hourly_species_counts(df, selected_ctars)
+                    show_hourly_counts(dataset, cube, species, id_ctar=selected_ctars, Annee=selected_year)
             elif all_ctars_selected and selected_year:  
                 st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                df= df[df['Annee'].isin(selected_year)]
-                plot_hourly_sex_counts(df, unique_ctars)
-
-                plot_hourly_species_counts(df, unique_ctars) 
+                show_hourly_counts(dataset, cube, species, Annee=selected_year)
             elif all_ctars_selected and not selected_year:
                 st.warning("Veuillez sélectionner au moins une année pour afficher l'analyse.")
            
         else:
-            st.warning('Veuillez sélectionner un fichier entre "CTAR_peripheriquedata20022024_cleaned.csv" et "CTAR_ipmdata20022024_cleaned.csv".')        
+            st.warning("Colonnes du fichier non reconnues : veuillez sélectionner une BDD CTAR IPM ou périphérique.")
   
 else:
     st.error("Aucun fichier n'a été téléchargé. Veuillez retourner à la page d'accueil pour télécharger un fichier.")
@@ -183,3 +204,5 @@ else:
 # Sidebar de la page
 with st.sidebar.container():
     st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
+
+perf_panel('Heure de morsure')
@@ -2,6 +2,20 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
+import numpy as np
+
+from ctar.cube import cube_slice, peripheral_cube
+from ctar.figures import figure_key, plotly_charts
+from ctar.filters import filter_form
+from ctar.perf import perf_panel
+from ctar.prepare import ipm_patients, prepared_peripheral
+from ctar.store import session_datasets
+
+# Colonnes utilisées par la page : seules les colonnes déclarées par les pages sont lues à l'ingestion
+COLUMNS = {
+    'ipm': ['nbtet', 'nb_sup', 'nb_extr_s', 'nb_inf', 'nb_extr_i', 'nb_abdo', 'nb_dos', 'nb_genit'],
+    'peripheral': ['nb_lesion', 'ctar'],
+}
 
 # Titre page 
 st.set_page_config(page_title="Lésion", page_icon="🩹")
@@ -9,19 +23,13 @@ st.title("Nombre de lésions par patient.")
 
 
 def plot_cat1_ipm(ipm):
-    # 1 patient= 1 ID ref_mordu
-    ipm=ipm.drop_duplicates(subset=['ref_mordu'])
 
    # Nettoyage colonne nombre lésions : format integer  :TOUTE COLONNES NULLE ALORS  DROP 
     lesion_columns = ['nbtet', 'nb_sup', 'nb_extr_s', 'nb_inf', 'nb_extr_i', 'nb_abdo', 'nb_dos', 'nb_genit']
     for col in lesion_columns:
             ipm[col] = ipm[col].dropna().astype(int)
 
-    # Définir les tranches d'âge (de 5 en 5)
-    bins = list(range(0, 105, 5)) + [float('inf')]
-    labels = [f'{i}-{i+4}' for i in bins[:-2]] + ['100+']
-    age_groups = pd.cut(ipm['age'], bins=bins, labels=labels, right=False)
-    ipm['Age Group'] = age_groups 
+    # Tranches d'âge (de 5 en 5) : colonne 'Age Group' de la BDD préparée
 
     # Grouper par âge et calculer la moyenne et la médiane des lésions par partie du corps
     grouped = ipm.groupby('Age Group').agg({col: ['mean', 'median', 'var'] for col in lesion_columns}).reset_index()
@@ -91,38 +99,34 @@ def plot_cat1_ipm(ipm):
             margin=dict(b=250) 
         )
 
-    st.plotly_chart(fig, use_container_width=True)
+    return fig
 
-def plot_cat1_peripheral(ctar):
-    #Nettoyage cas particulier colonnes 'ctar' et 'nb_lesion'
-    ctar['nb_lesion'] = ctar['nb_lesion'].replace({
-            '01': '1', '02': '2', '03': '3', '04': '4', '05': '5', 
-            '06': '6', '07': '7', '08': '8', '09': '9', '022': '22', 
-            '052': '52', '002': '2', '021': '21'
-        })
-    ctar=ctar.dropna(subset=['nb_lesion'])
+def known_lesions(counts):
+    # Comptes par nombre de lésions (tranche du cube), lignes sans 'nb_lesion' exclues
+    counts = counts.groupby(level='nb_lesion').sum()
+    return counts[counts.index.notna() & (counts > 0)]
 
-    ctar.at[26659, 'ctar'] = 'Antsohihy'
-    ctar.at[36582, 'ctar'] = 'Morondava'
-    ctar.at[38479, 'ctar'] = 'Vangaindrano'
-    ctar.at[42574, 'ctar'] = 'Fianarantsoa'
-    ctar.at[42575, 'ctar'] = 'Fianarantsoa'
 
-   
-        # Fill NaNs with -1 and convert to int
-    #ctar['nb_lesion_filled'] = ctar['nb_lesion'].fillna(-1).astype(int)
+def lesion_statistics(counts):
+    # Moyenne, médiane et variance (n - 1) du nombre de lésions, calculées sur les comptes
+    counts = known_lesions(counts)
+    values = counts.index.to_numpy(dtype='float64')
+    weights = counts.to_numpy()
+    n = weights.sum()
+    mean = (values * weights).sum() / n
+    variance = (weights * (values - mean) ** 2).sum() / (n - 1) if n > 1 else np.nan
+    # Médiane : valeur(s) du milieu dans l'ordre des nombres de lésions
+    middle = np.searchsorted(np.cumsum(weights), [(n - 1) // 2, n // 2], side='right')
+    return mean, values[middle].mean(), variance
 
-    # Calculate statistics, ignoring the marker value for NaNs
-    mean_lesions = ctar[ctar['nb_lesion'] != -1]['nb_lesion'].mean()
-    median_lesions = ctar[ctar['nb_lesion'] != -1]['nb_lesion'].median()
-    variance_lesions = ctar[ctar['nb_lesion'] != -1]['nb_lesion'].var()
 
-        # Count the values 
-    value_counts = ctar['nb_lesion'].value_counts().sort_index()
+def plot_cat1_peripheral(counts):
+    # 'nb_lesion' (entier) et 'ctar' corrigés au chargement du fichier : règles de ctar.corrections
+    value_counts = known_lesions(counts)
 
     if (len(value_counts) - 1)>0:
-            # Convert the index to a list of strings for x-axis labeling, converting -1 back to 'NaN'
-        x_labels = [int(x) if x != -1 else 'NaN' for x in value_counts.index]
+        mean_lesions, median_lesions, variance_lesions = lesion_statistics(value_counts)
+        x_labels = [int(x) for x in value_counts.index]
 
          # Gradient de couleur (orange) basé sur le nombre de lésions
         dark_oranges = px.colors.sequential.Oranges[::-1] 
@@ -154,13 +158,16 @@ def plot_cat1_peripheral(ctar):
             ))
 
         fig.update_layout(
-                title=f'Distribution du nombre de lésions sur {len(ctar)} patients des CTAR périphériques.',
+                title=f'Distribution du nombre de lésions sur {value_counts.sum()} patients des CTAR périphériques.',
                 xaxis_title='Nombre de lésions',
                 yaxis_title='Nombre de patients',
                 xaxis=dict(tickmode='array', tickvals=x_labels, ticktext=x_labels),
                 template='plotly_white'
             )
 
+        # Statistiques gardées dans la figure : relues depuis le cache sans recalcul
+        fig.update_layout(meta=dict(mean=mean_lesions, median=median_lesions, variance=variance_lesions))
+
         fig.add_annotation(
                 x=len(x_labels) - 1,
                 y=max(value_counts.values),
@@ -171,65 +178,63 @@ def plot_cat1_peripheral(ctar):
                 font=dict(color='black', size=12)
             )
 
-        st.plotly_chart(fig, use_container_width=True)
+        return fig
+
 
-        st.subheader('Statistiques:')
-        st.write(f'Moyenne des lésions: {mean_lesions:.2f}')
-        st.write(f'Médiane des lésions: {median_lesions:.2f}')
-        st.write(f'Variance des lésions: {variance_lesions:.2f}')
-    else:
-         st.info("Pas de donnée pour ce CTAR périphérique.")
+def show_lesions(dataset, cube, **filters):
+    # Figure mise en cache par sélection : la tranche du cube n'est lue que pour la construire
+    figures = plotly_charts(figure_key(dataset, 'Lésion', **filters),
+                            lambda: plot_cat1_peripheral(cube_slice(cube, ['nb_lesion'], **filters)),
+                            use_container_width=True)
+    if not figures:
+        st.info("Pas de donnée pour ce CTAR périphérique.")
+        return
+    stats = figures[0].layout.meta
+    mean_lesions, median_lesions, variance_lesions = stats['mean'], stats['median'], stats['variance']
+    st.subheader('Statistiques:')
+    st.write(f'Moyenne des lésions: {mean_lesions:.2f}')
+    st.write(f'Médiane des lésions: {median_lesions:.2f}')
+    st.write(f'Variance des lésions: {variance_lesions:.2f}')
 
     
 # Main 
-if 'dataframes' in st.session_state:
-    dataframes = st.session_state['dataframes']
+# Fichiers de la session (poignées vers le store partagé entre sessions)
+datasets = session_datasets()
+if datasets:
 
-    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(dataframes.keys()))
+    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(datasets.keys()))
 
     if selected_file:
-        df = dataframes[selected_file]
+        dataset = datasets[selected_file]
 
         # BDD CTAR IPM
-        if selected_file == "CTAR_ipmdata20022024_cleaned.csv":
-            plot_cat1_ipm(df)
+        if dataset.schema_name == 'ipm':
+            # 1 patient = 1 ID ref_mordu (vue calculée une seule fois par fichier)
+            plotly_charts(figure_key(dataset, 'Lésion'), lambda: plot_cat1_ipm(ipm_patients(dataset)), use_container_width=True)
 
         # BDD CTAR périphérique
-        elif selected_file == "CTAR_peripheriquedata20022024_cleaned.csv":
-             #  Ne pas comptabiliser les lignes sans ID 'id_ctar' = CTAR périphériques inconnues 
-            df = df.dropna(subset=['id_ctar'])
-            df = df.dropna(subset=['date_de_consultation'])
+        elif dataset.schema_name == 'peripheral':
+             # BDD nettoyée une seule fois par fichier : lignes sans 'id_ctar' ou sans date exclues, années <= 2024
+            df = prepared_peripheral(dataset)
 
-            # Liste des CTARs périphériques pour leur sélection
+            # Liste des CTARs périphériques et des années pour leur sélection
             unique_ctars = df['id_ctar'].unique()
+            unique_year = df['Annee'].unique()
+            # Patients par nombre de lésions, CTAR et année : calculé une seule fois par fichier
+            cube = peripheral_cube(dataset, ['nb_lesion'])
 
-            df['date_de_consultation']=pd.to_datetime(df['date_de_consultation'])
-
-            df['Annee'] = df['date_de_consultation'].dt.year
-            df['Annee']=df['Annee'].astype(int)
-            df=df[df['Annee']<=2024]
-            unique_year=df['Annee'].unique()
-
-            # Analyse de l'ensemble des CTAR périphériques
-            all_ctars_selected = st.checkbox("Sélectionnez tous les CTARs")
-            selected_year = st.multiselect(
-                    "Sélectionnez une ou plusieurs année(s)",
-                    options=sorted(list(unique_year)))
+            # Filtre CTARs / années de la sidebar, validé par « Appliquer » et partagé par les pages
+            all_ctars_selected, selected_ctars, selected_year = filter_form(unique_ctars, unique_year)
 
             if not all_ctars_selected:
-                selected_ctars = st.multiselect(
-                    "Sélectionnez un ou plusieurs CTARs",
-                    options=list(unique_ctars))
                 if not selected_ctars or not selected_year:
                     st.warning("Veuillez sélectionner au moins un CTAR et une année pour afficher l'analyse.")
                 else:
-                    df= df[df['id_ctar'].isin(selected_ctars)&df['Annee'].isin(selected_year)]
                     st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                    plot_cat1_peripheral(df)
+                    show_lesions(dataset, cube, id_ctar=selected_ctars, Annee=selected_year)
             elif all_ctars_selected and selected_year:  
                 st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                df= df[df['Annee'].isin(selected_year)]
-                plot_cat1_peripheral(df) 
+                show_lesions(dataset, cube, Annee=selected_year)
             elif all_ctars_selected and not selected_year:
                 st.warning("Veuillez sélectionner au moins une année pour afficher l'analyse.")
            
@@ -240,3 +245,5 @@ else:
 # Sidebar de la page
 with st.sidebar.container():
     st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
+
+perf_panel('Lésion')
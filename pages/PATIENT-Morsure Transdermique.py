@@ -4,44 +4,27 @@ import plotly.graph_objects as go
 import plotly.express as px
 import plotly.colors as pc
 
+from ctar.contacts import CONTACT_COLUMNS, contact_counts, ipm_contact_cube, peripheral_contact_cube
+from ctar.figures import figure_key, plotly_charts
+from ctar.filters import filter_form
+from ctar.perf import perf_panel
+from ctar.prepare import prepared_peripheral
+from ctar.sections import lazy_section
+from ctar.store import session_datasets
+
+# Colonnes utilisées par la page : seules les colonnes déclarées par les pages sont lues à l'ingestion
+COLUMNS = CONTACT_COLUMNS
+
 # Titre page
 st.set_page_config(page_title="MT", page_icon="🐾")
 st.title("Facteurs de risque des Morsures Transdermiques (MT).")
 
 
-def plot_MT_ipm(ipm):
-
-    # 1 patient = 1 ID ref_mordu
-    ipm=ipm.drop_duplicates(subset=['ref_mordu'])
-
-    # Définir les tranches d'âge (de 5 en 5)
-    bins = list(range(0, 105, 5)) + [float('inf')]
-    labels = [f'{i}-{i+4}' for i in bins[:-2]] + ['100+']
-    age_groups = pd.cut(ipm['age'], bins=bins, labels=labels, right=False)
-    ipm['Age Group'] = age_groups
-
-    # Renommer partie du corps pour une légende plus visible
-    body_parts = {
-            'Tête': 'tet_cont',
-            'Bras et avant-bras': 'm_sup_cont',
-            'Main': 'ext_s_cont',
-            'Cuisse et Jambe': 'm_inf_cont',
-            'Pied': 'ext_i_cont',
-            'Abdomen': 'abdo_cont',
-            'Dos': 'dos_cont',
-            'Parties génitales': 'geni_cont'
-        }
-
-    # Sous tableau pour compter le nombre de catégorie MT pour chaque partie du corps, genre et groupe d'âge
-    mt_counts = pd.DataFrame(columns=['Age Group', 'Body Part', 'Gender', 'MT Count'])
+def plot_MT_ipm(cube):
 
-    # Remplir le tableau mt_counts
-    for part, column in body_parts.items():
-            for gender in ipm['sexe'].dropna().unique():
-                part_counts = ipm[(ipm[column] == 'MT') & (ipm['sexe'] == gender)].groupby('Age Group').size().reset_index(name='MT Count')
-                part_counts['Body Part'] = part
-                part_counts['Gender'] = gender
-                mt_counts = pd.concat([mt_counts, part_counts], ignore_index=True)
+    # Nombre de MT par partie du corps, genre et groupe d'âge, lu dans le cube des contacts
+    mt_counts = contact_counts(cube, 'MT', ['Body Part', 'sexe', 'Age Group'])
+    mt_counts = mt_counts.rename(columns={'sexe': 'Gender', 'count': 'MT Count'})
 
     # Visualisation
     fig = px.bar(
@@ -72,7 +55,10 @@ def plot_MT_ipm(ipm):
             margin=dict(b=100)  
         )
 
-    st.plotly_chart(fig)
+    return fig
+
+
+def plot_MT_ipm_animal(cube):
 
     # Correspondance valeurs type d'animal pour la légende
     animal_type_mapping = {
@@ -85,20 +71,11 @@ def plot_MT_ipm(ipm):
             'G': 'Domestique Mort'
         }
 
-    ipm['typanim'] = ipm['typanim'].map(animal_type_mapping)
-
-    # Sous tableau pour compter le nombre de catégorie MT pour chaque partie du corps, genre et groupe d'âge
-    mt_counts = pd.DataFrame(columns=['Age Group', 'Body Part', 'Gender', 'Animal Type', 'MT Count'])
-
-    # Remplir le tableau mt_counts
-    for part, column in body_parts.items():
-        for gender in ipm['sexe'].dropna().unique():
-            for animal_type in ipm['typanim'].dropna().unique():
-                    part_counts = ipm[(ipm[column] == 'MT') & (ipm['sexe'] == gender) & (ipm['typanim'] == animal_type)].groupby('Age Group').size().reset_index(name='MT Count')
-                    part_counts['Body Part'] = part
-                    part_counts['Gender'] = gender
-                    part_counts['Animal Type'] = animal_type
-                    mt_counts = pd.concat([mt_counts, part_counts], ignore_index=True)
+    # Nombre de MT par partie du corps, genre, groupe d'âge et type d'animal
+    mt_counts = contact_counts(cube, 'MT', ['Body Part', 'sexe', 'typanim', 'Age Group'])
+    mt_counts = mt_counts.rename(columns={'sexe': 'Gender', 'typanim': 'Animal Type', 'count': 'MT Count'})
+    mt_counts['Animal Type'] = mt_counts['Animal Type'].astype(object).map(animal_type_mapping)
+    mt_counts = mt_counts.dropna(subset=['Animal Type'])
 
     # Visualisation
     gender_icons = {'M': '♂', 'F': '♀'}
@@ -143,39 +120,15 @@ def plot_MT_ipm(ipm):
     fig2.update_yaxes(tickfont=dict(size=10))
     fig2.update_yaxes(automargin=True)
 
-    st.plotly_chart(fig2)
-
-
+    return fig2
 
-def plot_MT_peripheral(df):
 
-    bins = list(range(0, 105, 5)) + [float('inf')]
-    labels = [f'{i}-{i+4}' for i in bins[:-2]] + ['100+']
-    age_groups = pd.cut(df['age'], bins=bins, labels=labels, right=False)
-    df['Age Group'] = age_groups
-
-    
-    body_parts = {
-            'Tête et Cou': 'singes_des_legions___1',
-            'Bras et Avant-bras': 'singes_des_legions___2',
-            'Main': 'singes_des_legions___3',
-            'Cuisse et Jambe': 'singes_des_legions___4',
-            'Pied': 'singes_des_legions___5',
-            'Autres': 'singes_des_legions___9',
-            'Dos et Torse': 'singes_des_legions___6',
-            'Parties génitales': 'singes_des_legions___7'
-        }
 
-    
-    mt_counts = pd.DataFrame(columns=['Age Group', 'Body Part', 'Gender', 'MT Count'])
+def plot_MT_peripheral(cube, **filters):
 
-    # Remplir le tableau mt_couts
-    for part, column in body_parts.items():
-            for gender in df['sexe'].dropna().unique():
-                part_counts = df[(df[column] == 1) & (df.type_contact___5== 1)& (df['sexe'] == gender)].groupby('Age Group').size().reset_index(name='MT Count')
-                part_counts['Body Part'] = part
-                part_counts['Gender'] = gender
-                mt_counts = pd.concat([mt_counts, part_counts], ignore_index=True)
+    # Nombre de MT par partie du corps, genre et groupe d'âge, lu dans le cube des contacts
+    mt_counts = contact_counts(cube, 'MT', ['Body Part', 'sexe', 'Age Group'], **filters)
+    mt_counts = mt_counts.rename(columns={'sexe': 'Gender', 'count': 'MT Count'})
 
     # Visualisation
     fig = px.bar(
@@ -206,20 +159,14 @@ def plot_MT_peripheral(df):
             margin=dict(b=100) 
         )
 
-    st.plotly_chart(fig)
+    return fig
 
-     
-    mt_counts = pd.DataFrame(columns=['Age Group', 'Body Part', 'Gender', 'Animal Type', 'MT Count'])
-    df = df[~df['dev_carac'].astype(str).str.contains('nan-nan|nan-|nan-|-nan', regex=True)]
 
-    for part, column in body_parts.items():
-        for gender in df['sexe'].dropna().unique():
-            for animal_type in df['dev_carac'].dropna().unique():
-                    part_counts = df[(df[column] == 1) & (df.type_contact___5== 1) & (df['sexe'] == gender) & (df['dev_carac'] == animal_type)].groupby('Age Group').size().reset_index(name='MT Count')
-                    part_counts['Body Part'] = part
-                    part_counts['Gender'] = gender
-                    part_counts['Animal Type'] = animal_type
-                    mt_counts = pd.concat([mt_counts, part_counts], ignore_index=True)
+def plot_MT_peripheral_animal(cube, **filters):
+
+    mt_counts = contact_counts(cube, 'MT', ['Body Part', 'sexe', 'dev_carac', 'Age Group'], **filters)
+    mt_counts = mt_counts.rename(columns={'sexe': 'Gender', 'dev_carac': 'Animal Type', 'count': 'MT Count'})
+    mt_counts = mt_counts[~mt_counts['Animal Type'].astype(str).str.contains('nan-nan|nan-|nan-|-nan', regex=True)]
 
     gender_icons = {'M': 'M', 'F': 'F'}
     mt_counts['Gender'] = mt_counts['Gender'].map(gender_icons)
@@ -243,7 +190,7 @@ def plot_MT_peripheral(df):
             },
             category_orders={
                 'Gender': ['M', 'F'], 
-                'Animal Type': sorted(df['dev_carac'].dropna().unique())  
+                'Animal Type': sorted(mt_counts['Animal Type'].unique())  
             }
         )
 
@@ -263,60 +210,60 @@ def plot_MT_peripheral(df):
     fig2.update_yaxes(tickfont=dict(size=10))
     fig2.update_yaxes(automargin=True)
 
-    st.plotly_chart(fig2)
+    return fig2
 
 
+def show_animal_section(key, build):
+    # Grille par type d'animal (1900 px) calculée et envoyée seulement quand la section est ouverte
+    lazy_section("MT par type d'animal, groupe d'âge, partie du corps et sexe",
+                 lambda: plotly_charts(key, build), key='mt_type_animal')
 
 
 # Main
-if 'dataframes' in st.session_state:
-    dataframes = st.session_state['dataframes']
+# Fichiers de la session (poignées vers le store partagé entre sessions)
+datasets = session_datasets()
+if datasets:
 
-    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(dataframes.keys()))
+    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(datasets.keys()))
 
     if selected_file:
-        df = dataframes[selected_file]
+        dataset = datasets[selected_file]
 
         # BDD IPM CTAR
-        if selected_file == "CTAR_ipmdata20022024_cleaned.csv":
-            plot_MT_ipm(df)
+        if dataset.schema_name == 'ipm':
+            # 1 patient = 1 ID ref_mordu (cube calculé une seule fois par fichier)
+            cube = ipm_contact_cube(dataset, ['Body Part', 'sexe', 'typanim', 'Age Group'])
+            plotly_charts(figure_key(dataset, 'MT'), lambda: plot_MT_ipm(cube))
+            show_animal_section(figure_key(dataset, 'MT animal'), lambda: plot_MT_ipm_animal(cube))
 
         # BDD CTAR périphériques
-        elif selected_file == "CTAR_peripheriquedata20022024_cleaned.csv":
-             #  Ne pas comptabiliser les lignes sans ID 'id_ctar' = CTAR périphériques inconnues 
-            df = df.dropna(subset=['id_ctar'])
-            df = df.dropna(subset=['date_de_consultation'])
+        elif dataset.schema_name == 'peripheral':
+             # BDD nettoyée une seule fois par fichier : lignes sans 'id_ctar' ou sans date exclues, années <= 2024
+            df = prepared_peripheral(dataset)
 
-            # Liste des CTARs périphériques pour leur sélection
+            # Liste des CTARs périphériques et des années pour leur sélection
             unique_ctars = df['id_ctar'].unique()
+            unique_year = df['Annee'].unique()
+            cube = peripheral_contact_cube(dataset, ['Body Part', 'sexe', 'dev_carac', 'Age Group'])
 
-            df['date_de_consultation']=pd.to_datetime(df['date_de_consultation'])
-
-            df['Annee'] = df['date_de_consultation'].dt.year
-            df['Annee']=df['Annee'].astype(int)
-            df=df[df['Annee']<=2024]
-            unique_year=df['Annee'].unique()
-
-            # Analyse de l'ensemble des CTAR périphériques
-            all_ctars_selected = st.checkbox("Sélectionnez tous les CTARs")
-            selected_year = st.multiselect(
-                    "Sélectionnez une ou plusieurs année(s)",
-                    options=sorted(list(unique_year)))
+            # Filtre CTARs / années de la sidebar, validé par « Appliquer » et partagé par les pages
+            all_ctars_selected, selected_ctars, selected_year = filter_form(unique_ctars, unique_year)
 
             if not all_ctars_selected:
-                selected_ctars = st.multiselect(
-                    "Sélectionnez un ou plusieurs CTARs",
-                    options=list(unique_ctars))
                 if not selected_ctars or not selected_year:
                     st.warning("Veuillez sélectionner au moins un CTAR et une année pour afficher l'analyse.")
                 else:
-                    df= df[df['id_ctar'].isin(selected_ctars)&df['Annee'].isin(selected_year)]
                     st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                    plot_MT_peripheral(df)
+                    plotly_charts(figure_key(dataset, 'MT', id_ctar=selected_ctars, Annee=selected_year),
+                                  lambda: plot_MT_peripheral(cube, id_ctar=selected_ctars, Annee=selected_year))
+                    show_animal_section(figure_key(dataset, 'MT animal', id_ctar=selected_ctars, Annee=selected_year),
+                                        lambda: plot_MT_peripheral_animal(cube, id_ctar=selected_ctars, Annee=selected_year))
             elif all_ctars_selected and selected_year:  
                 st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                df= df[df['Annee'].isin(selected_year)]
-                plot_MT_peripheral(df) 
+                plotly_charts(figure_key(dataset, 'MT', Annee=selected_year),
+                              lambda: plot_MT_peripheral(cube, Annee=selected_year))
+                show_animal_section(figure_key(dataset, 'MT animal', Annee=selected_year),
+                                    lambda: plot_MT_peripheral_animal(cube, Annee=selected_year))
             elif all_ctars_selected and not selected_year:
                 st.warning("Veuillez sélectionner au moins une année pour afficher l'analyse.")
            
@@ -327,4 +274,6 @@ else:
 
 # Sidebar de la page
 with st.sidebar.container():
-    st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
\ No newline at end of file
+    st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
+
+perf_panel('Morsure Transdermique')
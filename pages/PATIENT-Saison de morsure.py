@@ -1,127 +1,67 @@
 import streamlit as st
-import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
-import plotly.express as px
 import plotly.colors as pc
 
+from ctar.cube import cube_array, ipm_cube, peripheral_cube
+from ctar.figures import figure_key, plotly_charts
+from ctar.filters import filter_form
+from ctar.perf import perf_panel
+from ctar.prepare import prepared_peripheral
+from ctar.store import session_datasets
+
+# Colonnes utilisées par la page : seules les colonnes déclarées par les pages sont lues à l'ingestion
+COLUMNS = {
+    'ipm': ['mois', 'Annee', 'sexe'],
+    'peripheral': ['sexe'],
+}
+
 # Titre page
 st.set_page_config(page_title="Saison Morsure", page_icon="☀️")
 st.title("Affluence des patients par saison.")
 
 
- # Fonction saisons malgaches 
-def get_season(date):
-        if pd.isnull(date):
-            return None
-        if pd.Timestamp(year=date.year, month=9, day=15) <= date < pd.Timestamp(year=date.year, month=12, day=15):
-            return 'Lohataona (été)'
-        elif pd.Timestamp(year=date.year, month=12, day=15) <= date < pd.Timestamp(year=date.year+1, month=3, day=15):
-            return 'Fahavratra (pluie)'
-        elif pd.Timestamp(year=date.year, month=3, day=15) <= date < pd.Timestamp(year=date.year, month=6, day=15):
-            return 'Fararano (automne)'
-        else:
-            return 'Ritinina (hiver)'
-
-def plot_saison_morsure_ipm(ipm):
-     #1 ref_mordu=1 patient
-    ipm=ipm.drop_duplicates(subset=['ref_mordu'])
-
-    ipm['dat_consu'] = pd.to_datetime(ipm['dat_consu'], format='%d/%m/%Y', errors='coerce')
-
-    # Associer une saison à chaque date de consultation
-    ipm['season'] = ipm['dat_consu'].apply(get_season)
-
-    # Group by month, year, and sexe to count the number of patients for each sex
-    monthly_sex_counts = ipm.groupby(['mois', 'Annee', 'sexe']).size().reset_index(name='count')
-
-    months = list(range(1, 13)) 
-    month_names = [
-        'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
-        'Sep', 'Oct', 'Nov', 'Dec'
-    ]
-
-    # Ajuster le zoom du la visualisation
-    min_count = monthly_sex_counts['count'].min()
-    max_count = monthly_sex_counts['count'].max()
-    range_margin = (max_count - min_count) * 0.2  
-
-    fig = go.Figure()
-
-    male_colors = pc.sequential.Blues[::-1]  
-    female_colors = pc.sequential.Reds[::-1]  
-
-    years_sorted = sorted(monthly_sex_counts['Annee'].unique(), reverse=True)
+MONTHS = list(range(1, 13))
+MONTH_NAMES = [
+    'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
+    'Sep', 'Oct', 'Nov', 'Dec'
+]
 
-    sexes = ['M', 'F']
-    for i, year in enumerate(years_sorted):
-        for j, sex in enumerate(sexes):
-            df_year_sex = monthly_sex_counts[(monthly_sex_counts['Annee'] == year) & (monthly_sex_counts['sexe'] == sex)]
-            df_year_sex = df_year_sex.set_index('mois').reindex(months).reset_index()
-            df_year_sex['count'] = df_year_sex['count'].fillna(0)
-            
-            # Determine color based on gender
-            if sex == 'M':
-                color = male_colors[i % len(male_colors)]
-            else:
-                color = female_colors[i % len(female_colors)]
+# Saison : (mois de début, mois de fin, couleur du fond, couleur du texte)
+SEASON_BACKGROUNDS = {
+    'Fahavratra (pluie)': (12, 3, 'rgba(186, 225, 255, 0.3)', 'rgb(186, 225, 255)'),
+    'Fararano (automne)': (3.5, 6, 'rgba(255, 186, 186, 0.3)', 'rgb(255, 186, 186)'),
+    'Ritinina (hiver)': (6.5, 9, 'rgba(186, 255, 201, 0.3)', 'rgb(186, 255, 201)'),
+    'Lohataona (été)': (9.5, 11.5, 'rgba(255, 223, 186, 0.3)', 'rgb(255, 223, 186)')
+}
 
-            fig.add_trace(go.Scatter(
-                x=df_year_sex['mois'],
-                y=df_year_sex['count'],
-                mode='lines+markers',
-                name=f"{int(year)} - {'Homme' if sex == 'M' else 'Femme'}", 
-                marker=dict(size=8, color=color),  
-                line=dict(width=2),
-                visible="legendonly" if year < 2021 else True  
-            ))
-
-    season_backgrounds = {
-        'Fahavratra (pluie)': (12, 3, 'rgba(186, 225, 255, 0.3)', 'rgb(186, 225, 255)'),
-        'Fararano (automne)': (3.5, 6, 'rgba(255, 186, 186, 0.3)', 'rgb(255, 186, 186)'),
-        'Ritinina (hiver)': (6.5, 9, 'rgba(186, 255, 201, 0.3)', 'rgb(186, 255, 201)'),
-        'Lohataona (été)': (9.5, 11.5, 'rgba(255, 223, 186, 0.3)', 'rgb(255, 223, 186)')
-    }
 
+def season_backgrounds():
+    # Fonds et noms des saisons ; en hauteur, ils couvrent tout l'axe (coordonnées 'paper') et ne
+    # dépendent donc pas des données : calculés une seule fois pour toutes les figures
     shapes = []
     annotations = []
 
-    for season, (start_month, end_month, color, text_color) in season_backgrounds.items():
-        if end_month < start_month:
-            shapes.append(dict(
-                type='rect',
-                x0=start_month - 1,
-                x1=11,  
-                y0=min_count - range_margin,
-                y1=max_count + range_margin,
-                fillcolor=color,
-                line=dict(width=0),
-                layer='below'
-            ))
-            shapes.append(dict(
-                type='rect',
-                x0=1 - 1,  
-                x1=end_month - 0.5,
-                y0=min_count - range_margin,
-                y1=max_count + range_margin,
-                fillcolor=color,
-                line=dict(width=0),
-                layer='below'
-            ))
-        else:
+    for season, (start_month, end_month, color, text_color) in SEASON_BACKGROUNDS.items():
+        # Une saison à cheval sur deux années (décembre -> mars) occupe les deux bords de l'axe
+        spans = [(start_month, 12), (1, end_month + 0.5)] if end_month < start_month else [(start_month, end_month + 0.5)]
+        for x0, x1 in spans:
             shapes.append(dict(
                 type='rect',
-                x0=start_month - 1,
-                x1=end_month - 0.5,
-                y0=min_count - range_margin,
-                y1=max_count + range_margin,
+                x0=x0,
+                x1=x1,
+                yref='paper',
+                y0=0,
+                y1=1,
                 fillcolor=color,
                 line=dict(width=0),
                 layer='below'
             ))
 
         annotations.append(dict(
-            x=(start_month) / 10 if end_month < start_month else (start_month + end_month - 1) / 2,
-            y=min_count - range_margin,  
+            x=(start_month) / 10 + 1 if end_month < start_month else (start_month + end_month + 1) / 2,
+            yref='paper',
+            y=0,
             text=season,
             showarrow=False,
             font=dict(size=15, color=text_color),
@@ -129,54 +69,21 @@ def plot_saison_morsure_ipm(ipm):
             yanchor="bottom"
         ))
 
-    fig.update_layout(
-        shapes=shapes,
-        annotations=annotations,
-        xaxis=dict(
-            tickvals=months,
-            ticktext=month_names,
-            title='Mois',
-            type='category',
-            range=[-0.5, 12]  
-        ),
-        yaxis=dict(
-            title='Nombre de patients venus à IPM',
-            range=[min_count - range_margin, max_count + range_margin]  
-        ),
-        title={
-            'text': "Affluence des patients venus au CTAR IPM sur période saisonnière d'une année",
-            'x': 0.5,
-            'xanchor': 'center'
-        },
-        height=700,  
-        width=7400,  
-        legend_title='Légende'
-    )
-
-    fig.for_each_trace(lambda trace: trace.update(showlegend=False) if trace.name in season_backgrounds else None)
-
-
-    st.plotly_chart(fig, use_container_width=True)
-
-def plot_saison_peripheral(df):
+    return shapes, annotations
 
-    df['date_de_consultation']=pd.to_datetime(df['date_de_consultation'])
 
-    df['season'] = df['date_de_consultation'].apply(get_season)
-    df['mois'] = df['date_de_consultation'].dt.month
-    df['Annee'] = df['date_de_consultation'].dt.year
-    df=df[df['Annee']<=2024]
+SEASON_SHAPES, SEASON_ANNOTATIONS = season_backgrounds()
 
-    monthly_sex_counts = df.groupby(['mois', 'Annee', 'sexe']).size().reset_index(name='count')
 
-    months = list(range(1, 13)) 
-    month_names = [
-        'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug',
-        'Sep', 'Oct', 'Nov', 'Dec'
-    ]
+def plot_saison(values, axes, title, yaxis_title):
+    # `values[année, sexe, mois]` : tableau des patients dont chaque trace lit une ligne
+    observed = values[values > 0]
+    if not observed.size:
+        return None
 
-    min_count = monthly_sex_counts['count'].min()
-    max_count = monthly_sex_counts['count'].max()
+    # Ajuster le zoom du la visualisation
+    min_count = observed.min()
+    max_count = observed.max()
     range_margin = (max_count - min_count) * 0.2  
 
     fig = go.Figure()
@@ -184,149 +91,128 @@ def plot_saison_peripheral(df):
     male_colors = pc.sequential.Blues[::-1]  
     female_colors = pc.sequential.Reds[::-1]  
 
-    years_sorted = sorted(monthly_sex_counts['Annee'].unique(), reverse=True)
+    years = axes['Annee']
+    sexes = axes['sexe']
+    # Mois absents du tableau : 0 patient
+    months = axes['mois'].get_indexer(MONTHS)
+    monthly = np.where(months >= 0, values[:, :, months], 0)
 
-    sexes = ['M', 'F']
-    for i, year in enumerate(years_sorted):
-        for j, sex in enumerate(sexes):
-            df_year_sex = monthly_sex_counts[(monthly_sex_counts['Annee'] == year) & (monthly_sex_counts['sexe'] == sex)]
-            df_year_sex = df_year_sex.set_index('mois').reindex(months).reset_index()
-            df_year_sex['count'] = df_year_sex['count'].fillna(0)
-            
+    # Années les plus récentes d'abord
+    for i, y in enumerate(np.argsort(-years.to_numpy(), kind='stable')):
+        year = int(years[y])
+        for sex in ['M', 'F']:
+            # Determine color based on gender
             if sex == 'M':
                 color = male_colors[i % len(male_colors)]
             else:
                 color = female_colors[i % len(female_colors)]
 
+            # Trace allégée : abscisses implicites (x0, dx) et comptes en entiers compacts
+            counts = monthly[y, sexes.get_loc(sex)] if sex in sexes else np.zeros(len(MONTHS), dtype='int64')
             fig.add_trace(go.Scatter(
-                x=df_year_sex['mois'],
-                y=df_year_sex['count'],
+                x0=MONTHS[0],
+                dx=1,
+                y=counts.astype(np.min_scalar_type(int(counts.max()))),
                 mode='lines+markers',
-                name=f"{int(year)} - {'Homme' if sex == 'M' else 'Femme'}", 
-                marker=dict(size=8, color=color), 
+                name=f"{year} - {'Homme' if sex == 'M' else 'Femme'}", 
+                marker=dict(size=8, color=color),  
                 line=dict(width=2),
-                visible="legendonly" if year < 2021 else True  
-            ))
-
-    season_backgrounds = {
-        'Fahavratra (pluie)': (12, 3, 'rgba(186, 225, 255, 0.3)', 'rgb(186, 225, 255)'),
-        'Fararano (automne)': (3.5, 6, 'rgba(255, 186, 186, 0.3)', 'rgb(255, 186, 186)'),
-        'Ritinina (hiver)': (6.5, 9, 'rgba(186, 255, 201, 0.3)', 'rgb(186, 255, 201)'),
-        'Lohataona (été)': (9.5, 11.5, 'rgba(255, 223, 186, 0.3)', 'rgb(255, 223, 186)')
-    }
-
-    shapes = []
-    annotations = []
-
-    for season, (start_month, end_month, color, text_color) in season_backgrounds.items():
-        if end_month < start_month:
-            shapes.append(dict(
-                type='rect',
-                x0=start_month - 1,
-                x1=11,  
-                y0=min_count - range_margin,
-                y1=max_count + range_margin,
-                fillcolor=color,
-                line=dict(width=0),
-                layer='below'
-            ))
-            shapes.append(dict(
-                type='rect',
-                x0=1 - 1, 
-                x1=end_month - 0.5,
-                y0=min_count - range_margin,
-                y1=max_count + range_margin,
-                fillcolor=color,
-                line=dict(width=0),
-                layer='below'
-            ))
-        else:
-            shapes.append(dict(
-                type='rect',
-                x0=start_month - 1,
-                x1=end_month - 0.5,
-                y0=min_count - range_margin,
-                y1=max_count + range_margin,
-                fillcolor=color,
-                line=dict(width=0),
-                layer='below'
+                visible="legendonly" if year < 2021 else None
             ))
 
-        annotations.append(dict(
-            x=(start_month) / 10 if end_month < start_month else (start_month + end_month - 1) / 2,
-            y=min_count - range_margin,  
-            text=season,
-            showarrow=False,
-            font=dict(size=15, color=text_color),
-            xanchor="center",
-            yanchor="bottom"
-        ))
-
     fig.update_layout(
-        shapes=shapes,
-        annotations=annotations,
+        shapes=SEASON_SHAPES,
+        annotations=SEASON_ANNOTATIONS,
         xaxis=dict(
-            tickvals=months,
-            ticktext=month_names,
+            tickvals=MONTHS,
+            ticktext=MONTH_NAMES,
             title='Mois',
-            type='category',
-            range=[-0.5, 12]  
+            range=[0.5, 13]  
         ),
         yaxis=dict(
-            title='Nombre de patients venus au CTAR',
+            title=yaxis_title,
             range=[min_count - range_margin, max_count + range_margin]  
         ),
         title={
-            'text': "Affluence des patients venus au CTAR périphérique sur période saisonnière d'une année",
+            'text': title,
             'x': 0.5,
             'xanchor': 'center'
         },
-        height=700, 
+        height=700,  
         width=7400,  
         legend_title='Légende'
     )
 
-    fig.for_each_trace(lambda trace: trace.update(showlegend=False) if trace.name in season_backgrounds else None)
+    return fig
+
+
+def plot_saison_morsure_ipm(pivot):
+    # Tableau (année, sexe, mois) des patients IPM, calculé une fois par fichier
+    return plot_saison(*pivot, "Affluence des patients venus au CTAR IPM sur période saisonnière d'une année",
+                       'Nombre de patients venus à IPM')
 
 
-    st.plotly_chart(fig, use_container_width=True)
+def plot_saison_peripheral(pivot, selected_ctars=None):
+    # Tableau (CTAR, année, sexe, mois) : une sélection de CTARs est une somme sur le premier axe
+    values, axes = pivot
+    if selected_ctars is not None:
+        values = values[axes['id_ctar'].isin(selected_ctars)]
+    return plot_saison(values.sum(axis=0), axes,
+                       "Affluence des patients venus au CTAR périphérique sur période saisonnière d'une année",
+                       'Nombre de patients venus au CTAR')
+
+
+def ipm_pivot(dataset):
+    return dataset.derived(('tableau', 'saison'),
+                           lambda _: cube_array(ipm_cube(dataset, ['Annee', 'sexe', 'mois']), ['Annee', 'sexe', 'mois']))
+
+
+def peripheral_pivot(dataset):
+    # Reconstruit depuis le cube (lui-même mis à jour) après un upsert
+    return dataset.derived(('tableau', 'saison'), lambda _: cube_array(
+        peripheral_cube(dataset, ['mois', 'sexe']), ['id_ctar', 'Annee', 'sexe', 'mois']))
+
 
 # Main
-if 'dataframes' in st.session_state:
-    dataframes = st.session_state['dataframes']
+# Fichiers de la session (poignées vers le store partagé entre sessions)
+datasets = session_datasets()
+if datasets:
 
-    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(dataframes.keys()))
+    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(datasets.keys()))
 
     if selected_file:
-        df = dataframes[selected_file]
+        dataset = datasets[selected_file]
 
         # BDD CTAR IPM 
-        if selected_file == "CTAR_ipmdata20022024_cleaned.csv":
+        if dataset.schema_name == 'ipm':
             st.info("Cliquez sur agrandir l'image en haut à droite.")
-            plot_saison_morsure_ipm(df)
+            # 1 patient = 1 ID ref_mordu (tableau calculé une seule fois par fichier)
+            plotly_charts(figure_key(dataset, 'Saison'), lambda: plot_saison_morsure_ipm(ipm_pivot(dataset)), use_container_width=True)
 
         # BDD CTAR périphérique
-        elif selected_file == "CTAR_peripheriquedata20022024_cleaned.csv":
+        elif dataset.schema_name == 'peripheral':
 
-            df = df.dropna(subset=['id_ctar'])
+            # BDD nettoyée une seule fois par fichier : lignes sans 'id_ctar' ou sans date exclues, années <= 2024
+            df = prepared_peripheral(dataset)
 
             # Liste des CTARs périphériques pour leur sélection
             unique_ctars = df['id_ctar'].unique()
+            pivot = peripheral_pivot(dataset)
 
-            # Analyse de l'ensemble des CTAR périphériques
-            all_ctars_selected = st.checkbox("Sélectionnez tous les CTARs")
+            # Filtre CTARs de la sidebar, validé par « Appliquer » et partagé par les pages
+            all_ctars_selected, selected_ctars, _ = filter_form(unique_ctars)
 
             if not all_ctars_selected:
-                selected_ctars = st.multiselect(
-                    "Sélectionnez un ou plusieurs CTARs",
-                    options=list(unique_ctars))
                 if not selected_ctars:
                     st.warning("Veuillez sélectionner au moins un CTAR pour afficher l'analyse.")
                 else:
-                    df= df[df['id_ctar'].isin(selected_ctars)]
-                    plot_saison_peripheral(df)
+                    plotly_charts(figure_key(dataset, 'Saison', id_ctar=selected_ctars),
+                                  lambda: plot_saison_peripheral(pivot, selected_ctars),
+                                  use_container_width=True)
             elif all_ctars_selected:  
-                plot_saison_peripheral(df)
+                plotly_charts(figure_key(dataset, 'Saison'),
+                              lambda: plot_saison_peripheral(pivot),
+                              use_container_width=True)
            
 
 else:
@@ -335,4 +221,6 @@ else:
 
 # Sidebar de la page
 with st.sidebar.container():
-    st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
\ No newline at end of file
+    st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
+
+perf_panel('Saison de morsure')
@@ -2,31 +2,46 @@ import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
 
+from ctar.cube import cube_slice, ipm_cube, peripheral_cube
+from ctar.figures import figure_key, plotly_charts
+from ctar.filters import filter_form
+from ctar.perf import perf_panel
+from ctar.prepare import prepared_peripheral
+from ctar.proportions import stratified_proportions
+from ctar.store import session_datasets
+
+# Colonnes utilisées par la page : seules les colonnes déclarées par les pages sont lues à l'ingestion
+COLUMNS = {
+    'ipm': ['age', 'sexe', 'savon'],
+    'peripheral': ['age', 'sexe', 'lavage_savon'],
+}
+
 # Titre page
 st.set_page_config(page_title="Utilisation Savon", page_icon="🧼")
 st.title("Lavage au savon sur plaie.")
 
-def plot_age_sex_savon_distribution(ipm):
-    # 1ref_mordu = 1 patient
-    ipm=ipm.drop_duplicates(subset=['ref_mordu'])
+def percentage_hover(data):
+    # Survol des barres : effectif, part de l'âge dans son groupe (sexe, savon) et intervalle de Wilson à 95 %
+    return dict(
+        customdata=data[['percentage', 'ci_low', 'ci_high']].to_numpy(),
+        hovertemplate='Âge %{x} : %{y} patient(s)<br>%{customdata[0]:.2f} % du groupe '
+                      '(IC 95 % : %{customdata[1]:.2f} - %{customdata[2]:.2f})',
+    )
+
+def plot_age_sex_savon_distribution(counts):
+    # Nombre de patients par (age, sexe, savon), lu dans le cube de comptage
+    ipmm = counts.reset_index(name='count')
     # Convert 'age' column to numeric, coerce errors to NaN
-    ipm['age'] = pd.to_numeric(ipm['age'], errors='coerce')
+    ipmm['age'] = pd.to_numeric(ipmm['age'], errors='coerce')
 
-    ipmm = ipm.dropna(subset=['age'])
+    ipmm = ipmm.dropna(subset=['age', 'sexe', 'savon'])
     ipmm=ipmm[ipmm.age>0]
 
-    not_null_pairs = ipmm[['age', 'sexe', 'savon']].notnull().all(axis=1).sum()
-
-    age_sex_savon_counts = ipmm.groupby(['age', 'sexe', 'savon']).size().reset_index(name='count')
+    # Effectifs et part de chaque âge parmi les patients de même sexe et même lavage au savon
+    age_sex_savon_counts = stratified_proportions(ipmm, ['age', 'sexe', 'savon'], ['sexe', 'savon'])
+    not_null_pairs = age_sex_savon_counts['count'].sum()
     age_sex_savon_counts = age_sex_savon_counts.sort_values(by='age')
 
-    total_counts = age_sex_savon_counts.groupby(['sexe', 'savon'])['count'].sum()
-
-    age_sex_savon_counts['percentage'] = age_sex_savon_counts.apply(
-        lambda row: round((row['count'] / total_counts[row['sexe'], row['savon']]) * 100, 2)
-        if total_counts[row['sexe'], row['savon']] != 0 else 0, axis=1
-    )
-
     color_palette = {
         ('M', 'OUI'): 'rgba(50, 171, 96, 0.6)',   
         ('M', 'NON'): 'rgba(50, 171, 96, 0.9)',   
@@ -36,32 +51,22 @@ def plot_age_sex_savon_distribution(ipm):
 
     fig = go.Figure()
 
+    # Lignes de chaque groupe (sexe, savon) en un seul groupby, triées par âge
+    groups = dict(list(age_sex_savon_counts.groupby(['sexe', 'savon'], observed=True)))
+
     for sex in age_sex_savon_counts['sexe'].unique():
-        data_oui = age_sex_savon_counts[(age_sex_savon_counts['sexe'] == sex) & (age_sex_savon_counts['savon'] == 'OUI')]
-        data_non = age_sex_savon_counts[(age_sex_savon_counts['sexe'] == sex) & (age_sex_savon_counts['savon'] == 'NON')]
-        
-        data_oui = data_oui.sort_values(by='age')
-        data_non = data_non.sort_values(by='age')
-        
-        if not data_oui.empty:
-            fig.add_trace(go.Bar(
-                x=data_oui['age'],
-                y=data_oui['count'],
-                name=f'{sex} - Savon: OUI',
-                marker_color=color_palette[(sex, 'OUI')],
-                base=0,  
-                offsetgroup=sex,
-            ))
-        
-        if not data_non.empty:
-            fig.add_trace(go.Bar(
-                x=data_non['age'],
-                y=data_non['count'],
-                name=f'{sex} - Savon: NON',
-                marker_color=color_palette[(sex, 'NON')],
-                base=0,  
-                offsetgroup=sex,
-            ))
+        for savon in ('OUI', 'NON'):
+            data = groups.get((sex, savon))
+            if data is not None:
+                fig.add_trace(go.Bar(
+                    x=data['age'],
+                    y=data['count'],
+                    name=f'{sex} - Savon: {savon}',
+                    marker_color=color_palette[(sex, savon)],
+                    base=0,  
+                    offsetgroup=sex,
+                    **percentage_hover(data),
+                ))
 
   
     fig.update_layout(
@@ -79,11 +84,11 @@ def plot_age_sex_savon_distribution(ipm):
         )
     )
 
-    st.plotly_chart(fig)
+    return fig
 
-def plot_peripheral_data(df):
-    
-    peripheral_data = df[['sexe', 'age', 'lavage_savon']]
+def plot_peripheral_data(counts):
+    # Nombre de patients par (age, sexe, lavage_savon), lu dans le cube de comptage
+    peripheral_data = counts.reset_index(name='count')
 
     peripheral_data = peripheral_data[peripheral_data['lavage_savon'] != 'Non rempli']
 
@@ -92,9 +97,11 @@ def plot_peripheral_data(df):
 
     peripheral_data = peripheral_data.dropna(subset=['age'])
 
-    num_patients = peripheral_data.shape[0]
+    num_patients = peripheral_data['count'].sum()
 
-    age_sex_savon_counts = peripheral_data.groupby(['age', 'sexe', 'lavage_savon']).size().reset_index(name='count')
+    # Effectifs et part de chaque âge parmi les patients de même sexe et même lavage au savon
+    age_sex_savon_counts = stratified_proportions(
+        peripheral_data, ['age', 'sexe', 'lavage_savon'], ['sexe', 'lavage_savon'])
 
     age_sex_savon_counts = age_sex_savon_counts.sort_values(by='age')
 
@@ -107,19 +114,17 @@ def plot_peripheral_data(df):
 
     fig = go.Figure()
 
-    for sex in age_sex_savon_counts['sexe'].unique():
-        for savon in age_sex_savon_counts['lavage_savon'].unique():
-            data = age_sex_savon_counts[(age_sex_savon_counts['sexe'] == sex) & (age_sex_savon_counts['lavage_savon'] == savon)]
-            
-            if not data.empty:
-                fig.add_trace(go.Bar(
-                    x=data['age'],
-                    y=data['count'],
-                    name=f'{sex} - Savon: {savon}',
-                    marker_color=color_palette[(sex, savon)],
-                    base=0,  
-                    offsetgroup=sex,
-                ))
+    # Une trace par groupe (sexe, lavage_savon), dans l'ordre d'apparition
+    for (sex, savon), data in age_sex_savon_counts.groupby(['sexe', 'lavage_savon'], observed=True, sort=False):
+        fig.add_trace(go.Bar(
+            x=data['age'],
+            y=data['count'],
+            name=f'{sex} - Savon: {savon}',
+            marker_color=color_palette[(sex, savon)],
+            base=0,  
+            offsetgroup=sex,
+            **percentage_hover(data),
+        ))
 
     fig.update_layout(
         barmode='stack',
@@ -137,60 +142,52 @@ def plot_peripheral_data(df):
     )
 
     if num_patients>1:
-        return(st.plotly_chart(fig))
-    else:
-        return(st.info('Données indisponibles pour ce CTAR périphérique.'))
+        return fig
 
-# Main
-if 'dataframes' in st.session_state:
+def show_peripheral_data(dataset, cube, **filters):
+    # Figure mise en cache par sélection ; sans figure, les données du CTAR sont indisponibles
+    if not plotly_charts(figure_key(dataset, 'Savon', **filters),
+                         lambda: plot_peripheral_data(cube_slice(cube, ['age', 'sexe', 'lavage_savon'], **filters))):
+        st.info('Données indisponibles pour ce CTAR périphérique.')
 
-    dataframes = st.session_state['dataframes']
+# Main
+# Fichiers de la session (poignées vers le store partagé entre sessions)
+datasets = session_datasets()
+if datasets:
 
-    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(dataframes.keys()))
+    selected_file = st.selectbox("Sélectionnez un fichier pour l'analyse", options=list(datasets.keys()))
 
     if selected_file:
-        df = dataframes[selected_file]
+        dataset = datasets[selected_file]
 
         # BDD CTAR IPM
-        if selected_file == "CTAR_ipmdata20022024_cleaned.csv":
-            plot_age_sex_savon_distribution(df)
+        if dataset.schema_name == 'ipm':
+            # 1 patient = 1 ID ref_mordu (cube calculé une seule fois par fichier)
+            plotly_charts(figure_key(dataset, 'Savon'),
+                          lambda: plot_age_sex_savon_distribution(ipm_cube(dataset, ['age', 'sexe', 'savon'])))
 
         # BDD CTAR périphérique
-        elif selected_file == "CTAR_peripheriquedata20022024_cleaned.csv":
-             #  Ne pas comptabiliser les lignes sans ID 'id_ctar' = CTAR périphériques inconnues 
-            df = df.dropna(subset=['id_ctar'])
-            df = df.dropna(subset=['date_de_consultation'])
+        elif dataset.schema_name == 'peripheral':
+             # BDD nettoyée une seule fois par fichier : lignes sans 'id_ctar' ou sans date exclues, années <= 2024
+            df = prepared_peripheral(dataset)
 
-            # Liste des CTARs périphériques pour leur sélection
+            # Liste des CTARs périphériques et des années pour leur sélection
             unique_ctars = df['id_ctar'].unique()
+            unique_year = df['Annee'].unique()
+            cube = peripheral_cube(dataset, ['age', 'sexe', 'lavage_savon'])
 
-            df['date_de_consultation']=pd.to_datetime(df['date_de_consultation'])
-
-            df['Annee'] = df['date_de_consultation'].dt.year
-            df['Annee']=df['Annee'].astype(int)
-            df=df[df['Annee']<=2024]
-            unique_year=df['Annee'].unique()
-
-            # Analyse de l'ensemble des CTAR périphériques
-            all_ctars_selected = st.checkbox("Sélectionnez tous les CTARs")
-            selected_year = st.multiselect(
-                    "Sélectionnez une ou plusieurs année(s)",
-                    options=sorted(list(unique_year)))
+            # Filtre CTARs / années de la sidebar, validé par « Appliquer » et partagé par les pages
+            all_ctars_selected, selected_ctars, selected_year = filter_form(unique_ctars, unique_year)
 
             if not all_ctars_selected:
-                selected_ctars = st.multiselect(
-                    "Sélectionnez un ou plusieurs CTARs",
-                    options=list(unique_ctars))
                 if not selected_ctars or not selected_year:
                     st.warning("Veuillez sélectionner au moins un CTAR et une année pour afficher l'analyse.")
                 else:
-                    df= df[df['id_ctar'].isin(selected_ctars)&df['Annee'].isin(selected_year)]
                     st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                    plot_peripheral_data(df)
+                    show_peripheral_data(dataset, cube, id_ctar=selected_ctars, Annee=selected_year)
             elif all_ctars_selected and selected_year:  
                 st.info("Cliquez sur agrandir l'image en haut à droite du graphique.")
-                df= df[df['Annee'].isin(selected_year)]
-                plot_peripheral_data(df) 
+                show_peripheral_data(dataset, cube, Annee=selected_year)
             elif all_ctars_selected and not selected_year:
                 st.warning("Veuillez sélectionner au moins une année pour afficher l'analyse.")
            
@@ -201,4 +198,6 @@ else:
 
 # Sidebar de la page
 with st.sidebar.container():
-    st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
\ No newline at end of file
+    st.image("Logo-CORAMAD.jpg", use_column_width=True, width=250, caption="FSPI Rage")
+
+perf_panel('Utilisation savon sur plaie')
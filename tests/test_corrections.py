@@ -0,0 +1,41 @@
+import pandas as pd
+
+from bench.generate import generate
+from ctar.corrections import apply_corrections
+from ctar.ingestion import CSV_ENCODING, parse_csv
+from ctar.schema import SCHEMAS
+
+
+def test_non_numeric_lesion_count_becomes_missing():
+    raw = generate('peripheral', scale=0.01, seed=1)
+    raw.loc[3, 'nb_lesion'] = 'plusieurs'
+    raw.loc[4, 'nb_lesion'] = '052'
+    frame = parse_csv(raw.to_csv(index=False).encode(CSV_ENCODING), SCHEMAS['peripheral'])
+    assert isinstance(frame['nb_lesion'].dtype, pd.CategoricalDtype)
+
+    frame, audit = apply_corrections(frame, SCHEMAS['peripheral'])
+
+    assert pd.api.types.is_integer_dtype(frame['nb_lesion'].dtype)
+    assert pd.isna(frame['nb_lesion'].iloc[3]) and frame['nb_lesion'].iloc[4] == 52
+    missing = audit[audit['après'].isna()]
+    assert missing['avant'].tolist() == ['plusieurs']
+
+
+def test_record_correction_skipped_when_current_value_differs():
+    rules = [{
+        'schema': 'peripheral',
+        'column': 'ctar',
+        'check': 'id_ctar',
+        'records': {1: ('Morondava', 'Morondava'), 2: ('Antsohihy', 'Antsohihy')},
+        'reason': 'Nom du CTAR corrigé',
+    }]
+    frame = pd.DataFrame({
+        'record_id': [1, 2, 3],
+        'id_ctar': pd.Categorical(['Morondava', 'Toliara', 'Toliara']),
+        'ctar': pd.Categorical(['Morondav', 'Toliara', 'Toliara']),
+    })
+
+    frame, audit = apply_corrections(frame, SCHEMAS['peripheral'], rules)
+
+    assert frame['ctar'].tolist() == ['Morondava', 'Toliara', 'Toliara']
+    assert audit.set_index('enregistrement')['appliquée'].to_dict() == {1: True, 2: False}
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from bench.generate import generate
+from ctar import ingestion
+from ctar.ingestion import CSV_ENCODING, parse_csv
+from ctar.schema import SCHEMAS
+
+
+def _csv(frame):
+    return frame.to_csv(index=False).encode(CSV_ENCODING)
+
+
+def test_chunked_read_with_column_empty_in_one_chunk(monkeypatch):
+    raw = generate('ipm', scale=0.01, seed=1)
+    raw['geni_cont'] = raw['geni_cont'].astype(object)
+    raw.loc[:49, 'geni_cont'] = None
+    data = _csv(raw)
+
+    whole = parse_csv(data, SCHEMAS['ipm'])
+    monkeypatch.setattr(ingestion, 'CSV_CHUNK_ROWS', 50)
+    chunked = parse_csv(data, SCHEMAS['ipm'])
+
+    assert isinstance(chunked['geni_cont'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(chunked, whole)
+
+
+def test_numeric_fallback_applies_to_every_chunk(monkeypatch):
+    raw = generate('ipm', scale=0.01, seed=1)
+    raw['age'] = raw['age'].astype(object)
+    raw.loc[120, 'age'] = 'INCONNU'
+    monkeypatch.setattr(ingestion, 'CSV_CHUNK_ROWS', 50)
+    frame = parse_csv(_csv(raw), SCHEMAS['ipm'])
+
+    assert isinstance(frame['age'].dtype, pd.CategoricalDtype)
+    assert all(isinstance(value, str) for value in frame['age'].cat.categories)
+    assert frame['age'].iloc[0] == str(raw['age'].iloc[0])
@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from bench.generate import generate
+from ctar import snapshot
+from ctar.contacts import ipm_contact_cube, peripheral_contact_cube
+from ctar.cube import ipm_cube, peripheral_cube
+from ctar.ingestion import CSV_ENCODING, load_bytes, upsert_dataset
+from ctar.prepare import ipm_patients, prepared_peripheral
+from ctar.schema import SCHEMAS
+
+# Colonne catégorielle vide dans le fichier ajouté (catégories vides de type object)
+EMPTY_COLUMNS = {'ipm': 'geni_cont', 'peripheral': 'lavage_savon'}
+
+
+def _derived(kind, dataset):
+    if kind == 'ipm':
+        return [
+            ipm_patients(dataset).reset_index(drop=True),
+            ipm_cube(dataset, ['age', 'sexe']),
+            ipm_cube(dataset, ['animal', 'typanim']),
+            ipm_contact_cube(dataset, ['Body Part', 'Age Group']),
+        ]
+    return [
+        prepared_peripheral(dataset).reset_index(drop=True),
+        peripheral_cube(dataset, ['age', 'sexe']),
+        peripheral_cube(dataset, ['mois', 'sexe']),
+        peripheral_contact_cube(dataset, ['Body Part', 'sexe', 'dev_carac', 'Age Group']),
+    ]
+
+
+def _assert_equal(result, expected):
+    if isinstance(expected, pd.Series):
+        pd.testing.assert_series_equal(result, expected)
+    else:
+        pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize('kind', ['ipm', 'peripheral'])
+def test_incremental_upsert_matches_full_rebuild(kind, monkeypatch, tmp_path):
+    monkeypatch.setattr(snapshot, 'SNAPSHOT_DIR', str(tmp_path))
+    record_key = SCHEMAS[kind]['record_key']
+    raw = generate(kind, scale=0.05, seed=2)
+    base_raw = raw.iloc[:-200]
+    # Nouveaux enregistrements et enregistrements déjà présents, modifiés
+    delta_raw = pd.concat([raw.iloc[-200:], base_raw.sample(50, random_state=1).assign(age=7)])
+    delta_raw[EMPTY_COLUMNS[kind]] = None
+    merged_raw = pd.concat([base_raw[~base_raw[record_key].isin(delta_raw[record_key])], delta_raw])
+
+    def load(name, frame):
+        return load_bytes(name, frame.to_csv(index=False).encode(CSV_ENCODING))
+
+    base = load('base.csv', base_raw)
+    _derived(kind, base)
+    merged = upsert_dataset(base, load('delta.csv', delta_raw))
+    rebuilt = load('complet.csv', merged_raw)
+
+    pd.testing.assert_frame_equal(merged.frame.reset_index(drop=True), rebuilt.frame.reset_index(drop=True))
+    for result, expected in zip(_derived(kind, merged), _derived(kind, rebuilt)):
+        _assert_equal(result, expected)